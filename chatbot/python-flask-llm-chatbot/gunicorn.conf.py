@@ -0,0 +1,44 @@
+"""
+Configuração do gunicorn para produção.
+
+Uso, a partir de chatbot/python-flask-llm-chatbot:
+    gunicorn -c gunicorn.conf.py
+
+O app é criado uma vez no processo mestre (preload_app) sem threads nem conexões abertas;
+cada worker, após o fork, recria o pool HTTP do Ollama e inicia as próprias threads de
+segundo plano (ver app.init_worker). O MongoClient é criado com connect=False e só conecta
+dentro de cada worker.
+"""
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+pythonpath = "src"
+wsgi_app = "app:create_app(start_background=False)"
+preload_app = True
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+# Workers com threads: cada chamada ao LLM bloqueia uma thread por vários segundos (e cada tela do
+# KDS mantém uma conexão SSE aberta), enquanto o worker segue respondendo às demais requisições.
+worker_class = "gthread"
+# As sessões em memória ficam no processo que as criou: com elas, só um worker é aceito.
+SESSIONS_SHARED = os.getenv("SESSION_BACKEND", "memory") == "mongo"
+workers = int(os.getenv("GUNICORN_WORKERS", 2 if SESSIONS_SHARED else 1)) # Mais de um exige SESSION_BACKEND=mongo
+threads = int(os.getenv("GUNICORN_THREADS", 32)) # Requisições simultâneas por worker (LLM e SSE incluídos)
+# Tempo sem sinal de vida do worker antes de reiniciá-lo; no gthread, requisições longas não contam.
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 30)) # Espera pelas requisições em andamento ao parar
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+accesslog = os.getenv("GUNICORN_ACCESS_LOG") or None # Ex.: "-" para a saída padrão
+
+if workers > 1 and not SESSIONS_SHARED:
+    raise RuntimeError(
+        f"GUNICORN_WORKERS={workers} com SESSION_BACKEND em memória: cada worker teria as próprias sessões "
+        "e o carrinho se perderia entre requisições. Use SESSION_BACKEND=mongo ou um único worker."
+    )
+
+
+def post_fork(server, worker):
+    import app
+    app.init_worker()
@@ -0,0 +1,131 @@
+import copy
+import threading
+from bson.objectid import ObjectId
+from pymongo.errors import BulkWriteError, OperationFailure
+from pymongo.results import InsertManyResult, InsertOneResult
+
+# Mesmo código do mongod standalone: o feed do KDS passa a usar a publicação local.
+CHANGE_STREAM_NOT_SUPPORTED = 40573
+DUPLICATE_KEY_ERROR = 11000
+
+
+class MemoryMongoClient:
+    """
+    Substituto em memória do MongoClient para o teste de carga.
+
+    Implementa apenas as operações usadas no caminho do /chat (cardápio, pedidos e índices);
+    os filtros aceitam somente igualdade em campos do primeiro nível.
+    """
+    def __init__(self, *args, **kwargs):
+        self._databases = {}
+        self._lock = threading.Lock()
+        self.admin = self
+
+    def command(self, name, *args, **kwargs):
+        return {"ok": 1.0}
+
+    def get_database(self, name):
+        with self._lock:
+            return self._databases.setdefault(name, MemoryDatabase(name))
+
+    def __getitem__(self, name):
+        return self.get_database(name)
+
+    def close(self):
+        pass
+
+
+class MemoryDatabase:
+    def __init__(self, name):
+        self.name = name
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def get_collection(self, name):
+        with self._lock:
+            return self._collections.setdefault(name, MemoryCollection(name))
+
+    def __getitem__(self, name):
+        return self.get_collection(name)
+
+
+class MemoryCollection:
+    def __init__(self, name):
+        self.name = name
+        self._documents = {} # {_id: documento}, na ordem de inserção
+        self._lock = threading.Lock()
+
+    def _insert(self, document):
+        document = copy.deepcopy(document)
+        document.setdefault("_id", ObjectId())
+        if document["_id"] in self._documents:
+            return None
+        self._documents[document["_id"]] = document
+        return document["_id"]
+
+    def insert_one(self, document):
+        with self._lock:
+            inserted_id = self._insert(document)
+        if inserted_id is None:
+            raise OperationFailure("E11000 duplicate key error", code=DUPLICATE_KEY_ERROR)
+        document.setdefault("_id", inserted_id)
+        return InsertOneResult(inserted_id, True)
+
+    def insert_many(self, documents, ordered=True):
+        inserted_ids, write_errors = [], []
+        with self._lock:
+            for index, document in enumerate(documents):
+                inserted_id = self._insert(document)
+                if inserted_id is None:
+                    write_errors.append({"index": index, "code": DUPLICATE_KEY_ERROR, "errmsg": "E11000 duplicate key error"})
+                    if ordered:
+                        break
+                    continue
+                document.setdefault("_id", inserted_id)
+                inserted_ids.append(inserted_id)
+        if write_errors:
+            raise BulkWriteError({"writeErrors": write_errors, "writeConcernErrors": [], "nInserted": len(inserted_ids)})
+        return InsertManyResult(inserted_ids, True)
+
+    def find(self, filter=None, projection=None):
+        with self._lock:
+            documents = [copy.deepcopy(document) for document in self._documents.values() if _matches(document, filter)]
+        return MemoryCursor(documents)
+
+    def find_one(self, filter=None, projection=None):
+        return next(iter(self.find(filter, projection)), None)
+
+    def count_documents(self, filter):
+        with self._lock:
+            return sum(1 for document in self._documents.values() if _matches(document, filter))
+
+    def create_index(self, keys, **kwargs):
+        return kwargs.get("name") or "_".join(f"{key}_{direction}" for key, direction in keys)
+
+    def watch(self, *args, **kwargs):
+        raise OperationFailure("The $changeStream stage is only supported on replica sets", code=CHANGE_STREAM_NOT_SUPPORTED)
+
+
+class MemoryCursor:
+    def __init__(self, documents):
+        self._documents = documents
+
+    def sort(self, keys):
+        for key, direction in reversed(keys):
+            self._documents.sort(key=lambda document: document.get(key), reverse=direction < 0)
+        return self
+
+    def limit(self, count):
+        if count:
+            self._documents = self._documents[:count]
+        return self
+
+    def close(self):
+        pass
+
+    def __iter__(self):
+        return iter(self._documents)
+
+
+def _matches(document, filter):
+    return all(document.get(key) == value for key, value in (filter or {}).items())
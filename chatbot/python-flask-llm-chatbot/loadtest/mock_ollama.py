@@ -0,0 +1,154 @@
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Trecho do prompt de check_confirmation_intent.
+CONFIRMATION_PROMPT_MARKER = "is the intent a positive confirmation?"
+
+
+class MockOllamaServer:
+    """
+    Servidor HTTP local que imita /api/generate e /api/chat do Ollama, com respostas roteirizadas.
+
+    A resposta é escolhida pela primeira regra cujo trecho aparece na mensagem atual do cliente.
+    A duração simula um modelo real: latency_seconds até o primeiro token e depois
+    tokens_per_second tokens por segundo (uma palavra conta como um token). Responde em
+    NDJSON quando "stream" é true e em JSON quando o payload pede "format".
+    """
+    def __init__(self, rules, default_response, latency_seconds=0.2, tokens_per_second=50.0, host="127.0.0.1", port=0):
+        """
+        Args:
+            rules (list): [{"match": str, "response": str, "structured": dict (opcional)}].
+            default_response (str): Resposta quando nenhuma regra corresponde.
+            latency_seconds (float): Espera até o primeiro token (avaliação do prompt).
+            tokens_per_second (float): Velocidade de geração; 0 gera instantaneamente.
+        """
+        self.rules = [dict(rule, match=rule["match"].lower()) for rule in rules]
+        self.default_response = default_response
+        self.latency_seconds = latency_seconds
+        self.tokens_per_second = tokens_per_second
+        self.calls = Counter() # {endpoint: chamadas}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def total_calls(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-ollama", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reply_for(self, payload):
+        """Texto da resposta para o payload recebido."""
+        if "messages" in payload:
+            user_messages = [message["content"] for message in payload["messages"] if message.get("role") == "user"]
+            user_input = user_messages[-1] if user_messages else ""
+        else:
+            prompt = payload.get("prompt", "")
+            if CONFIRMATION_PROMPT_MARKER in prompt:
+                return "yes"
+            # O prompt de geração termina com "Cliente: <mensagem>\nAssistente:".
+            user_input = prompt.rsplit("Cliente:", 1)[-1].rsplit("Assistente:", 1)[0]
+
+        rule = next((rule for rule in self.rules if rule["match"] in user_input.lower()), None)
+        text = rule["response"] if rule else self.default_response
+        if payload.get("format"):
+            structured = (rule or {}).get("structured") or {"intent": "other", "items": [], "reply": text}
+            return json.dumps(structured, ensure_ascii=False)
+        return text
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # Mantém as conexões keep-alive do pool do requests.
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                endpoint = self.path.rsplit("/", 1)[-1]
+                if endpoint not in ("generate", "chat"):
+                    self.send_error(404)
+                    return
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                with server._lock:
+                    server.calls[endpoint] += 1
+                tokens = server.reply_for(payload).split(" ")
+                prompt_tokens = len(payload.get("prompt", "").split()) + sum(
+                    len(message.get("content", "").split()) for message in payload.get("messages", [])
+                )
+                started_at = time.perf_counter()
+                time.sleep(server.latency_seconds)
+                if payload.get("stream"):
+                    self._send_stream(endpoint, tokens, prompt_tokens, started_at)
+                else:
+                    if server.tokens_per_second:
+                        time.sleep(len(tokens) / server.tokens_per_second)
+                    body = dict(_message(endpoint, " ".join(tokens)), done=True, **_stats(tokens, prompt_tokens, started_at, server))
+                    self._send_json(body)
+
+            def _send_json(self, body):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_stream(self, endpoint, tokens, prompt_tokens, started_at):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    for index, token in enumerate(tokens):
+                        if server.tokens_per_second:
+                            time.sleep(1 / server.tokens_per_second)
+                        self._write_chunk(dict(_message(endpoint, token if index == 0 else " " + token), done=False))
+                    self._write_chunk(dict(_message(endpoint, ""), done=True, **_stats(tokens, prompt_tokens, started_at, server)))
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass # O cliente fechou a conexão (ex.: token de parada encontrado).
+
+            def _write_chunk(self, body):
+                data = json.dumps(body).encode("utf-8") + b"\n"
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+        return Handler
+
+
+def _message(endpoint, text):
+    if endpoint == "chat":
+        return {"message": {"role": "assistant", "content": text}}
+    return {"response": text}
+
+
+def _stats(tokens, prompt_tokens, started_at, server):
+    """Estatísticas no formato do Ollama (durações em nanossegundos)."""
+    eval_seconds = len(tokens) / server.tokens_per_second if server.tokens_per_second else 0.0
+    return {
+        "total_duration": int((time.perf_counter() - started_at) * 1e9),
+        "load_duration": 0,
+        "prompt_eval_count": prompt_tokens, # Aproximação: uma palavra por token.
+        "prompt_eval_duration": int(server.latency_seconds * 1e9),
+        "eval_count": len(tokens),
+        "eval_duration": int(eval_seconds * 1e9)
+    }
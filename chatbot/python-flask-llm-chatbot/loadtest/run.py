@@ -0,0 +1,184 @@
+"""
+Teste de carga offline do /chat.
+
+Sobe um Ollama simulado (mock_ollama.py) e troca o MongoClient por um substituto em memória
+(memory_mongo.py), então repete as conversas de conversations.json (pedido, confirmação e nome)
+contra a aplicação Flask com vários usuários simultâneos. Não precisa de rede nem de banco.
+
+Uso, a partir de chatbot/python-flask-llm-chatbot:
+    python -m loadtest.run --users 8 --iterations 20
+    python -m loadtest.run --stream --api-mode chat --latency 0.5 --tokens-per-second 30
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from loadtest.memory_mongo import MemoryMongoClient
+from loadtest.mock_ollama import MockOllamaServer
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+DEFAULT_CONVERSATIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "conversations.json")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Teste de carga offline do /chat com Ollama simulado e MongoDB em memória.")
+    parser.add_argument("--users", type=int, default=4, help="Usuários simultâneos (threads).")
+    parser.add_argument("--iterations", type=int, default=10, help="Conversas por usuário.")
+    parser.add_argument("--conversations", default=DEFAULT_CONVERSATIONS, help="Arquivo JSON com cardápio, regras do LLM e conversas.")
+    parser.add_argument("--latency", type=float, default=0.2, help="Espera do Ollama simulado até o primeiro token (segundos).")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="Velocidade de geração do Ollama simulado.")
+    parser.add_argument("--api-mode", choices=("generate", "chat"), default="generate", help="OLLAMA_API_MODE da aplicação.")
+    parser.add_argument("--output-format", choices=("text", "json", "schema"), default="text", help="LLM_OUTPUT_FORMAT da aplicação.")
+    parser.add_argument("--stream", action="store_true", help="Usa /chat/stream em vez de /chat.")
+    parser.add_argument("--no-response-cache", action="store_true", help="Desativa o cache de respostas do LLM.")
+    parser.add_argument("--json", action="store_true", help="Imprime o relatório em JSON.")
+    parser.add_argument("--verbose", action="store_true", help="Mantém os logs INFO da aplicação.")
+    return parser.parse_args(argv)
+
+
+def load_app(args, ollama_url, journal_dir):
+    """Configura o ambiente e cria a aplicação (create_app) com o MongoDB em memória."""
+    os.environ.update({
+        "MONGODB_URI": "memory://loadtest",
+        "OLLAMA_URL": f"{ollama_url}/api/generate",
+        "OLLAMA_API_MODE": args.api_mode,
+        "LLM_OUTPUT_FORMAT": args.output_format,
+        "SESSION_BACKEND": "memory",
+        "ORDER_JOURNAL_DIR": journal_dir,
+    })
+    if args.no_response_cache:
+        os.environ["RESPONSE_CACHE_SIZE"] = "0"
+    if SRC_DIR not in sys.path:
+        sys.path.insert(0, SRC_DIR)
+
+    if not args.verbose:
+        logging.disable(logging.INFO) # Os logs por requisição distorceriam as latências medidas.
+
+    import pymongo
+    pymongo.MongoClient = MemoryMongoClient # A aplicação importa o MongoClient do módulo pymongo.
+    import app as app_module
+    app_module.create_app()
+    return app_module
+
+
+def seed_menu(app_module, menu):
+    app_module.menu_items_collection.insert_many([dict(item) for item in menu])
+    app_module.menu_cache.refresh()
+
+
+def send_turn(client, message, stream):
+    """Envia uma mensagem e retorna (status HTTP, corpo final da resposta)."""
+    if not stream:
+        response = client.post("/chat", json={"message": message})
+        return response.status_code, response.get_json()
+    response = client.post("/chat/stream", json={"message": message})
+    body = None
+    for event in response.get_data(as_text=True).split("\n\n"):
+        if event.startswith("event: done\n"):
+            body = json.loads(event.split("data: ", 1)[1])
+    return response.status_code, body
+
+
+def run_user(app_module, conversations, iterations, offset, stream, results, lock):
+    """Executa as conversas de um usuário; cada conversa usa uma sessão nova."""
+    latencies, errors, orders = [], 0, 0
+    for iteration in range(iterations):
+        conversation = conversations[(offset + iteration) % len(conversations)]
+        client = app_module.app.test_client()
+        for message in conversation["turns"]:
+            started_at = time.perf_counter()
+            status, body = send_turn(client, message, stream)
+            latencies.append(time.perf_counter() - started_at)
+            if status != 200 or body is None:
+                errors += 1
+            elif body.get("final_order"):
+                orders += 1
+    with lock:
+        results["latencies"].extend(latencies)
+        results["errors"] += errors
+        results["orders"] += orders
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def wait_for_order_queue(app_module, timeout=10.0):
+    """Espera a fila write-behind gravar os pedidos no MongoDB em memória."""
+    deadline = time.monotonic() + timeout
+    while app_module.order_queue is not None and len(app_module.order_queue) and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with open(args.conversations, encoding="utf-8") as f:
+        scenario = json.load(f)
+
+    mock = MockOllamaServer(
+        scenario["llm_rules"], scenario["default_response"],
+        latency_seconds=args.latency, tokens_per_second=args.tokens_per_second
+    ).start()
+    journal_dir = tempfile.mkdtemp(prefix="loadtest-journal-")
+    try:
+        app_module = load_app(args, mock.base_url, journal_dir)
+        seed_menu(app_module, scenario["menu"])
+
+        results = {"latencies": [], "errors": 0, "orders": 0}
+        lock = threading.Lock()
+        threads = [
+            threading.Thread(
+                target=run_user,
+                args=(app_module, scenario["conversations"], args.iterations, user, args.stream, results, lock)
+            )
+            for user in range(args.users)
+        ]
+        started_at = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started_at
+        wait_for_order_queue(app_module)
+        persisted_orders = app_module.orders_collection.count_documents({})
+    finally:
+        mock.stop()
+        shutil.rmtree(journal_dir, ignore_errors=True)
+
+    latencies = sorted(results["latencies"])
+    llm_calls = mock.total_calls
+    report = {
+        "users": args.users,
+        "conversations": args.users * args.iterations,
+        "requests": len(latencies),
+        "errors": results["errors"],
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "latency_p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "latency_p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "completed_orders": results["orders"],
+        "persisted_orders": persisted_orders,
+        "llm_calls": llm_calls,
+        "llm_calls_per_order": round(llm_calls / results["orders"], 2) if results["orders"] else None,
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for key, value in report.items():
+            print(f"{key:>22}: {value}")
+    return 1 if results["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
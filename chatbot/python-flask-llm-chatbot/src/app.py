@@ -1,8 +1,10 @@
 import os
 import json
 import logging
+import threading
+import time
 from decimal import Decimal, InvalidOperation
-from flask import Flask, request, jsonify, session
+from flask import Flask, Response, g, request, jsonify, session, stream_with_context
 from flask_cors import CORS
 from dotenv import load_dotenv
 from pymongo import MongoClient
@@ -11,8 +13,25 @@ from bson.objectid import ObjectId
 from bson import errors as bson_errors # Para InvalidId
 import datetime
 import pytz
+from chatbot.cart import Cart
 from chatbot.handler import ChatbotHandler
-from llm.integration import LLMIntegration
+from chatbot.history import HistoryCompactor
+from kds.feed import OrderFeed
+from kds.order_queue import OrderWriteQueue
+from kds.orders import ensure_order_indexes, find_kds_orders, parse_page_cursor, serialize_kds_order
+from llm.admission import AdmissionController
+from llm.gateway import LLMGateway
+from llm.integration import LLMIntegration, ModelRoute, TASK_INTENT, TASK_STRUCTURED
+from llm.response_cache import ResponseCache
+from menu.cache import MenuCache
+from menu.updates import apply_menu_update, ensure_menu_indexes
+from metrics.exposition import PROMETHEUS_CONTENT_TYPE, render_prometheus
+from metrics.registry import REGISTRY, LATENCY_BUCKETS
+from metrics.spans import Span
+from nlp.intent import ConfirmationIntentClassifier, INTENT_YES
+from nlp.order_parser import OrderParser
+from sessions.interface import ServerSideSessionInterface
+from sessions.store import create_session_store
 
 # --- Carregar Variáveis de Ambiente ---
 load_dotenv()
@@ -30,92 +49,251 @@ CORS(app, supports_credentials=True)
 OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434/api/generate")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "mistral")
 OLLAMA_TIMEOUT = int(os.getenv("OLLAMA_TIMEOUT", 60))
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", OLLAMA_TIMEOUT)) # Espera máxima pela resposta
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", 5)) # Espera máxima para abrir a conexão
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", 10)) # Conexões keep-alive mantidas com o Ollama
+OLLAMA_MAX_RETRIES = int(os.getenv("OLLAMA_MAX_RETRIES", 2)) # Novas tentativas em falhas de conexão
+OLLAMA_RETRY_BACKOFF = float(os.getenv("OLLAMA_RETRY_BACKOFF", 0.5)) # Fator de backoff exponencial (segundos)
 OLLAMA_TEMPERATURE = float(os.getenv("OLLAMA_TEMPERATURE", 0.5))
+OLLAMA_API_MODE = os.getenv("OLLAMA_API_MODE", "generate") # "generate" ou "chat" (reaproveita o cache KV do prefixo)
+LLM_OUTPUT_FORMAT = os.getenv("LLM_OUTPUT_FORMAT", "text") # "text", "json" (intenção, itens e resposta em uma chamada) ou "schema" (JSON restrito ao cardápio)
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE") # Ex.: "30m"; se vazio, usa o padrão do Ollama
+# Modelo (e keep_alive) por tarefa; se vazios, usam OLLAMA_MODEL e OLLAMA_KEEP_ALIVE. Um modelo pequeno e
+# quantizado (ex.: "qwen2.5:1.5b") basta para classificar confirmações ambíguas ("Correto?" respondido com um
+# "sim" de baixa confiança). O modo estruturado gera também a resposta ao cliente, então um modelo pequeno
+# em OLLAMA_STRUCTURED_MODEL troca qualidade das respostas por latência.
+OLLAMA_INTENT_MODEL = os.getenv("OLLAMA_INTENT_MODEL") or OLLAMA_MODEL # Confirmações ambíguas (check_confirmation_intent)
+OLLAMA_INTENT_KEEP_ALIVE = os.getenv("OLLAMA_INTENT_KEEP_ALIVE") or OLLAMA_KEEP_ALIVE
+# Consulta o modelo de intenção antes do diálogo nas confirmações ambíguas; ativo por padrão só com OLLAMA_INTENT_MODEL definido.
+CONFIRMATION_LLM_CHECK = os.getenv("CONFIRMATION_LLM_CHECK", "true" if os.getenv("OLLAMA_INTENT_MODEL") else "false").lower() in ("true", "1", "t")
+OLLAMA_STRUCTURED_MODEL = os.getenv("OLLAMA_STRUCTURED_MODEL") or OLLAMA_MODEL # Modo estruturado: intenção, itens e resposta (LLM_OUTPUT_FORMAT json/schema)
+OLLAMA_STRUCTURED_KEEP_ALIVE = os.getenv("OLLAMA_STRUCTURED_KEEP_ALIVE") or OLLAMA_KEEP_ALIVE
+OLLAMA_NUM_PARALLEL = int(os.getenv("OLLAMA_NUM_PARALLEL", 4)) # Gerações simultâneas no Ollama; 0 desativa o gateway
+LLM_QUEUE_MAX = int(os.getenv("LLM_QUEUE_MAX", 32)) # Chamadas aguardando vaga antes de responder "ocupado"
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", 20)) # Espera máxima por uma vaga (segundos)
+# Espera estimada máxima pelo LLM antes de responder sem ele (segundos; 0 desativa) e percentil de latência usado.
+ADMISSION_WAIT_BUDGET = float(os.getenv("ADMISSION_WAIT_BUDGET", 15))
+ADMISSION_LATENCY_PERCENTILE = float(os.getenv("ADMISSION_LATENCY_PERCENTILE", 0.9))
 MONGODB_URI = os.getenv("MONGODB_URI")
-
-# --- Configuração do MongoDB ---
+MENU_CACHE_TTL = int(os.getenv("MENU_CACHE_TTL", 300))
+MENU_HTTP_MAX_AGE = int(os.getenv("MENU_HTTP_MAX_AGE", 0)) # Segundos que o navegador reutiliza GET /menu sem revalidar (0: sempre revalida pelo ETag)
+MENU_CACHE_CONTROL = f"public, max-age={MENU_HTTP_MAX_AGE}" if MENU_HTTP_MAX_AGE > 0 else "no-cache"
+# Frases extras de confirmação (separadas por vírgula) e confiança mínima para dispensar o LLM.
+CONFIRMATION_WORDS = [word.strip() for word in os.getenv("CONFIRMATION_WORDS", "").split(",") if word.strip()]
+INTENT_MIN_CONFIDENCE = float(os.getenv("INTENT_MIN_CONFIDENCE", 0.75))
+# Orçamento de tokens (estimados) do histórico enviado ao LLM; 0 volta ao corte fixo pelas últimas 3 interações.
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 256))
+HISTORY_CHARS_PER_TOKEN = float(os.getenv("HISTORY_CHARS_PER_TOKEN", 4)) # Caracteres por token na estimativa
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 256)) # Respostas do LLM guardadas; 0 desativa o cache
+RESPONSE_CACHE_MAX_HISTORY = int(os.getenv("RESPONSE_CACHE_MAX_HISTORY", 2)) # Histórico máximo (mensagens) para usar o cache
+KDS_PAGE_SIZE = int(os.getenv("KDS_PAGE_SIZE", 200)) # Pedidos por página em /api/kds/orders
+KDS_MAX_PAGE_SIZE = int(os.getenv("KDS_MAX_PAGE_SIZE", 1000)) # Maior valor aceito no parâmetro "limit"
+KDS_STREAM_HEARTBEAT = float(os.getenv("KDS_STREAM_HEARTBEAT", 15)) # Intervalo dos comentários keep-alive em /api/kds/stream (segundos)
+KDS_STREAM_HISTORY = int(os.getenv("KDS_STREAM_HISTORY", 500)) # Eventos guardados para retomar a conexão pelo Last-Event-ID
+ORDER_JOURNAL_DIR = os.getenv("ORDER_JOURNAL_DIR", "order_journal") # Journal dos pedidos ainda não gravados no MongoDB; vazio grava direto
+ORDER_FLUSH_BATCH_SIZE = int(os.getenv("ORDER_FLUSH_BATCH_SIZE", 50)) # Máximo de pedidos por insert_many
+ORDER_FLUSH_MAX_BACKOFF = float(os.getenv("ORDER_FLUSH_MAX_BACKOFF", 60)) # Intervalo máximo entre tentativas de gravação (segundos)
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory") # "memory" (um processo) ou "mongo" (vários workers)
+SESSION_TTL = int(os.getenv("SESSION_TTL", 7200)) # Validade da sessão desde o último uso (segundos)
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", 10000)) # Limite de sessões em memória (LRU)
+MONGO_STARTUP_MAX_BACKOFF = float(os.getenv("MONGO_STARTUP_MAX_BACKOFF", 30)) # Intervalo máximo entre verificações do MongoDB fora do ar (segundos)
+
+# --- Estado da Aplicação ---
+# Criado por create_app(); as rotas abaixo usam estas referências globais.
 mongo_client = None
 db = None
 orders_collection = None
 menu_items_collection = None
+session_store = None
+menu_cache = None
+order_feed = None
+order_queue = None
+llm_integration = None
+chatbot_handler = None
+_app_created = False
+_app_lock = threading.Lock()
+_mongo_check_pid = None # Processo que já iniciou a verificação do MongoDB
 
-if MONGODB_URI:
+def _init_mongo():
+    """
+    Cria o MongoClient sem conectar: com connect=False, nenhuma conexão ou thread de monitoramento
+    é aberta até a primeira operação. A aplicação sobe mesmo com o banco fora do ar, e o cliente
+    criado antes do fork (gunicorn com preload_app) só conecta dentro de cada worker.
+    """
+    global mongo_client, db, orders_collection, menu_items_collection
+    if not MONGODB_URI:
+        logging.warning("MONGODB_URI não configurada. A integração com MongoDB está desabilitada.")
+        return
     try:
-        mongo_client = MongoClient(MONGODB_URI, serverSelectionTimeoutMS=5000)
-        mongo_client.admin.command('ping') # Verifica a conexão
+        mongo_client = MongoClient(MONGODB_URI, serverSelectionTimeoutMS=5000, connect=False)
         db = mongo_client.get_database("poliedro_chatbot_db")
         orders_collection = db.get_collection("orders")
         menu_items_collection = db.get_collection("menu_items")
-        logging.info("Conexão com MongoDB estabelecida e coleções referenciadas (orders, menu_items).")
-    except ConnectionFailure:
-        logging.error("Falha ao conectar ao MongoDB: Verifique a URI de conexão e a disponibilidade do servidor.")
-        # Garante que as coleções permaneçam None se a conexão falhar
-        menu_items_collection = None
-        orders_collection = None
-        mongo_client = None
-    except Exception as e:
+        logging.info("Cliente MongoDB criado e coleções referenciadas (orders, menu_items); a conexão é verificada em segundo plano.")
+    except Exception as e: # Ex.: URI inválida.
         logging.exception(f"Erro inesperado ao configurar MongoDB: {e}")
-        menu_items_collection = None
-        orders_collection = None
-        mongo_client = None
-else:
-    logging.warning("MONGODB_URI não configurada. A integração com MongoDB está desabilitada.")
+        mongo_client = db = orders_collection = menu_items_collection = None
+
+def _check_mongo_in_background():
+    """
+    Verifica a conexão com o MongoDB (com novas tentativas e backoff) e, quando ela responde,
+    cria os índices e recarrega o cardápio. Roda em uma thread para não atrasar o início do processo.
+    """
+    delay = 1.0
+    while True:
+        try:
+            mongo_client.admin.command('ping')
+            break
+        except Exception as e: # ConnectionFailure, ServerSelectionTimeoutError, erros de autenticação...
+            logging.error(f"MongoDB indisponível; nova tentativa em {delay:.0f}s: {e}")
+            time.sleep(delay)
+            delay = min(delay * 2, MONGO_STARTUP_MAX_BACKOFF)
+    logging.info("Conexão com MongoDB estabelecida.")
+    ensure_order_indexes(orders_collection)
+    ensure_menu_indexes(menu_items_collection)
+    session_store.ensure_indexes()
+    if not menu_cache.get_snapshot().is_available:
+        menu_cache.invalidate()
+
+def create_app(start_background=True):
+    """
+    Fábrica da aplicação: cria o estado compartilhado (MongoDB, sessões, cache do cardápio, feed
+    e fila de pedidos do KDS, integração com o LLM) uma única vez por processo e retorna o app Flask.
+    Nenhuma etapa espera pelo MongoDB.
+
+    Args:
+        start_background (bool): Inicia as threads de segundo plano neste processo. Com o gunicorn
+            (preload_app), o processo mestre usa False e cada worker as inicia em init_worker().
+    """
+    global session_store, menu_cache, order_feed, order_queue, llm_integration, chatbot_handler, _app_created
+    with _app_lock:
+        if not _app_created:
+            _init_mongo()
+
+            # --- Sessões do Lado do Servidor ---
+            # O cookie carrega apenas um id curto; carrinho e histórico ficam no armazenamento configurado.
+            session_store = create_session_store(SESSION_BACKEND, db=db, max_entries=SESSION_MAX_ENTRIES)
+            app.session_interface = ServerSideSessionInterface(session_store, ttl_seconds=SESSION_TTL)
+
+            # --- Cache do Cardápio ---
+            # Compartilhado por load_menu_data() e LLMIntegration; recarregado em segundo plano e, com
+            # change streams, invalidado em todos os workers quando o cardápio muda no MongoDB.
+            menu_cache = MenuCache(menu_items_collection, ttl_seconds=MENU_CACHE_TTL)
+
+            # --- Feed de Pedidos do KDS ---
+            # Change stream da coleção de pedidos quando disponível; senão, publicação local pelos endpoints.
+            order_feed = OrderFeed(orders_collection, history_size=KDS_STREAM_HISTORY)
+
+            # --- Fila de Gravação dos Pedidos (write-behind) ---
+            # O pedido é registrado no journal local e gravado no MongoDB em segundo plano, inclusive se o
+            # banco estiver fora do ar; o feed do KDS é avisado quando o pedido chega ao banco.
+            if MONGODB_URI and ORDER_JOURNAL_DIR:
+                order_queue = OrderWriteQueue(
+                    orders_collection, ORDER_JOURNAL_DIR, batch_size=ORDER_FLUSH_BATCH_SIZE, max_backoff=ORDER_FLUSH_MAX_BACKOFF,
+                    on_flushed=lambda orders: [order_feed.notify_order_created(order) for order in orders]
+                )
+
+            llm_integration, chatbot_handler = _init_chatbot()
+            _app_created = True
+    if start_background:
+        start_background_services()
+    return app
+
+def start_background_services():
+    """
+    Inicia as threads de segundo plano deste processo: verificação do MongoDB, recarga do cardápio,
+    change stream do KDS e gravação dos pedidos. Todas são ligadas ao pid, então chamar de novo
+    após um fork as recria no processo filho.
+    """
+    global _mongo_check_pid
+    with _app_lock:
+        if mongo_client is not None and _mongo_check_pid != os.getpid():
+            _mongo_check_pid = os.getpid()
+            threading.Thread(target=_check_mongo_in_background, name="mongo-startup-check", daemon=True).start()
+    menu_cache.start(blocking=False)
+    order_feed.start()
+    if order_queue is not None:
+        order_queue.start()
+
+def init_worker():
+    """
+    Prepara um worker recém-criado por fork (hook post_fork do gunicorn): recria o pool de conexões
+    HTTP com o Ollama, para não compartilhar sockets com o processo mestre, e inicia as threads
+    de segundo plano do worker. O MongoClient (connect=False) conecta na primeira operação do worker.
+    """
+    create_app(start_background=False)
+    if llm_integration is not None:
+        llm_integration.reset_http_session()
+    start_background_services()
+    logging.info(f"Worker {os.getpid()} inicializado.")
 
 # --- Inicialização dos Componentes ---
-llm_integration = None
-chatbot_handler = None
-try:
-    # Passa menu_items_collection para LLMIntegration
-    llm_integration = LLMIntegration(
-        ollama_url=OLLAMA_URL,
-        model_name=OLLAMA_MODEL,
-        menu_collection=menu_items_collection, # A LLMIntegration usará esta coleção
-        timeout=OLLAMA_TIMEOUT,
-        temperature=OLLAMA_TEMPERATURE
-    )
-    # O ChatbotHandler usa o llm_integration configurado
-    chatbot_handler = ChatbotHandler(llm_integration=llm_integration)
-    logging.info(f"Integração LLM e ChatbotHandler inicializados com sucesso para o modelo '{OLLAMA_MODEL}'.")
-except Exception as e:
-    logging.exception("Erro fatal durante a inicialização dos componentes.")
-    # Garante que chatbot_handler seja None se a inicialização falhar
-    chatbot_handler = None
+confirmation_classifier = ConfirmationIntentClassifier(
+    extra_yes_phrases=CONFIRMATION_WORDS, min_confidence=INTENT_MIN_CONFIDENCE
+)
+
+def _init_chatbot():
+    """Cria a LLMIntegration e o ChatbotHandler; retorna (None, None) se a inicialização falhar."""
+    llm_gateway = None
+    if OLLAMA_NUM_PARALLEL > 0:
+        llm_gateway = LLMGateway(max_parallel=OLLAMA_NUM_PARALLEL, max_queue=LLM_QUEUE_MAX, max_wait_seconds=LLM_QUEUE_TIMEOUT)
+    admission_controller = None
+    if ADMISSION_WAIT_BUDGET > 0:
+        admission_controller = AdmissionController(
+            max_parallel=OLLAMA_NUM_PARALLEL or 1,
+            wait_budget_seconds=ADMISSION_WAIT_BUDGET,
+            latency_percentile=ADMISSION_LATENCY_PERCENTILE
+        )
+    response_cache = None
+    if RESPONSE_CACHE_SIZE > 0:
+        response_cache = ResponseCache(max_entries=RESPONSE_CACHE_SIZE, max_history_messages=RESPONSE_CACHE_MAX_HISTORY)
+    history_compactor = None
+    if HISTORY_TOKEN_BUDGET > 0:
+        history_compactor = HistoryCompactor(token_budget=HISTORY_TOKEN_BUDGET, chars_per_token=HISTORY_CHARS_PER_TOKEN)
+    try:
+        # Passa o menu_cache para LLMIntegration
+        integration = LLMIntegration(
+            ollama_url=OLLAMA_URL,
+            model_name=OLLAMA_MODEL,
+            menu_cache=menu_cache, # A LLMIntegration lê o cardápio formatado deste cache
+            timeout=OLLAMA_READ_TIMEOUT,
+            temperature=OLLAMA_TEMPERATURE,
+            max_history_turns=None if history_compactor else 3, # Com o compactador, o orçamento de tokens limita o histórico
+            api_mode=OLLAMA_API_MODE,
+            output_format=LLM_OUTPUT_FORMAT,
+            keep_alive=OLLAMA_KEEP_ALIVE,
+            connect_timeout=OLLAMA_CONNECT_TIMEOUT,
+            pool_size=OLLAMA_POOL_SIZE,
+            max_retries=OLLAMA_MAX_RETRIES,
+            retry_backoff=OLLAMA_RETRY_BACKOFF,
+            intent_classifier=confirmation_classifier,
+            response_cache=response_cache,
+            gateway=llm_gateway,
+            admission=admission_controller,
+            model_routes={
+                TASK_INTENT: ModelRoute(OLLAMA_INTENT_MODEL, OLLAMA_INTENT_KEEP_ALIVE),
+                TASK_STRUCTURED: ModelRoute(OLLAMA_STRUCTURED_MODEL, OLLAMA_STRUCTURED_KEEP_ALIVE)
+            }
+        )
+        # O ChatbotHandler usa o llm_integration configurado
+        handler = ChatbotHandler(
+            llm_integration=integration, order_parser=OrderParser(), history_compactor=history_compactor
+        )
+        logging.info(f"Integração LLM e ChatbotHandler inicializados com sucesso para o modelo '{OLLAMA_MODEL}'.")
+        return integration, handler
+    except Exception as e:
+        logging.exception("Erro fatal durante a inicialização dos componentes.")
+        # Garante que chatbot_handler seja None se a inicialização falhar
+        return None, None
 
 # --- Função Auxiliar: Carregar Cardápio para o ChatbotHandler ---
 def load_menu_data():
     """
-    Carrega os dados do cardápio da coleção MongoDB.
+    Retorna os dados do cardápio a partir do MenuCache, sem acessar o MongoDB.
     Retorna um dicionário mapeando nomes de itens (minúsculos) para {"original_name": str, "price": Decimal}.
-    Retorna um dicionário vazio se houver erro ou a coleção não estiver disponível.
+    Retorna um dicionário vazio se o cardápio não estiver disponível.
     """
-    menu_data_for_handler = {}
-    if menu_items_collection is None:
-        logging.error("load_menu_data: menu_items_collection não está disponível.")
-        return {}
-    try:
-        menu_list_from_db = list(menu_items_collection.find({}))
-        for item in menu_list_from_db:
-            if not isinstance(item, dict) or 'name' not in item or 'price' not in item:
-                logging.warning(f"Item de menu do DB em formato inválido ignorado: {item}")
-                continue
-            try:
-                original_name = str(item['name'])
-                # Preços no MongoDB são armazenados como números (float).
-                # Convertendo para Decimal para consistência interna no ChatbotHandler.
-                price = Decimal(str(item['price']))
-                if price < 0:
-                    logging.warning(f"Item de menu do DB com preço negativo ignorado: {item}")
-                    continue
-                menu_data_for_handler[original_name.lower()] = {"original_name": original_name, "price": price}
-            except (InvalidOperation, ValueError, TypeError) as item_error:
-                logging.warning(f"Erro ao processar item de menu do DB {item}: {item_error}")
-        return menu_data_for_handler
-    except OperationFailure as op_e:
-        logging.exception(f"load_menu_data: Erro de operação do MongoDB: {op_e.details}")
-        return {}
-    except Exception as e:
-        logging.exception(f"load_menu_data: Erro inesperado ao carregar dados do cardápio do MongoDB: {e}")
-        return {}
+    return menu_cache.get_menu_data()
 
 # --- Função Auxiliar para Descrição do Log ---
 def get_request_description(method, path):
@@ -127,64 +305,107 @@ def get_request_description(method, path):
         return "Requisição OPTIONS (preflight) para o chat"
     elif method == 'POST' and path == '/chat':
         return "Requisição para enviar mensagem ao chat"
+    elif method == 'POST' and path == '/chat/stream':
+        return "Requisição para enviar mensagem ao chat com streaming"
     elif method == 'POST' and path == '/chat/reset_session':
         return "Requisição para resetar a sessão do chat"
+    elif method == 'GET' and path == '/api/kds/stream':
+        return "Requisição para acompanhar os pedidos do KDS em tempo real"
+    elif method == 'GET' and path == '/metrics':
+        return "Requisição para coletar as métricas"
     # Adicione outras descrições personalizadas conforme necessário
     return f"Requisição {method} para {path}"
 
+# --- Métricas das Requisições ---
+# Em respostas transmitidas (SSE, JSON em streaming), mede o tempo até o início da resposta.
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "Duração das requisições HTTP por rota e método.", LATENCY_BUCKETS,
+    labelnames=("endpoint", "method")
+)
+
+@app.before_request
+def start_request_timer():
+    g.request_started_at = time.perf_counter()
+
 # --- Decorador para Logar Após Cada Requisição ---
 @app.after_request
 def log_request_info(response):
     if not request: # Evita erro se o contexto da requisição não estiver disponível
         return response
+    started_at = g.get('request_started_at')
+    if started_at is not None:
+        endpoint = request.url_rule.rule if request.url_rule is not None else "desconhecido"
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started_at, endpoint=endpoint, method=request.method)
     description = get_request_description(request.method, request.path)
     app.logger.info(
         f'>>> Descrição: {description} (Status: {response.status_code})'
     )
     return response
 
-# --- Endpoint Principal: Chat ---
-@app.route('/chat', methods=['POST'])
-def chat():
-    data = request.get_json()
-    user_input = data.get('message', '').strip()
+# --- Funções Auxiliares do Chat ---
+# Chaves da sessão que representam o estado da conversa.
+CHAT_STATE_KEYS = ('cart', 'conversation_history', 'last_bot_message', 'awaiting_client_name')
+MAX_HISTORY_LEN = 10
+
+def _init_chat_state(state):
+    if 'cart' not in state:
+        state['cart'] = [] # Carrinho no formato compacto de Cart.to_session()
+    if 'conversation_history' not in state:
+        state['conversation_history'] = []
+    if 'last_bot_message' not in state:
+        state['last_bot_message'] = ""
+    # state.get('awaiting_client_name') será usado para verificar o estado
+
+def _persist_stream_state(sid, state):
+    """
+    Grava o estado final de um turno transmitido via /chat/stream. O Flask já salvou a sessão
+    quando o streaming começou, então o estado é gravado diretamente no armazenamento.
+    """
+    data = app.session_interface.load_data(sid) or {}
+    for key in CHAT_STATE_KEYS:
+        if key in state:
+            data[key] = state[key]
+        else:
+            data.pop(key, None)
+    app.session_interface.save_data(sid, data)
 
-    if chatbot_handler is None:
-        logging.error("/chat: ChatbotHandler não inicializado.")
-        return jsonify({"error": "Serviço de chatbot indisponível."}), 503
+def _should_check_confirmation_with_llm(user_input, admission):
+    """
+    Indica se uma confirmação ambígua vai para o modelo de intenção antes do diálogo: a resposta
+    tem um sinal de "sim" abaixo da confiança mínima, sem pedido de alteração, e o LLM não está sobrecarregado.
+    """
+    if not CONFIRMATION_LLM_CHECK or llm_integration is None:
+        return False
+    if confirmation_classifier.classify(user_input).intent != INTENT_YES:
+        return False
+    return not admission.overloaded
 
-    if not user_input:
-        return jsonify({"response": "Por favor, digite uma mensagem.", "cart": session.get('cart', [])}), 400
-
-    if 'cart' not in session:
-        session['cart'] = []
-    if 'conversation_history' not in session:
-        session['conversation_history'] = []
-    if 'last_bot_message' not in session:
-        session['last_bot_message'] = ""
-    # session.get('awaiting_client_name') será usado para verificar o estado
-
-    final_response_data = {"response": None, "cart": list(session.get('cart', []))}
-    current_menu_data = load_menu_data() 
+def _handle_turn_without_llm(state, user_input, current_menu_data, final_response_data, admission):
+    """
+    Trata os turnos que não precisam do LLM: nome do cliente e confirmações diretas "sim"/"não".
+    admission é a AdmissionDecision do turno, repassada depois ao ChatbotHandler.
+    Retorna True se o turno foi tratado.
+    """
     brasilia_tz = pytz.timezone('America/Sao_Paulo')
 
     # Cenário 1: Bot estava aguardando o nome do cliente
-    if session.get('awaiting_client_name'):
+    if state.get('awaiting_client_name'):
         client_name = user_input # A mensagem atual do usuário é considerada o nome
-        session.pop('awaiting_client_name', None) # Limpa a flag
+        state.pop('awaiting_client_name', None) # Limpa a flag
 
-        if not session.get('cart'):
+        cart = Cart.from_session(state.get('cart'), current_menu_data)
+        if not cart:
             final_response_data["response"] = "Seu carrinho está vazio. Não posso finalizar um pedido sem itens."
-            session['conversation_history'] = [] # Limpa o histórico da conversa, pois não podemos finalizar
+            state['conversation_history'] = [] # Limpa o histórico da conversa, pois não podemos finalizar
             logging.info(f"Pedido não finalizado para {client_name} porque o carrinho está vazio.")
         else:
             order_details_text, total_calculated = chatbot_handler.format_order_details(
-                session['cart'], current_menu_data, include_total=True, for_confirmation=False
+                cart, current_menu_data, include_total=True, for_confirmation=False
             )
             final_response_data["response"] = f"Ótimo, {client_name}! Seu pedido foi anotado e enviado para a cozinha!"
             final_order_payload = {
                 "client_name": client_name, # Nome do cliente adicionado
-                "items": list(session['cart']),
+                "items": cart.to_list(),
                 "total": str(total_calculated),
                 "order_details_text": order_details_text,
                 "timestamp": datetime.datetime.now(brasilia_tz),
@@ -192,12 +413,27 @@ def chat():
             }
             final_response_data['final_order'] = final_order_payload
     
-            if orders_collection is not None:
+            order_journaled = False
+            if order_queue is not None:
+                try:
+                    with Span("order.journal"):
+                        order_id = order_queue.enqueue(final_order_payload)
+                    final_order_payload['_id'] = str(order_id)
+                    order_journaled = True
+                    logging.info(f"Pedido finalizado para {client_name} registrado no journal com ID: {order_id}")
+                except OSError:
+                    logging.exception(f"Falha ao registrar o pedido de {client_name} no journal; gravando diretamente no MongoDB.")
+
+            if order_journaled:
+                pass # Gravado no MongoDB pela fila em segundo plano.
+            elif orders_collection is not None:
                 try:
-                    insert_result = orders_collection.insert_one(final_order_payload)
+                    with Span("order.insert"):
+                        insert_result = orders_collection.insert_one(final_order_payload)
                     logging.info(f"Pedido finalizado para {client_name} e salvo no MongoDB com ID: {insert_result.inserted_id}")
                     if '_id' in final_order_payload: # Para retornar ao frontend se necessário
                         final_order_payload['_id'] = str(final_order_payload['_id'])
+                    order_feed.notify_order_created(final_order_payload)
                 except OperationFailure as e:
                     logging.error(f"Falha ao salvar pedido no MongoDB para {client_name}: {e.details}")
                 except Exception as e:
@@ -205,88 +441,200 @@ def chat():
             else:
                 logging.warning(f"MongoDB não configurado. Pedido para {client_name} não foi salvo no banco de dados.")
     
-            logging.info(f"Pedido finalizado para {client_name}: {session['cart']}")
-            session['cart'] = [] # Limpa o carrinho após pedido bem-sucedido
-            session['conversation_history'] = [] # Limpa o histórico da conversa para um novo começo
-            session['last_bot_message'] = "" # Limpa a última mensagem do bot
-        
-    else: # Bot NÃO estava aguardando um nome, prossegue com a lógica normal
-        last_bot_message_for_confirmation = session.get('last_bot_message', '').strip()
-        is_direct_sim_confirmation = user_input.lower() == "sim" and \
-                                     last_bot_message_for_confirmation.endswith("Correto?")
-        is_direct_nao_confirmation = user_input.lower() == "não" and \
-                                     last_bot_message_for_confirmation.endswith("Correto?")
-
-        if is_direct_sim_confirmation:
-            logging.info("Confirmação 'sim' direta recebida do frontend.")
-            if not session.get('cart'):
-                final_response_data["response"] = "Seu carrinho está vazio. Adicione itens antes de finalizar."
-            else:
-                # Em vez de finalizar diretamente, define a flag e pede o nome
-                session['awaiting_client_name'] = True
-                final_response_data["response"] = "Entendido. Para finalizar, por favor, me diga seu nome."
-                # Carrinho e histórico são preservados. Pedido ainda não foi salvo.
-        
-        elif is_direct_nao_confirmation:
-            logging.info("Confirmação 'não' direta recebida do frontend.")
-            final_response_data["response"] = "Entendido. O que você gostaria de alterar ou adicionar?"
-            
-        else: # Não é uma confirmação direta "sim" ou "não", processar com LLM/Handler
-            try:
-                processed_output = chatbot_handler.process_input(
-                    user_input,
-                    list(session.get('cart', [])),
-                    list(session.get('conversation_history', [])),
-                    session.get('last_bot_message', ''),
-                    current_menu_data
-                )
+            logging.info(f"Pedido finalizado para {client_name}: {cart.to_list()}")
+            state['cart'] = [] # Limpa o carrinho após pedido bem-sucedido
+            state['conversation_history'] = [] # Limpa o histórico da conversa para um novo começo
+            state['last_bot_message'] = "" # Limpa a última mensagem do bot
+        return True
+
+    # Bot NÃO estava aguardando um nome, verifica confirmações diretas.
+    # O classificador local resolve respostas como "sim", "fechou" ou "pode fechar" sem o LLM;
+    # respostas ambíguas ou com alterações seguem para o LLM/Handler.
+    last_bot_message_for_confirmation = (state.get('last_bot_message') or '').strip()
+    direct_confirmation = None
+    if last_bot_message_for_confirmation.endswith("Correto?"):
+        direct_confirmation = confirmation_classifier.decide(user_input)
+        if direct_confirmation is None and _should_check_confirmation_with_llm(user_input, admission):
+            # Só o "sim" do modelo de intenção é aceito: um "não" pode trazer alterações ao pedido,
+            # que o diálogo precisa ler, então segue para o LLM/Handler.
+            if llm_integration.check_confirmation_intent(
+                user_input, last_bot_message_for_confirmation, use_local_classifier=False
+            ) == 'sim':
+                direct_confirmation = 'sim'
+    is_direct_sim_confirmation = direct_confirmation == 'sim'
+    is_direct_nao_confirmation = direct_confirmation == 'não'
+
+    if is_direct_sim_confirmation:
+        logging.info(f"Confirmação positiva direta recebida: '{user_input}'.")
+        if not state.get('cart'):
+            final_response_data["response"] = "Seu carrinho está vazio. Adicione itens antes de finalizar."
+        else:
+            # Em vez de finalizar diretamente, define a flag e pede o nome
+            state['awaiting_client_name'] = True
+            final_response_data["response"] = "Entendido. Para finalizar, por favor, me diga seu nome."
+            # Carrinho e histórico são preservados. Pedido ainda não foi salvo.
+        return True
+    
+    if is_direct_nao_confirmation:
+        logging.info(f"Confirmação negativa direta recebida: '{user_input}'.")
+        final_response_data["response"] = "Entendido. O que você gostaria de alterar ou adicionar?"
+        return True
+
+    return False # Não é uma confirmação direta "sim" ou "não", processar com LLM/Handler
+
+def _apply_processed_output(state, processed_output, final_response_data):
+    """Aplica ao estado da conversa a saída de ChatbotHandler.process_input."""
+    final_response_data["response"] = processed_output.get("llm_response")
+    action = processed_output.get("action")
+    cart_updated = processed_output.get("cart_updated")
+    if cart_updated is not None:
+        state['cart'] = cart_updated.to_session()
+
+    if action == "needs_confirmation":
+        logging.info(f"Handler indica necessidade de confirmação. Carrinho para confirmar: {state['cart']}")
+        # A resposta do handler (perguntando "Correto?") já está em final_response_data["response"]
+
+    elif action == "finalize_order_confirmed": # LLM ou handler decidiu finalizar
+        logging.info("Handler indica que o pedido foi confirmado.")
+        if not state.get('cart'):
+            final_response_data["response"] = "Seu carrinho está vazio. Adicione itens antes de finalizar."
+        else:
+            # Em vez de finalizar diretamente, define a flag e pede o nome
+            state['awaiting_client_name'] = True
+            # Sobrescreve a mensagem de finalização do LLM para pedir o nome
+            final_response_data["response"] = "Entendido. Para finalizar, por favor, me diga seu nome."
+    
+    elif action == "clear_cart":
+        logging.info("Carrinho limpo conforme instrução do handler.")
+        state['cart'] = [] # Garante que o carrinho seja limpo na sessão
 
-                final_response_data["response"] = processed_output.get("llm_response")
-                action = processed_output.get("action")
-                session['cart'] = processed_output.get("cart_updated", list(session.get('cart', [])))
-
-                if action == "needs_confirmation":
-                    logging.info(f"Handler indica necessidade de confirmação. Carrinho para confirmar: {session['cart']}")
-                    # A resposta do handler (perguntando "Correto?") já está em final_response_data["response"]
-
-                elif action == "finalize_order_confirmed": # LLM ou handler decidiu finalizar
-                    logging.info("Handler indica que o pedido foi confirmado.")
-                    if not session.get('cart'):
-                        final_response_data["response"] = "Seu carrinho está vazio. Adicione itens antes de finalizar."
-                    else:
-                        # Em vez de finalizar diretamente, define a flag e pede o nome
-                        session['awaiting_client_name'] = True
-                        # Sobrescreve a mensagem de finalização do LLM para pedir o nome
-                        final_response_data["response"] = "Entendido. Para finalizar, por favor, me diga seu nome."
-                
-                elif action == "clear_cart":
-                    logging.info("Carrinho limpo conforme instrução do handler.")
-                    session['cart'] = [] # Garante que o carrinho seja limpo na sessão
-
-            except Exception as e:
-                logging.exception("Erro ao chamar chatbot_handler.process_input ou ao processar sua saída.")
-                final_response_data["response"] = "Desculpe, ocorreu um erro interno ao processar sua mensagem. Tente novamente mais tarde."
-
-    # Lógica comum para atualizar a sessão e retornar a resposta
-    final_response_data["cart"] = list(session.get('cart', [])) # Reflete as alterações no carrinho (ex: limpo após o pedido)
-    session['last_bot_message'] = final_response_data.get("response")
+def _finish_chat_turn(state, user_input, final_response_data):
+    """Lógica comum para atualizar o estado da conversa ao final de um turno."""
+    final_response_data["cart"] = Cart.from_session(state.get('cart')).to_list() # Reflete as alterações no carrinho (ex: limpo após o pedido)
+    state['last_bot_message'] = final_response_data.get("response")
 
     # Adiciona a interação atual ao histórico.
-    # Se um pedido foi feito com sucesso, session['conversation_history'] foi limpo.
+    # Se um pedido foi feito com sucesso, state['conversation_history'] foi limpo.
     # Então, isso adicionará a mensagem final do usuário (nome) e a confirmação do bot como o início de um novo histórico.
     if user_input:
-         session['conversation_history'].append({"role": "user", "content": user_input})
+         state['conversation_history'].append({"role": "user", "content": user_input})
     if final_response_data.get("response"):
-        session['conversation_history'].append({"role": "assistant", "content": final_response_data["response"]})
+        state['conversation_history'].append({"role": "assistant", "content": final_response_data["response"]})
     
     # Limita o tamanho do histórico. Isso se aplica mesmo se o histórico acabou de ser limpo (será curto).
-    MAX_HISTORY_LEN = 10 
-    if len(session.get('conversation_history', [])) > MAX_HISTORY_LEN:
-        session['conversation_history'] = session['conversation_history'][-MAX_HISTORY_LEN:]
+    if len(state.get('conversation_history', [])) > MAX_HISTORY_LEN:
+        state['conversation_history'] = state['conversation_history'][-MAX_HISTORY_LEN:]
+
+def _sse_event(event, data):
+    """Formata um evento Server-Sent Events com dados em JSON."""
+    return f"event: {event}\ndata: {app.json.dumps(data)}\n\n"
 
+# --- Endpoint Principal: Chat ---
+@app.route('/chat', methods=['POST'])
+def chat():
+    data = request.get_json()
+    user_input = data.get('message', '').strip()
+
+    if chatbot_handler is None:
+        logging.error("/chat: ChatbotHandler não inicializado.")
+        return jsonify({"error": "Serviço de chatbot indisponível."}), 503
+
+    if not user_input:
+        return jsonify({"response": "Por favor, digite uma mensagem.", "cart": Cart.from_session(session.get('cart')).to_list()}), 400
+
+    _init_chat_state(session)
+
+    final_response_data = {"response": None, "cart": Cart.from_session(session.get('cart')).to_list()}
+    with Span("chat.menu_load"):
+        current_menu_data = load_menu_data() 
+
+    # Decisão de admissão do turno: tomada no máximo uma vez, por quem precisar primeiro do LLM.
+    admission = llm_integration.admission_decision()
+    with Span("chat.turn_without_llm"):
+        handled_without_llm = _handle_turn_without_llm(session, user_input, current_menu_data, final_response_data, admission)
+    if not handled_without_llm:
+        try:
+            with Span("chat.handler"):
+                processed_output = chatbot_handler.process_input(
+                    user_input,
+                    Cart.from_session(session.get('cart'), current_menu_data),
+                    list(session.get('conversation_history', [])),
+                    session.get('last_bot_message', ''),
+                    current_menu_data,
+                    admission
+                )
+            _apply_processed_output(session, processed_output, final_response_data)
+        except Exception as e:
+            logging.exception("Erro ao chamar chatbot_handler.process_input ou ao processar sua saída.")
+            final_response_data["response"] = "Desculpe, ocorreu um erro interno ao processar sua mensagem. Tente novamente mais tarde."
+
+    with Span("chat.finish_turn"):
+        _finish_chat_turn(session, user_input, final_response_data)
     session.modified = True 
     return jsonify(final_response_data)
 
+# --- Endpoint: Chat com Streaming (Server-Sent Events) ---
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Variante de /chat que transmite a resposta do LLM token a token como Server-Sent Events.
+    Emite eventos "token" ({"text": ...}) durante a geração e um evento "done" final com o
+    mesmo corpo de /chat; o texto de "done" é o definitivo (ex.: confirmação reformatada).
+    """
+    data = request.get_json()
+    user_input = data.get('message', '').strip()
+
+    if chatbot_handler is None:
+        logging.error("/chat/stream: ChatbotHandler não inicializado.")
+        return jsonify({"error": "Serviço de chatbot indisponível."}), 503
+
+    if not user_input:
+        return jsonify({"response": "Por favor, digite uma mensagem.", "cart": Cart.from_session(session.get('cart')).to_list()}), 400
+
+    _init_chat_state(session)
+
+    final_response_data = {"response": None, "cart": Cart.from_session(session.get('cart')).to_list()}
+    current_menu_data = load_menu_data()
+    sse_headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+    admission = llm_integration.admission_decision()
+    if _handle_turn_without_llm(session, user_input, current_menu_data, final_response_data, admission):
+        _finish_chat_turn(session, user_input, final_response_data)
+        session.modified = True
+        return Response(_sse_event("done", final_response_data), mimetype='text/event-stream', headers=sse_headers)
+
+    # O estado é copiado para ser atualizado ao final do streaming e gravado no armazenamento de sessões.
+    state = {key: session[key] for key in CHAT_STATE_KEYS if key in session}
+    state['cart'] = list(state['cart'])
+    state['conversation_history'] = list(state['conversation_history'])
+    sid = session.sid
+
+    def generate_events():
+        processed_output = None
+        try:
+            for kind, value in chatbot_handler.process_input_stream(
+                user_input,
+                Cart.from_session(state['cart'], current_menu_data),
+                list(state['conversation_history']),
+                state.get('last_bot_message', ''),
+                current_menu_data,
+                admission
+            ):
+                if kind == "token":
+                    yield _sse_event("token", {"text": value})
+                else:
+                    processed_output = value
+            _apply_processed_output(state, processed_output, final_response_data)
+        except Exception as e:
+            logging.exception("Erro ao chamar chatbot_handler.process_input_stream ou ao processar sua saída.")
+            final_response_data["response"] = "Desculpe, ocorreu um erro interno ao processar sua mensagem. Tente novamente mais tarde."
+
+        _finish_chat_turn(state, user_input, final_response_data)
+        _persist_stream_state(sid, state)
+        yield _sse_event("done", final_response_data)
+
+    return Response(stream_with_context(generate_events()), mimetype='text/event-stream', headers=sse_headers)
+
 # --- Endpoint para Resetar a Sessão do Chat ---
 @app.route('/chat/reset_session', methods=['POST'])
 def reset_chat_session():
@@ -303,55 +651,15 @@ def handle_menu_kds_admin():
         if menu_items_collection is None:
             logging.error("GET /menu: menu_items_collection não está disponível.")
             return jsonify({"error": "Serviço de cardápio (DB) não disponível."}), 503
-        try:
-            logging.info("GET /menu: Tentando buscar itens do menu do MongoDB.")
-            menu_from_db = list(menu_items_collection.find({}))
-            logging.info(f"GET /menu: Encontrados {len(menu_from_db)} itens no DB.")
-            
-            menu_list_serializable = []
-            for item_index, item in enumerate(menu_from_db):
-                if not isinstance(item, dict):
-                    logging.warning(f"GET /menu: Item {item_index} do DB não é um dicionário: {item}")
-                    continue
-
-                item_id = item.get('_id')
-                item_name_raw = item.get("name")
-                item_price_raw = item.get("price")
-
-                if not item_id: # Valida _id
-                    logging.warning(f"GET /menu: Item {item_index} não possui '_id': {item}")
-                    continue # Pular item sem ID
-                
-                # Valida nome
-                item_name_str = str(item_name_raw) if item_name_raw is not None else "Nome Indisponível"
-
-                # Valida preço
-                item_price_str = "0.00" # Preço padrão
-                if item_price_raw is not None:
-                    try:
-                        # Garante que o preço seja um número antes de formatar, depois converte para string para JSON.
-                        numeric_price = float(item_price_raw)
-                        item_price_str = f"{numeric_price:.2f}" # Formata para 2 casas decimais
-                    except (ValueError, TypeError) as price_conversion_error:
-                        logging.warning(f"GET /menu: Não foi possível converter o preço '{item_price_raw}' para float para o item ID {item_id}. Erro: {price_conversion_error}. Usando '0.00'.")
-                else: # item_price_raw é None
-                    logging.warning(f"GET /menu: Item ID {item_id} não possui 'price'. Usando '0.00'.")
-
-                menu_list_serializable.append({
-                    "id": str(item_id),
-                    "name": item_name_str.title(),
-                    "price": item_price_str
-                })
-            
-            logging.info(f"GET /menu: Retornando {len(menu_list_serializable)} itens serializados.")
-            return jsonify({"menu": menu_list_serializable})
-        
-        except OperationFailure as op_e:
-            logging.exception(f"GET /menu: Erro de operação do MongoDB ao buscar cardápio: {op_e.details if hasattr(op_e, 'details') else op_e}")
-            return jsonify({"error": f"Erro de banco de dados ao carregar cardápio: {op_e}"}), 500
-        except Exception as e:
-            logging.exception("GET /menu: Erro inesperado ao preparar dados do menu para resposta.")
-            return jsonify({"error": f"Erro interno ao processar cardápio: {str(e)}"}), 500
+        # Corpo serializado e ETag são gerados pelo MenuCache apenas quando o cardápio muda.
+        snapshot = menu_cache.get_snapshot()
+        if snapshot.menu_json is None:
+            logging.error("GET /menu: O cardápio não pôde ser carregado do MongoDB.")
+            return jsonify({"error": "Erro de banco de dados ao carregar cardápio."}), 500
+        response = Response(snapshot.menu_json, mimetype='application/json')
+        response.set_etag(snapshot.etag)
+        response.headers['Cache-Control'] = MENU_CACHE_CONTROL
+        return response.make_conditional(request) # 304 quando If-None-Match corresponde ao ETag
 
     elif request.method == 'POST':
         if menu_items_collection is None:
@@ -386,13 +694,15 @@ def handle_menu_kds_admin():
                      logging.warning(f"POST /menu: Preço inválido para o item: {item_from_request}")
                      return jsonify({"error": f"Preço inválido para o item '{item_from_request.get('name')}': {item_from_request.get('price')}"}), 400
             
-            # Limpa a coleção existente e insere os novos itens.
-            menu_items_collection.delete_many({})
-            if validated_menu_to_save_to_db: # Apenas insere se a lista não estiver vazia.
-                menu_items_collection.insert_many(validated_menu_to_save_to_db)
-            
-            logging.info(f"POST /menu: Cardápio atualizado no MongoDB com {len(validated_menu_to_save_to_db)} itens.")
-            return jsonify({"message": "Cardápio atualizado com sucesso!"}), 200
+            # Aplica apenas as diferenças em relação ao cardápio atual (sem esvaziar a coleção).
+            update_result = apply_menu_update(menu_items_collection, validated_menu_to_save_to_db)
+            if update_result.changed:
+                menu_cache.refresh() # Recarrega já, para que o próximo GET /menu receba a nova versão.
+            logging.info(
+                f"POST /menu: Cardápio atualizado no MongoDB com {len(validated_menu_to_save_to_db)} itens "
+                f"({update_result.inserted} incluídos, {update_result.updated} alterados, {update_result.removed} removidos)."
+            )
+            return jsonify({"message": "Cardápio atualizado com sucesso!", **update_result.to_dict()}), 200
         except OperationFailure as op_e:
             logging.exception(f"POST /menu: Erro de operação do MongoDB: {op_e.details if hasattr(op_e, 'details') else op_e}")
             return jsonify({"error": "Erro de banco de dados ao salvar cardápio."}), 500
@@ -409,6 +719,7 @@ def delete_menu_item_kds_admin(item_id):
         obj_id = ObjectId(item_id)
         result = menu_items_collection.delete_one({"_id": obj_id})
         if result.deleted_count == 1:
+            menu_cache.refresh() # Recarrega já, para que o próximo GET /menu receba a nova versão.
             logging.info(f"DELETE /api/menu/items/{item_id}: Item excluído com sucesso.")
             return jsonify({"message": "Item excluído com sucesso!"}), 200
         else:
@@ -427,6 +738,11 @@ def delete_menu_item_kds_admin(item_id):
 # --- API Endpoint: Pedidos KDS ---
 @app.route('/api/kds/orders', methods=['GET'])
 def api_kds_orders():
+    """
+    Lista os pedidos de um status para o KDS, com paginação por cursor:
+    ?after=<timestamp_iso do último pedido>&after_id=<_id do último pedido>&limit=<n>.
+    O array JSON é transmitido à medida que os documentos são lidos do MongoDB.
+    """
     requested_status = request.args.get('status', 'Pendente') # Padrão para 'Pendente'
     
     valid_statuses_for_fetch = ['Pendente', 'Em Preparo', 'Pronto']
@@ -434,43 +750,23 @@ def api_kds_orders():
         logging.warning(f"/api/kds/orders: Status de busca inválido '{requested_status}'.")
         return jsonify({"error": f"Status de busca inválido. Permitidos: {', '.join(valid_statuses_for_fetch)}"}), 400
 
-    logging.info(f"/api/kds/orders: Iniciando busca de pedidos com status '{requested_status}'. orders_collection is {'None' if orders_collection is None else 'válida'}.")
+    limit = request.args.get('limit', KDS_PAGE_SIZE, type=int)
+    if limit < 1 or limit > KDS_MAX_PAGE_SIZE:
+        return jsonify({"error": f"Parâmetro 'limit' deve estar entre 1 e {KDS_MAX_PAGE_SIZE}."}), 400
+    try:
+        page_cursor = parse_page_cursor(request.args.get('after'), request.args.get('after_id'))
+    except ValueError as e:
+        logging.warning(f"/api/kds/orders: Cursor de paginação inválido: {e}")
+        return jsonify({"error": "Parâmetros 'after'/'after_id' inválidos."}), 400
+
     if orders_collection is not None:
         try:
-            logging.info(f"/api/kds/orders: Tentando buscar e ordenar pedidos com status '{requested_status}' do MongoDB.")
             # Ordena pelo mais antigo primeiro para 'Pendente' e 'Em Preparo',
             # e mais recente primeiro para 'Pronto'.
             sort_order = 1 if requested_status in ['Pendente', 'Em Preparo'] else -1
-            
-            kds_orders_cursor = orders_collection.find({"status": requested_status}).sort("timestamp", sort_order)
-            kds_orders = list(kds_orders_cursor) # Executa a consulta
-            logging.info(f"/api/kds/orders: Encontrados {len(kds_orders)} pedidos com status '{requested_status}'.")
-            
-            processed_orders = []
-            for order_data in kds_orders: 
-                order_data['_id'] = str(order_data['_id']) # Converte ObjectId para string
-                
-                timestamp_obj = order_data.get('timestamp')
-                if isinstance(timestamp_obj, datetime.datetime):
-                    # O timestamp_obj do MongoDB é um datetime ingênuo (sem fuso) representando UTC.
-                    # Torna-o ciente do UTC antes de converter para string ISO.
-                    aware_utc_timestamp = timestamp_obj.replace(tzinfo=datetime.timezone.utc)
-                    order_data['timestamp_iso'] = aware_utc_timestamp.isoformat()
-                else:
-                    if timestamp_obj is not None:
-                        logging.warning(f"/api/kds/orders: Timestamp para pedido {order_data['_id']} não é um objeto datetime, é {type(timestamp_obj)}.")
-                        order_data['timestamp_iso'] = str(timestamp_obj) # Fallback
-                    else:
-                        order_data['timestamp_iso'] = None
-                
-                # Remove o objeto datetime original para evitar problemas de serialização JSON.
-                if 'timestamp' in order_data:
-                    del order_data['timestamp']
-                
-                processed_orders.append(order_data)
-
-            logging.info(f"/api/kds/orders: Processamento concluído. Retornando {len(processed_orders)} pedidos.")
-            return jsonify(processed_orders)
+            kds_orders_cursor = find_kds_orders(orders_collection, requested_status, sort_order, page_cursor, limit)
+            # Lê o primeiro documento antes de iniciar a resposta para que erros do banco ainda gerem um status HTTP adequado.
+            first_order = next(kds_orders_cursor, None)
         except OperationFailure as op_e: 
             logging.exception(f"/api/kds/orders: Erro de operação do MongoDB (OperationFailure) ao buscar pedidos: {op_e.details if hasattr(op_e, 'details') else op_e}")
             return jsonify({"error": f"Erro de banco de dados ao carregar pedidos: {op_e.code if hasattr(op_e, 'code') else 'N/A'}", "details": op_e.details if hasattr(op_e, 'details') else str(op_e)}), 500
@@ -480,10 +776,59 @@ def api_kds_orders():
         except Exception as e:
             logging.exception("/api/kds/orders: Erro DENTRO DO TRY ao buscar/processar pedidos para a API KDS.")
             return jsonify({"error": "Erro ao carregar pedidos (interno)."}), 500
+
+        def generate_orders_json():
+            yield "["
+            order_data, count = first_order, 0
+            try:
+                while order_data is not None:
+                    yield ("," if count else "") + app.json.dumps(serialize_kds_order(order_data))
+                    count += 1
+                    order_data = next(kds_orders_cursor, None)
+            except Exception:
+                # A resposta já começou; encerra o array com os pedidos enviados até aqui.
+                logging.exception("/api/kds/orders: Erro ao transmitir pedidos para a API KDS.")
+            finally:
+                kds_orders_cursor.close()
+            yield "]"
+            logging.info(f"/api/kds/orders: {count} pedidos com status '{requested_status}' enviados.")
+
+        return Response(stream_with_context(generate_orders_json()), mimetype='application/json')
     else:
         logging.error("/api/kds/orders: orders_collection é None. Coleção de pedidos (MongoDB) não está disponível.")
         return jsonify({"error": "Serviço de banco de dados não disponível (orders_collection is None)."}), 503
 
+# --- API Endpoint: Feed de Pedidos KDS (Server-Sent Events) ---
+@app.route('/api/kds/stream', methods=['GET'])
+def api_kds_stream():
+    """
+    Envia aos KDS os pedidos novos (evento "order_created") e as mudanças de status
+    ("order_updated") assim que acontecem, em vez de consultas periódicas a /api/kds/orders.
+    Cada evento traz um id; ao reconectar, o navegador o reenvia no cabeçalho Last-Event-ID
+    (ou no parâmetro ?last_event_id=) e recebe apenas os eventos perdidos. Se não for
+    possível retomar, o evento "resync" indica que a tela deve recarregar a lista completa.
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    subscription = order_feed.subscribe(last_event_id)
+
+    def generate_events():
+        try:
+            yield "retry: 3000\n\n" # Intervalo de reconexão do EventSource (ms)
+            while True:
+                if subscription.needs_resync:
+                    subscription.needs_resync = False
+                    yield _sse_event("resync", {})
+                event = subscription.get(timeout=KDS_STREAM_HEARTBEAT)
+                if event is None:
+                    yield ": keep-alive\n\n" # Mantém a conexão aberta através de proxies
+                    continue
+                yield f"id: {event.id}\n" + _sse_event(event.name, event.data)
+        finally:
+            subscription.close()
+
+    sse_headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(generate_events()), mimetype='text/event-stream', headers=sse_headers)
+
 # --- API Endpoint: Atualizar Status do Pedido KDS ---
 @app.route('/api/kds/order/<order_id>/status', methods=['PUT'])
 def update_kds_order_status(order_id):
@@ -526,6 +871,7 @@ def update_kds_order_status(order_id):
             return jsonify({"message": f"Status do pedido já era '{new_status}'."}), 200
 
         logging.info(f"PUT /api/kds/order/{order_id}/status: Status do pedido atualizado para '{new_status}'.")
+        order_feed.notify_status_changed(order_id, new_status)
         return jsonify({"message": "Status do pedido atualizado com sucesso."}), 200
 
     except OperationFailure as op_e:
@@ -536,7 +882,14 @@ def update_kds_order_status(order_id):
         return jsonify({"error": "Erro interno ao atualizar status do pedido."}), 500
 
 
+# --- Endpoint: Métricas (Prometheus) ---
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Exporta as métricas deste processo no formato texto do Prometheus."""
+    return Response(render_prometheus(REGISTRY), content_type=PROMETHEUS_CONTENT_TYPE)
+
 # --- Execução da Aplicação ---
+# Servidor de desenvolvimento. Em produção, use o gunicorn (ver gunicorn.conf.py).
 if __name__ == '__main__':
     logging.info("Iniciando servidor Flask...")
-    app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
+    create_app().run(host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,156 @@
+import logging
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from nlp.text import normalize_text
+
+CENT = Decimal('0.01')
+
+
+def to_cents(price):
+    """Converte um preço (Decimal, float ou str) em centavos inteiros."""
+    return int((Decimal(str(price)).quantize(CENT, rounding=ROUND_HALF_UP) * 100).to_integral_value())
+
+
+def cents_to_decimal(cents):
+    """Converte centavos inteiros em Decimal com duas casas ("20.50")."""
+    return (Decimal(cents) / 100).quantize(CENT)
+
+
+class CartLine:
+    """Linha do carrinho: item, quantidade e preço unitário em centavos."""
+    __slots__ = ("name", "quantity", "unit_cents")
+
+    def __init__(self, name, quantity, unit_cents):
+        self.name = name
+        self.quantity = quantity
+        self.unit_cents = unit_cents
+
+    @property
+    def unit_price(self):
+        return cents_to_decimal(self.unit_cents)
+
+    @property
+    def subtotal_cents(self):
+        return self.unit_cents * self.quantity
+
+    @property
+    def subtotal(self):
+        return cents_to_decimal(self.subtotal_cents)
+
+    def to_dict(self):
+        """Formato usado nas respostas da API e no documento do pedido."""
+        return {"name": self.name, "quantity": self.quantity, "price": str(self.unit_price)}
+
+
+class Cart:
+    """
+    Carrinho de compras da sessão do chat.
+
+    As linhas ficam em um dicionário indexado pelo nome normalizado do item (na ordem
+    em que foram adicionadas), e o total é mantido em centavos a cada alteração,
+    então incluir, alterar ou remover um item custa O(1).
+    Na sessão, o carrinho é gravado como uma lista compacta de [nome, quantidade, centavos].
+    """
+    __slots__ = ("_lines", "_total_cents")
+
+    def __init__(self):
+        self._lines = {} # {nome_normalizado: CartLine}
+        self._total_cents = 0
+
+    @classmethod
+    def from_session(cls, data, menu_data=None):
+        """
+        Reconstrói o carrinho a partir da sessão. Aceita o formato compacto e o formato antigo
+        (lista de dicionários {"name", "quantity", "price"}); entradas inválidas são descartadas.
+
+        Args:
+            data: Carrinho gravado na sessão (ou um Cart, que é copiado).
+            menu_data (dict): Cardápio usado para obter o preço de itens antigos gravados sem preço.
+        """
+        if isinstance(data, Cart):
+            return data.copy()
+        cart = cls()
+        for entry in data or ():
+            try:
+                if isinstance(entry, dict):
+                    price = entry.get("price")
+                    if price is None and menu_data:
+                        price = (menu_data.get(entry["name"].lower()) or {}).get("price")
+                    name, quantity, unit_cents = entry["name"], int(entry.get("quantity", 1)), to_cents(price)
+                else:
+                    name, quantity, unit_cents = entry[0], int(entry[1]), int(entry[2])
+            except (KeyError, IndexError, TypeError, ValueError, InvalidOperation) as e:
+                logging.warning(f"Item de carrinho inválido na sessão ignorado: {entry} ({e})")
+                continue
+            cart.set_quantity(name, quantity, unit_cents=unit_cents)
+        return cart
+
+    def to_session(self):
+        """Formato compacto gravado na sessão."""
+        return [[line.name, line.quantity, line.unit_cents] for line in self._lines.values()]
+
+    def to_list(self):
+        """Lista de itens para a API e para o documento do pedido."""
+        return [line.to_dict() for line in self._lines.values()]
+
+    def copy(self):
+        cart = Cart()
+        cart._lines = {key: CartLine(line.name, line.quantity, line.unit_cents) for key, line in self._lines.items()}
+        cart._total_cents = self._total_cents
+        return cart
+
+    def set_quantity(self, name, quantity, price=None, unit_cents=None):
+        """
+        Define a quantidade de um item, substituindo a anterior; quantidade 0 remove o item.
+
+        Args:
+            name (str): Nome do item como no cardápio.
+            quantity (int): Nova quantidade.
+            price: Preço unitário (Decimal, float ou str), usado se unit_cents não for informado.
+            unit_cents (int): Preço unitário em centavos.
+        """
+        key = normalize_text(name)
+        line = self._lines.get(key)
+        if line is not None:
+            self._total_cents -= line.subtotal_cents
+        if quantity <= 0:
+            if line is not None:
+                del self._lines[key]
+            return
+        if unit_cents is None:
+            unit_cents = to_cents(price)
+        if line is None:
+            self._lines[key] = CartLine(name, quantity, unit_cents)
+        else:
+            line.name, line.quantity, line.unit_cents = name, quantity, unit_cents
+        self._total_cents += quantity * unit_cents
+
+    def remove(self, name):
+        self.set_quantity(name, 0)
+
+    def clear(self):
+        self._lines.clear()
+        self._total_cents = 0
+
+    def get(self, name):
+        """Linha do item com esse nome (comparação normalizada) ou None."""
+        return self._lines.get(normalize_text(name))
+
+    @property
+    def total_cents(self):
+        return self._total_cents
+
+    @property
+    def total(self):
+        return cents_to_decimal(self._total_cents)
+
+    def __iter__(self):
+        return iter(self._lines.values())
+
+    def __len__(self):
+        return len(self._lines)
+
+    def __bool__(self):
+        return bool(self._lines)
+
+    def __repr__(self):
+        return f"Cart({self.to_session()!r})"
@@ -1,24 +1,42 @@
 import logging
 import re
-from decimal import Decimal, InvalidOperation
+from decimal import Decimal
+from chatbot.cart import Cart
+from menu.index import get_menu_index
+from metrics.spans import Span
+
+# Prefixo das respostas dadas sem o LLM quando ele está sobrecarregado.
+OVERLOAD_NOTICE = "Estamos com muitos pedidos agora e o assistente está mais lento."
 
 class ChatbotHandler:
     """
     Classe responsável por intermediar a comunicação entre a aplicação Flask
     e a integração com o LLM, além de gerenciar a lógica do chat.
     """
-    def __init__(self, llm_integration):
+    def __init__(self, llm_integration, order_parser=None, history_compactor=None):
         """
         Inicializa o handler com uma instância da integração LLM.
 
         Args:
             llm_integration: Objeto responsável pela comunicação com o LLM.
+            order_parser: Parser local de pedidos simples (opcional). Quando resolve a mensagem,
+                          a confirmação é gerada sem chamar o LLM.
+            history_compactor: HistoryCompactor que limita o histórico enviado ao LLM por um orçamento
+                               de tokens (opcional). Sem ele, o histórico é repassado como está.
         """
         if llm_integration is None:
              raise ValueError("llm_integration não pode ser None")
         self.llm_integration = llm_integration
+        self.order_parser = order_parser
+        self.history_compactor = history_compactor
         logging.info("ChatbotHandler inicializado.")
 
+    def _history_for_llm(self, conversation_history, current_cart):
+        """Histórico enviado ao LLM: compactado pelo orçamento de tokens, quando configurado."""
+        if self.history_compactor is None:
+            return conversation_history
+        return self.history_compactor.compact(conversation_history, current_cart)
+
     def _parse_and_validate_items_from_llm_response(self, llm_response_text, menu_data):
         """
         Extrai itens da resposta do LLM (seja confirmação ou listagem)
@@ -66,8 +84,8 @@ class ChatbotHandler:
                 menu_item_details = menu_data.get(parsed_name.lower())
 
                 if menu_item_details is None:
-                    name_base = re.sub(r'\s*\(.*\)$', '', parsed_name).strip().lower()
-                    menu_item_details = menu_data.get(name_base)
+                    # Variações de acento, plural e digitação são resolvidas pelo índice do cardápio
+                    menu_item_details = get_menu_index(menu_data).lookup(parsed_name)
                 
                 if menu_item_details:
                     validated_items.append({
@@ -86,158 +104,293 @@ class ChatbotHandler:
     def update_cart_from_validated(self, current_cart, validated_items_from_llm):
         """
         Atualiza o carrinho com base nos itens validados da resposta do LLM.
+        A quantidade de cada item substitui a anterior; quantidade 0 remove o item.
+        Retorna um novo Cart, sem alterar current_cart.
         """
-        updated_cart = list(current_cart) 
-
+        updated_cart = Cart.from_session(current_cart)
         for llm_item in validated_items_from_llm:
-            llm_item_name_lower = llm_item['name'].lower()
-            found_in_cart = False
-            
-            for i in range(len(updated_cart) -1, -1, -1):
-                cart_item = updated_cart[i]
-                if cart_item['name'].lower() == llm_item_name_lower:
-                    if llm_item['quantity'] > 0:
-                        cart_item['quantity'] = llm_item['quantity']
-                        cart_item['price'] = llm_item['price'] 
-                    else: 
-                        updated_cart.pop(i)
-                    found_in_cart = True
-                    break 
-            
-            if not found_in_cart and llm_item['quantity'] > 0:
-                updated_cart.append({
-                    "name": llm_item['name'],
-                    "quantity": llm_item['quantity'],
-                    "price": llm_item['price']
-                })
+            updated_cart.set_quantity(llm_item['name'], llm_item['quantity'], price=llm_item['price'])
         return updated_cart
 
     def format_order_details(self, cart, menu_data, include_total=False, for_confirmation=True):
         """
         Formata os detalhes do pedido para exibição.
+        Retorna uma tupla: (texto_dos_itens, total em Decimal).
         """
+        cart = cart if isinstance(cart, Cart) else Cart.from_session(cart, menu_data)
         if not cart:
             return "Seu carrinho está vazio.", Decimal('0.00')
 
-        details_parts = []
-        total_geral = Decimal('0.00')
-
-        for item_in_cart in cart:
-            item_name_original = item_in_cart['name']
-            quantity = item_in_cart.get('quantity', 1)
-            price_unit = item_in_cart.get('price')
-
-            if price_unit is not None:
-                try:
-                    price_unit = Decimal(str(price_unit))
-                    item_total = price_unit * quantity
-                    total_geral += item_total
-                    if for_confirmation: 
-                        details_parts.append(f"- {quantity}x {item_name_original}")
-                    else: 
-                        details_parts.append(f"- {quantity}x {item_name_original} (R$ {price_unit:.2f} cada) = R$ {item_total:.2f}")
-                except InvalidOperation:
-                    details_parts.append(f"- {quantity}x {item_name_original} (Erro no preço)")
-                    logging.error(f"Erro ao converter preço para Decimal para o item '{item_name_original}' no carrinho.")
-            else:
-                menu_item_details = menu_data.get(item_name_original.lower())
-                if menu_item_details and menu_item_details.get('price') is not None:
-                    price_unit = menu_item_details['price']
-                    item_total = price_unit * quantity
-                    total_geral += item_total
-                    if for_confirmation:
-                        details_parts.append(f"- {quantity}x {item_name_original}")
-                    else:
-                        details_parts.append(f"- {quantity}x {item_name_original} (R$ {price_unit:.2f} cada) = R$ {item_total:.2f}")
-                else:
-                    details_parts.append(f"- {quantity}x {item_name_original} (Preço indisponível)")
-                    logging.warning(f"Preço para '{item_name_original}' não encontrado no carrinho nem no menu_data ao formatar detalhes.")
+        if for_confirmation:
+            details_parts = [f"- {line.quantity}x {line.name}" for line in cart]
+        else:
+            details_parts = [
+                f"- {line.quantity}x {line.name} (R$ {line.unit_price:.2f} cada) = R$ {line.subtotal:.2f}"
+                for line in cart
+            ]
 
         details_str = "\n".join(details_parts)
         if include_total:
-            details_str += f"\n\nTotal: R$ {total_geral:.2f}"
+            details_str += f"\n\nTotal: R$ {cart.total:.2f}"
         
-        return details_str, total_geral
+        return details_str, cart.total
 
     def calculate_total(self, cart, menu_data):
         """Calcula o total do carrinho."""
-        _, total = self.format_order_details(cart, menu_data, include_total=True, for_confirmation=False)
-        return total
+        cart = cart if isinstance(cart, Cart) else Cart.from_session(cart, menu_data)
+        return cart.total
+
+    def _build_confirmation_output(self, validated_items, current_cart, menu_data):
+        """
+        Atualiza o carrinho com os itens validados e monta a mensagem de confirmação
+        detalhada ("Entendido. Você pediu: ... Correto?").
+        """
+        output = {"action": "needs_confirmation"}
+        output["cart_updated"] = self.update_cart_from_validated(current_cart, validated_items)
+        
+        # Gerar a string detalhada dos itens do carrinho ATUALIZADO para a confirmação
+        # Usamos for_confirmation=False para obter o formato detalhado com preços
+        detailed_items_string, _ = self.format_order_details(
+            output["cart_updated"], # Carrinho que reflete os itens entendidos
+            menu_data, 
+            include_total=True,    # Inclui o "Total: R$ ZZ.ZZ"
+            for_confirmation=False # Formato: "- Quantidade x Nome (Preço cada) = Subtotal"
+        )
+        
+        # Construir a nova mensagem de confirmação formatada
+        output["llm_response"] = f"Entendido. Você pediu:\n{detailed_items_string}\nCorreto?"
+        
+        logging.info(f"Itens para confirmação (reformatados): {output['cart_updated']}. Mensagem enviada ao usuário: {output['llm_response']}")
+        return output
+
+    def _try_local_order(self, user_input, current_cart, menu_data):
+        """
+        Tenta resolver a mensagem com o parser local de pedidos.
+        Retorna o output de confirmação ou None quando a mensagem deve seguir para o LLM.
+        """
+        if self.order_parser is None:
+            return None
+        try:
+            parsed_items = self.order_parser.parse(user_input, menu_data)
+        except Exception as e:
+            logging.exception(f"Erro no parser local de pedidos; usando o LLM: {e}")
+            return None
+        if not parsed_items:
+            return None
+        return self._build_confirmation_output(parsed_items, current_cart, menu_data)
+
+    def _build_degraded_output(self, current_cart, menu_data):
+        """
+        Resposta determinística usada quando o LLM está sobrecarregado: com itens no carrinho,
+        pede a confirmação do pedido atual; caso contrário, lista o cardápio e sugere
+        o formato de pedido que o parser local entende.
+        """
+        if current_cart:
+            output = self._build_confirmation_output([], current_cart, menu_data)
+            output["llm_response"] = (
+                f"{OVERLOAD_NOTICE} Responda \"sim\" para finalizar ou diga o que quer alterar.\n\n"
+                f"{output['llm_response']}"
+            )
+            return output
+
+        output = {"action": "none", "cart_updated": current_cart.copy()}
+        if not menu_data:
+            output["llm_response"] = f"{OVERLOAD_NOTICE} Por favor, tente novamente em alguns segundos."
+            return output
+        menu_lines = "\n".join(
+            f"- {details['original_name']} (R$ {details['price']:.2f})" for details in menu_data.values()
+        )
+        output["llm_response"] = (
+            f"{OVERLOAD_NOTICE} Para agilizar, peça pelo nome e pela quantidade "
+            f"(ex.: \"2 {next(iter(menu_data.values()))['original_name']}\").\n\nNosso cardápio:\n{menu_lines}"
+        )
+        return output
+
+    def _validate_structured_items(self, items, menu_data):
+        """Associa os itens da resposta estruturada ao cardápio; itens desconhecidos são descartados."""
+        menu_index = get_menu_index(menu_data)
+        validated_items = []
+        for item in items:
+            details = menu_index.lookup(item["name"])
+            if details is None:
+                logging.warning(f"Item '{item['name']}' da resposta estruturada não encontrado no cardápio.")
+                continue
+            validated_items.append({
+                "name": details["original_name"],
+                "quantity": item["quantity"],
+                "price": details["price"]
+            })
+        return validated_items
+
+    def _interpret_structured_response(self, structured, current_cart, last_bot_message, menu_data):
+        """
+        Determina as ações do turno a partir da resposta estruturada do LLM
+        (intenção, itens e mensagem), sem analisar o texto da resposta.
+        """
+        intent = structured["intent"]
+        output = {
+            "llm_response": structured["reply"],
+            "action": "none",
+            "cart_updated": current_cart.copy()
+        }
+
+        if intent == "order":
+            validated_items = self._validate_structured_items(structured["items"], menu_data)
+            if validated_items:
+                output = self._build_confirmation_output(validated_items, current_cart, menu_data)
+            elif not output["llm_response"]:
+                output["llm_response"] = "Desculpe, não encontrei esse item no cardápio. Gostaria de pedir algum dos itens disponíveis?"
+
+        elif intent == "confirm" and (last_bot_message or "").strip().endswith("Correto?"):
+            logging.info("LLM (estruturado) identificou a confirmação do pedido.")
+            output["action"] = "finalize_order_confirmed"
+
+        elif intent == "deny":
+            output["llm_response"] = output["llm_response"] or "Entendido. O que você gostaria de alterar ou adicionar?"
+
+        elif intent == "clear_cart":
+            logging.info("LLM (estruturado) indicou que o carrinho deve ser limpo.")
+            output["action"] = "clear_cart"
+            output["cart_updated"] = Cart()
+            output["llm_response"] = output["llm_response"] or "Tudo bem, seu carrinho foi esvaziado."
+
+        return output
+
+    def _interpret_llm_response(self, llm_response_text, current_cart, menu_data):
+        """
+        Analisa a resposta completa do LLM e determina as ações a serem tomadas
+        no carrinho e na conversa.
+        """
+        output = {
+            "llm_response": llm_response_text, # Pode ser sobrescrita abaixo
+            "action": "none",
+            "cart_updated": current_cart.copy()
+        }
+
+        # 1. Verificar se o LLM está pedindo confirmação
+        if "Você pediu:" in llm_response_text and llm_response_text.strip().endswith("Correto?"):
+            logging.info(f"LLM gerou uma mensagem de confirmação: '{llm_response_text}'")
+            # Parsear itens da resposta ORIGINAL do LLM para entender o que ele listou
+            validated_items_from_llm = self._parse_and_validate_items_from_llm_response(llm_response_text, menu_data)
+            
+            if validated_items_from_llm:
+                # Atualizar o carrinho com base nos itens que o LLM listou e reformatar a confirmação
+                output = self._build_confirmation_output(validated_items_from_llm, current_cart, menu_data)
+            else:
+                # LLM tentou confirmar, mas não conseguimos parsear itens válidos da sua resposta.
+                # Mantém a resposta original do LLM e não define ação de confirmação.
+                logging.warning("LLM pediu confirmação, mas nenhum item válido foi parseado. Usando resposta original do LLM.")
+
+        # 2. Verificar se o LLM finalizou o pedido
+        elif "pedido foi anotado e enviado para a cozinha" in llm_response_text:
+            logging.info("LLM gerou uma mensagem de finalização de pedido.")
+            output["action"] = "finalize_order_confirmed"
+            # output["llm_response"] já é a mensagem de finalização do LLM.
+
+        # 3. Verificar se o LLM indicou limpeza do carrinho
+        elif "carrinho foi esvaziado" in llm_response_text.lower() or \
+             "itens foram removidos do seu carrinho" in llm_response_text.lower() or \
+             "seu carrinho está vazio agora" in llm_response_text.lower():
+            logging.info("LLM indicou que o carrinho foi/deve ser limpo.")
+            output["action"] = "clear_cart"
+            output["cart_updated"] = Cart()
+            # output["llm_response"] já é a mensagem do LLM sobre o carrinho vazio.
+        
+        # Se nenhuma ação específica foi detectada, output["llm_response"] já contém llm_response_text.
+        return output
 
-    def process_input(self, user_input, current_cart, conversation_history, last_bot_message, menu_data):
+    def process_input(self, user_input, current_cart, conversation_history, last_bot_message, menu_data, admission=None):
         """
         Processa a entrada do usuário, interage com o LLM, analisa a resposta
         e determina as ações a serem tomadas no carrinho e na conversa.
+        current_cart pode ser um Cart ou o carrinho gravado na sessão; output["cart_updated"] é sempre um Cart.
+        admission é a AdmissionDecision do turno, quando já criada por quem chama (ex.: o app).
         """
+        current_cart = Cart.from_session(current_cart, menu_data)
         output = {
             "llm_response": "Desculpe, não consegui processar sua solicitação.", # Default
             "action": "none",
-            "cart_updated": list(current_cart)
+            "cart_updated": current_cart.copy()
         }
 
         try:
+            # Pedidos simples e inequívocos são confirmados sem chamar o LLM
+            with Span("handler.local_parse"):
+                local_output = self._try_local_order(user_input, current_cart, menu_data)
+            if local_output is not None:
+                return local_output
+
+            # Com o LLM sobrecarregado, responde na hora em vez de esperar na fila
+            if (admission or self.llm_integration.admission_decision()).overloaded:
+                return self._build_degraded_output(current_cart, menu_data)
+
+            conversation_history = self._history_for_llm(conversation_history, current_cart)
+
+            # No modo estruturado, uma única chamada devolve intenção, itens e resposta
+            if self.llm_integration.output_format != "text":
+                with Span("handler.llm"):
+                    structured = self.llm_integration.generate_structured_response(user_input, conversation_history)
+                if structured is not None:
+                    with Span("handler.interpret"):
+                        return self._interpret_structured_response(structured, current_cart, last_bot_message, menu_data)
+
             # Obter a resposta do LLM
-            llm_response_text = self.llm_integration.generate_response(user_input, conversation_history)
-            
-            # Definir a resposta do LLM como padrão, pode ser sobrescrita abaixo
-            output["llm_response"] = llm_response_text 
-
-            # 1. Verificar se o LLM está pedindo confirmação
-            if "Você pediu:" in llm_response_text and llm_response_text.strip().endswith("Correto?"):
-                logging.info(f"LLM gerou uma mensagem de confirmação: '{llm_response_text}'")
-                # Parsear itens da resposta ORIGINAL do LLM para entender o que ele listou
-                validated_items_from_llm = self._parse_and_validate_items_from_llm_response(llm_response_text, menu_data)
-                
-                if validated_items_from_llm:
-                    # Atualizar o carrinho com base nos itens que o LLM listou
-                    output["cart_updated"] = self.update_cart_from_validated(list(current_cart), validated_items_from_llm)
-                    output["action"] = "needs_confirmation"
-                    
-                    # Gerar a string detalhada dos itens do carrinho ATUALIZADO para a confirmação
-                    # Usamos for_confirmation=False para obter o formato detalhado com preços
-                    detailed_items_string, _ = self.format_order_details(
-                        output["cart_updated"], # Carrinho que reflete o que o LLM entendeu
-                        menu_data, 
-                        include_total=True,    # Inclui o "Total: R$ ZZ.ZZ"
-                        for_confirmation=False # Formato: "- Quantidade x Nome (Preço cada) = Subtotal"
-                    )
-                    
-                    # Construir a nova mensagem de confirmação formatada
-                    formatted_confirmation_message = f"Entendido. Você pediu:\n{detailed_items_string}\nCorreto?"
-                    output["llm_response"] = formatted_confirmation_message # Sobrescreve a resposta do LLM
-                    
-                    logging.info(f"Itens para confirmação (reformatados): {output['cart_updated']}. Mensagem enviada ao usuário: {output['llm_response']}")
-                else:
-                    # LLM tentou confirmar, mas não conseguimos parsear itens válidos da sua resposta.
-                    # Mantém a resposta original do LLM e não define ação de confirmação.
-                    logging.warning("LLM pediu confirmação, mas nenhum item válido foi parseado. Usando resposta original do LLM.")
-                    # A ação permanece "none" ou a resposta do LLM pode levar a outro fluxo.
-                    # Se output["llm_response"] já foi setado com llm_response_text, está ok.
-
-            # 2. Verificar se o LLM finalizou o pedido
-            elif "pedido foi anotado e enviado para a cozinha" in llm_response_text:
-                logging.info("LLM gerou uma mensagem de finalização de pedido.")
-                output["action"] = "finalize_order_confirmed"
-                # output["llm_response"] já é a mensagem de finalização do LLM.
-
-            # 3. Verificar se o LLM indicou limpeza do carrinho
-            elif "carrinho foi esvaziado" in llm_response_text.lower() or \
-                 "itens foram removidos do seu carrinho" in llm_response_text.lower() or \
-                 "seu carrinho está vazio agora" in llm_response_text.lower():
-                logging.info("LLM indicou que o carrinho foi/deve ser limpo.")
-                output["action"] = "clear_cart"
-                output["cart_updated"] = []
-                # output["llm_response"] já é a mensagem do LLM sobre o carrinho vazio.
-            
-            # Se nenhuma ação específica foi detectada, output["llm_response"] já contém llm_response_text.
+            with Span("handler.llm"):
+                llm_response_text = self.llm_integration.generate_response(user_input, conversation_history)
+            with Span("handler.interpret"):
+                output = self._interpret_llm_response(llm_response_text, current_cart, menu_data)
 
         except Exception as e:
             logging.exception(f"Erro em ChatbotHandler.process_input: {e}")
             output["llm_response"] = "Desculpe, ocorreu um erro interno ao falar com o assistente."
-            output["cart_updated"] = list(current_cart) # Garante que o carrinho não seja corrompido
+            output["cart_updated"] = current_cart.copy() # Garante que o carrinho não seja corrompido
         
         # Garantir que sempre há uma resposta do LLM no output, mesmo que seja a de erro padrão.
         if output.get("llm_response") is None:
              output["llm_response"] = "Desculpe, não consegui processar sua solicitação."
 
-        return output
\ No newline at end of file
+        return output
+
+    def process_input_stream(self, user_input, current_cart, conversation_history, last_bot_message, menu_data, admission=None):
+        """
+        Variante de process_input que repassa os tokens do LLM à medida que são gerados.
+
+        Produz tuplas ("token", texto) durante a geração e, ao final, uma única tupla
+        ("result", output), onde output tem o mesmo formato retornado por process_input.
+        A análise de confirmação e a atualização do carrinho são feitas sobre o texto completo,
+        portanto output["llm_response"] pode diferir do texto transmitido (ex.: confirmação reformatada).
+        No modo estruturado não há texto parcial para transmitir, e o resultado é produzido de uma vez.
+        """
+        current_cart = Cart.from_session(current_cart, menu_data)
+        if self.llm_integration.output_format != "text":
+            yield "result", self.process_input(
+                user_input, current_cart, conversation_history, last_bot_message, menu_data, admission
+            )
+            return
+
+        local_output = self._try_local_order(user_input, current_cart, menu_data)
+        if local_output is not None:
+            yield "result", local_output
+            return
+        if (admission or self.llm_integration.admission_decision()).overloaded:
+            yield "result", self._build_degraded_output(current_cart, menu_data)
+            return
+
+        chunks = []
+        try:
+            conversation_history = self._history_for_llm(conversation_history, current_cart)
+            for chunk in self.llm_integration.generate_response_stream(user_input, conversation_history):
+                chunks.append(chunk)
+                yield "token", chunk
+            output = self._interpret_llm_response("".join(chunks).strip(), current_cart, menu_data)
+        except Exception as e:
+            logging.exception(f"Erro em ChatbotHandler.process_input_stream: {e}")
+            output = {
+                "llm_response": "Desculpe, ocorreu um erro interno ao falar com o assistente.",
+                "action": "none",
+                "cart_updated": current_cart.copy() # Garante que o carrinho não seja corrompido
+            }
+
+        if not output.get("llm_response"):
+             output["llm_response"] = "Desculpe, não consegui processar sua solicitação."
+        yield "result", output
@@ -0,0 +1,89 @@
+import math
+import re
+from metrics.registry import REGISTRY
+
+# Mensagens de confirmação geradas por ChatbotHandler._build_confirmation_output (e as do LLM no mesmo formato).
+CONFIRMATION_PATTERN = re.compile(r'Você\s+pediu:.*Correto\?\s*$', re.IGNORECASE | re.DOTALL)
+# Substitui as confirmações no histórico; os itens vão uma única vez na linha do carrinho.
+CONFIRMATION_PLACEHOLDER = "(Resumo do pedido enviado para confirmação.)"
+# A confirmação mais recente mantém a pergunta: o prompt só finaliza o pedido após um "Correto?".
+LAST_CONFIRMATION_PLACEHOLDER = f"{CONFIRMATION_PLACEHOLDER} Correto?"
+
+HISTORY_PROMPT_TOKENS = REGISTRY.histogram(
+    "llm_history_tokens", "Tokens estimados do histórico enviado ao LLM.",
+    (16, 32, 64, 128, 256, 512, 1024)
+)
+HISTORY_DROPPED_MESSAGES = REGISTRY.counter(
+    "llm_history_dropped_messages_total", "Mensagens antigas deixadas fora do prompt pelo orçamento de tokens."
+)
+
+
+class HistoryCompactor:
+    """
+    Monta o histórico enviado ao LLM dentro de um orçamento de tokens.
+
+    As confirmações longas (itens, preços e total) são trocadas por uma frase curta (a mais recente
+    mantém o "Correto?"), e o estado do carrinho, que é a fonte de verdade na sessão, entra uma
+    única vez como uma linha compacta no fim.
+    As mensagens mais recentes são mantidas na íntegra enquanto couberem no orçamento; as mais
+    antigas são descartadas. Os tokens são estimados pelo número de caracteres, sem tokenizador.
+    """
+    def __init__(self, token_budget=256, chars_per_token=4, message_overhead_tokens=4):
+        """
+        Args:
+            token_budget (int): Tokens estimados disponíveis para o histórico (inclui a linha do carrinho).
+            chars_per_token (float): Caracteres por token na estimativa (~4 para português).
+            message_overhead_tokens (int): Tokens somados por mensagem (rótulo do papel e separadores).
+        """
+        if token_budget <= 0:
+            raise ValueError("token_budget deve ser maior que zero.")
+        self.token_budget = token_budget
+        self.chars_per_token = chars_per_token
+        self.message_overhead_tokens = message_overhead_tokens
+
+    def estimate_tokens(self, text):
+        """Estimativa dos tokens de uma mensagem do histórico."""
+        return math.ceil(len(text) / self.chars_per_token) + self.message_overhead_tokens
+
+    @staticmethod
+    def cart_state_line(cart):
+        """Linha compacta com o conteúdo do carrinho, ou None se ele estiver vazio."""
+        if not cart:
+            return None
+        items = ", ".join(f"{line.quantity}x {line.name}" for line in cart)
+        return f"Carrinho atual do cliente: {items} (total R$ {cart.total:.2f})."
+
+    def compact(self, conversation_history, cart=None):
+        """
+        Retorna o histórico compactado no formato [{"role", "content"}].
+        A linha do carrinho, quando existe, vem por último com role "system".
+
+        Args:
+            conversation_history (list): Histórico gravado na sessão, do mais antigo ao mais recente.
+            cart (Cart): Carrinho atual da sessão (opcional).
+        """
+        cart_line = self.cart_state_line(cart)
+        remaining = self.token_budget
+        if cart_line:
+            remaining -= self.estimate_tokens(cart_line)
+
+        kept = []
+        entries = conversation_history or []
+        placeholder = LAST_CONFIRMATION_PLACEHOLDER
+        for index in range(len(entries) - 1, -1, -1):
+            role = entries[index].get("role")
+            content = entries[index].get("content", "")
+            if role != "user" and CONFIRMATION_PATTERN.search(content):
+                content, placeholder = placeholder, CONFIRMATION_PLACEHOLDER
+            tokens = self.estimate_tokens(content)
+            if tokens > remaining:
+                HISTORY_DROPPED_MESSAGES.inc(index + 1)
+                break
+            remaining -= tokens
+            kept.append({"role": role, "content": content})
+        kept.reverse()
+
+        if cart_line:
+            kept.append({"role": "system", "content": cart_line})
+        HISTORY_PROMPT_TOKENS.observe(self.token_budget - remaining)
+        return kept
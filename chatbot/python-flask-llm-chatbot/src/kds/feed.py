@@ -0,0 +1,227 @@
+import datetime
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from pymongo.errors import OperationFailure, PyMongoError
+from kds.orders import serialize_kds_order
+from metrics.registry import REGISTRY
+from mongo.errors import CHANGE_STREAM_NOT_SUPPORTED
+
+KDS_FEED_EVENTS = REGISTRY.counter(
+    "kds_feed_events_total", "Eventos publicados no feed de pedidos do KDS.", labelnames=("event", "source")
+)
+KDS_FEED_SUBSCRIBERS = REGISTRY.gauge("kds_feed_subscribers", "Telas do KDS conectadas ao feed de pedidos.")
+
+ORDER_CREATED = "order_created"
+ORDER_UPDATED = "order_updated"
+
+
+class OrderEvent:
+    """Evento do feed: id (token de retomada), nome do evento SSE e dados em JSON."""
+    __slots__ = ("id", "name", "data")
+
+    def __init__(self, event_id, name, data):
+        self.id = event_id
+        self.name = name
+        self.data = data
+
+
+class Subscription:
+    """
+    Assinatura de uma tela do KDS. Recebe os eventos publicados após a assinatura,
+    precedidos dos eventos perdidos desde o último id recebido (quando ainda estão no histórico).
+    """
+    def __init__(self, broker, backlog, needs_resync, max_pending):
+        self._broker = broker
+        self._queue = queue.Queue(maxsize=max_pending)
+        for event in backlog:
+            self._queue.put_nowait(event)
+        # Indica que a tela perdeu eventos e deve recarregar a lista completa.
+        self.needs_resync = needs_resync
+
+    def _offer(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.needs_resync = True # Tela lenta demais: o restante será obtido na recarga.
+
+    def get(self, timeout):
+        """Próximo evento, ou None se nada chegar em timeout segundos."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self._broker._unsubscribe(self)
+
+
+class OrderEventBroker:
+    """
+    Pub/sub em memória dos eventos de pedidos. Mantém um histórico curto para que
+    as telas reconectem a partir do último id recebido (Last-Event-ID) sem recarregar tudo.
+    """
+    def __init__(self, history_size=500, max_pending=1000):
+        self._history = deque(maxlen=history_size)
+        self._subscribers = set()
+        self._max_pending = max_pending
+        self._lock = threading.Lock()
+        self._sequence = itertools.count(1)
+        # Prefixo dos ids locais, para que ids de outro processo (ou de antes de um reinício) não sejam confundidos.
+        # É refeito após um fork, já que os workers herdam o broker do processo mestre.
+        self._id_prefix = None
+        self._prefix_pid = None
+
+    def publish(self, name, data, event_id=None, source="local"):
+        with self._lock:
+            if event_id is None:
+                if self._prefix_pid != os.getpid():
+                    self._prefix_pid = os.getpid()
+                    self._id_prefix = f"{self._prefix_pid}-{int(time.time())}"
+                event_id = f"{self._id_prefix}-{next(self._sequence)}"
+            event = OrderEvent(event_id, name, data)
+            self._history.append(event)
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription._offer(event)
+        KDS_FEED_EVENTS.inc(event=name, source=source)
+        return event
+
+    def subscribe(self, last_event_id=None):
+        """
+        Args:
+            last_event_id (str): Último id recebido pela tela antes de reconectar.
+        """
+        with self._lock:
+            backlog, needs_resync = [], False
+            if last_event_id:
+                ids = [event.id for event in self._history]
+                if last_event_id in ids:
+                    backlog = list(self._history)[ids.index(last_event_id) + 1:]
+                else:
+                    needs_resync = True # O id é antigo demais ou de outro processo.
+            subscription = Subscription(self, backlog, needs_resync, self._max_pending)
+            self._subscribers.add(subscription)
+        KDS_FEED_SUBSCRIBERS.set(len(self._subscribers))
+        return subscription
+
+    def _unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+        KDS_FEED_SUBSCRIBERS.set(len(self._subscribers))
+
+
+class OrderFeed:
+    """
+    Feed de pedidos do KDS.
+
+    Quando o MongoDB suporta change streams (replica set), uma thread acompanha a coleção
+    de pedidos e publica inserções e mudanças de status, inclusive as feitas por outros
+    workers; o token de retomada do change stream é usado como id dos eventos.
+    Caso contrário (mongod standalone ou sem banco), a aplicação publica os eventos
+    diretamente com notify_order_created e notify_status_changed, apenas neste processo.
+    """
+    def __init__(self, orders_collection, history_size=500, retry_seconds=5):
+        self.orders_collection = orders_collection
+        self.retry_seconds = retry_seconds
+        self.broker = OrderEventBroker(history_size=history_size)
+        self._change_stream_active = False
+        self._change_stream_supported = orders_collection is not None
+        self._resume_token = None
+        self._thread = None
+        self._thread_pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def uses_change_stream(self):
+        return self._change_stream_active
+
+    def start(self):
+        """Inicia (ou reinicia, após um fork) a thread do change stream, se houver banco."""
+        if not self._change_stream_supported:
+            return
+        if self._thread is not None and self._thread.is_alive() and self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._thread_pid == os.getpid():
+                return
+            self._change_stream_active = False
+            self._thread = threading.Thread(target=self._watch_loop, name="kds-change-stream", daemon=True)
+            self._thread_pid = os.getpid()
+            self._thread.start()
+
+    def subscribe(self, last_event_id=None):
+        self.start()
+        return self.broker.subscribe(last_event_id)
+
+    def notify_order_created(self, order):
+        """Publica um pedido recém-criado (apenas quando o change stream não está ativo)."""
+        if self._change_stream_active:
+            return
+        self.broker.publish(ORDER_CREATED, serialize_kds_order(_kds_view(order)))
+
+    def notify_status_changed(self, order_id, status):
+        """Publica a mudança de status de um pedido (apenas quando o change stream não está ativo)."""
+        if self._change_stream_active:
+            return
+        self.broker.publish(ORDER_UPDATED, {"_id": str(order_id), "status": status})
+
+    def _watch_loop(self):
+        """Laço da thread: acompanha o change stream e o reabre a partir do último token em caso de falha."""
+        pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}}]
+        while True:
+            try:
+                with self.orders_collection.watch(pipeline, resume_after=self._resume_token) as stream:
+                    self._change_stream_active = True
+                    logging.info("OrderFeed: change stream da coleção de pedidos ativo.")
+                    for change in stream:
+                        self._resume_token = change["_id"]
+                        self._publish_change(change)
+            except OperationFailure as e:
+                self._change_stream_active = False
+                if e.code == CHANGE_STREAM_NOT_SUPPORTED:
+                    self._change_stream_supported = False
+                    logging.info("OrderFeed: change streams indisponíveis (mongod sem replica set); usando publicação local.")
+                    return
+                logging.error(f"OrderFeed: erro no change stream; nova tentativa em {self.retry_seconds}s: {e}")
+            except PyMongoError as e:
+                self._change_stream_active = False
+                logging.error(f"OrderFeed: change stream interrompido; nova tentativa em {self.retry_seconds}s: {e}")
+            except Exception:
+                self._change_stream_active = False
+                logging.exception("OrderFeed: erro inesperado no change stream.")
+            time.sleep(self.retry_seconds)
+
+    def _publish_change(self, change):
+        event_id = change["_id"].get("_data") if isinstance(change["_id"], dict) else None
+        if change["operationType"] in ("insert", "replace"):
+            name = ORDER_CREATED if change["operationType"] == "insert" else ORDER_UPDATED
+            kds_order = serialize_kds_order(_kds_view(change.get("fullDocument") or {}))
+            self.broker.publish(name, kds_order, event_id=event_id, source="change_stream")
+            return
+        updated_fields = (change.get("updateDescription") or {}).get("updatedFields") or {}
+        if "status" in updated_fields:
+            order_id = str(change["documentKey"]["_id"])
+            self.broker.publish(
+                ORDER_UPDATED, {"_id": order_id, "status": updated_fields["status"]},
+                event_id=event_id, source="change_stream"
+            )
+
+
+def _kds_view(order):
+    """Campos do pedido exibidos pelo KDS (mesma projeção de /api/kds/orders)."""
+    timestamp = order.get("timestamp")
+    if isinstance(timestamp, datetime.datetime) and timestamp.tzinfo is not None:
+        # Mesmo formato ingênuo em UTC devolvido pelo MongoDB.
+        timestamp = timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return {
+        "_id": order.get("_id"),
+        "client_name": order.get("client_name"),
+        "items": [{"name": item.get("name"), "quantity": item.get("quantity")} for item in order.get("items", [])],
+        "status": order.get("status"),
+        "timestamp": timestamp
+    }
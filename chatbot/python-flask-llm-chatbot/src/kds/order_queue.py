@@ -0,0 +1,237 @@
+import glob
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from bson import json_util
+from bson.objectid import ObjectId
+from pymongo.errors import BulkWriteError, PyMongoError
+from metrics.registry import REGISTRY, LATENCY_BUCKETS
+from mongo.errors import DUPLICATE_KEY_ERROR
+
+try:
+    import fcntl
+except ImportError: # Windows: sem travas de arquivo (um único processo por diretório de journal).
+    fcntl = None
+
+ORDER_QUEUE_DEPTH = REGISTRY.gauge("order_queue_depth", "Pedidos registrados no journal e ainda não gravados no MongoDB.")
+ORDER_FLUSH_SECONDS = REGISTRY.histogram(
+    "order_flush_seconds", "Duração de cada gravação em lote (insert_many) dos pedidos.", LATENCY_BUCKETS
+)
+ORDER_FLUSHES = REGISTRY.counter(
+    "order_flush_total", "Gravações em lote dos pedidos no MongoDB, por resultado.", labelnames=("result",)
+)
+
+# Primeira espera após uma falha de gravação; dobra a cada nova falha, até max_backoff.
+MIN_BACKOFF_SECONDS = 0.5
+
+_JSON_OPTIONS = json_util.CANONICAL_JSON_OPTIONS
+
+
+class OrderWriteQueue:
+    """
+    Fila write-behind dos pedidos finalizados no chat.
+
+    enqueue() grava o pedido em um journal local (arquivo JSON Lines, com fsync) e retorna
+    imediatamente; uma thread grava os pedidos pendentes no MongoDB em lotes (insert_many),
+    com novas tentativas e backoff exponencial enquanto o banco estiver indisponível.
+    Cada pedido recebe o _id na hora do enqueue, então repetir um lote não duplica pedidos.
+
+    Cada processo escreve no próprio journal (orders-<pid>.jsonl), travado com flock enquanto
+    o processo vive. Ao iniciar, a fila adota os journals de processos encerrados (inclusive
+    um anterior com o mesmo pid) e reenvia os pedidos que ainda não tinham sido confirmados.
+    """
+    def __init__(self, orders_collection, journal_dir, batch_size=50, max_backoff=60.0, fsync=True, on_flushed=None):
+        """
+        Args:
+            orders_collection: Coleção MongoDB dos pedidos (pode ser None; os pedidos ficam no journal).
+            journal_dir (str): Diretório dos journals.
+            batch_size (int): Máximo de pedidos por insert_many.
+            max_backoff (float): Intervalo máximo entre tentativas após falhas (segundos).
+            fsync (bool): Força a gravação do journal em disco a cada pedido.
+            on_flushed (callable): Chamado com a lista de pedidos gravados no MongoDB.
+        """
+        self.orders_collection = orders_collection
+        self.journal_dir = journal_dir
+        self.batch_size = max(1, batch_size)
+        self.max_backoff = max_backoff
+        self.fsync = fsync
+        self.on_flushed = on_flushed
+        self._pending = OrderedDict() # {ObjectId: documento}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._journal = None
+        self._journal_path = None
+        self._thread = None
+        self._thread_pid = None
+
+    def start(self):
+        """Abre o journal deste processo, adota journals órfãos e inicia a thread de gravação (também após um fork)."""
+        if self._thread is not None and self._thread.is_alive() and self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._thread_pid == os.getpid():
+                return
+            self._open_journal()
+            self._adopt_orphan_journals()
+            ORDER_QUEUE_DEPTH.set(len(self._pending))
+            self._thread = threading.Thread(target=self._flush_loop, name="order-write-behind", daemon=True)
+            self._thread_pid = os.getpid()
+            self._thread.start()
+        if self._pending:
+            logging.info(f"OrderWriteQueue: {len(self._pending)} pedidos não gravados recuperados do journal.")
+            self._wakeup.set()
+
+    def enqueue(self, order):
+        """
+        Registra um pedido no journal e agenda a gravação no MongoDB.
+
+        Returns:
+            ObjectId: _id atribuído ao pedido.
+        """
+        self.start()
+        document = dict(order)
+        document["_id"] = ObjectId()
+        with self._lock:
+            self._append({"op": "order", "doc": document})
+            self._pending[document["_id"]] = document
+            ORDER_QUEUE_DEPTH.set(len(self._pending))
+        self._wakeup.set()
+        return document["_id"]
+
+    def __len__(self):
+        return len(self._pending)
+
+    def flush(self):
+        """
+        Grava um lote de pedidos pendentes no MongoDB.
+
+        Returns:
+            bool: True se o lote foi gravado (ou não havia pedidos), False em caso de falha.
+        """
+        with self._lock:
+            batch = list(self._pending.values())[:self.batch_size]
+        if not batch:
+            return True
+        if self.orders_collection is None:
+            return False
+
+        started_at = time.monotonic()
+        try:
+            self.orders_collection.insert_many(batch, ordered=False)
+            failed_ids = set()
+        except BulkWriteError as e:
+            if e.details.get("writeConcernErrors"):
+                failed_ids = {document["_id"] for document in batch} # Gravação não confirmada: repete o lote.
+            else:
+                # Pedidos já gravados em uma tentativa anterior (chave duplicada) contam como gravados.
+                failed_ids = {
+                    batch[error["index"]]["_id"] for error in e.details.get("writeErrors", [])
+                    if error.get("code") != DUPLICATE_KEY_ERROR
+                }
+            if failed_ids:
+                logging.error(f"OrderWriteQueue: {len(failed_ids)} de {len(batch)} pedidos não foram gravados: {e.details}")
+        except PyMongoError as e:
+            ORDER_FLUSHES.inc(result="error")
+            logging.error(f"OrderWriteQueue: falha ao gravar {len(batch)} pedidos no MongoDB: {e}")
+            return False
+        ORDER_FLUSH_SECONDS.observe(time.monotonic() - started_at)
+
+        flushed = [document for document in batch if document["_id"] not in failed_ids]
+        with self._lock:
+            if flushed:
+                self._append({"op": "ack", "ids": [document["_id"] for document in flushed]})
+            for document in flushed:
+                self._pending.pop(document["_id"], None)
+            if not self._pending:
+                self._journal.truncate(0) # Tudo confirmado: o journal pode recomeçar vazio.
+            ORDER_QUEUE_DEPTH.set(len(self._pending))
+        ORDER_FLUSHES.inc(result="error" if failed_ids else "ok")
+        logging.info(f"OrderWriteQueue: {len(flushed)} pedidos gravados no MongoDB.")
+        if flushed and self.on_flushed is not None:
+            try:
+                self.on_flushed(flushed)
+            except Exception:
+                logging.exception("OrderWriteQueue: erro no callback após gravar pedidos.")
+        return not failed_ids
+
+    def _flush_loop(self):
+        """
+        Laço da thread: grava os pendentes assim que são registrados (os que chegam durante
+        uma gravação formam o próximo lote) e, após falhas, espera com backoff exponencial.
+        """
+        backoff = 0.0
+        while True:
+            if backoff:
+                time.sleep(backoff)
+            else:
+                self._wakeup.wait()
+                self._wakeup.clear()
+            try:
+                while self._pending and self.flush():
+                    pass
+            except Exception:
+                logging.exception("OrderWriteQueue: erro inesperado ao gravar pedidos.")
+            if self._pending:
+                backoff = min(max(backoff * 2, MIN_BACKOFF_SECONDS), self.max_backoff)
+                logging.warning(f"OrderWriteQueue: {len(self._pending)} pedidos pendentes; nova tentativa em {backoff:.1f}s.")
+            else:
+                backoff = 0.0
+
+    def _open_journal(self):
+        """Abre (ou reabre, após um fork) o journal exclusivo deste processo."""
+        if self._journal is not None:
+            self._journal.close() # Journal herdado do processo pai; o pai continua responsável por ele.
+            self._pending.clear()
+        os.makedirs(self.journal_dir, exist_ok=True)
+        self._journal_path = os.path.join(self.journal_dir, f"orders-{os.getpid()}.jsonl")
+        self._journal = open(self._journal_path, "a+", encoding="utf-8")
+        if fcntl is not None:
+            fcntl.flock(self._journal.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        # Journal de um processo anterior com o mesmo pid (ex.: pid 1 em um contêiner reiniciado).
+        self._pending.update(_read_pending(self._journal, self._journal_path))
+
+    def _adopt_orphan_journals(self):
+        """Move para o journal deste processo os pedidos pendentes de journals de processos encerrados."""
+        for path in sorted(glob.glob(os.path.join(self.journal_dir, "orders-*.jsonl"))):
+            if path == self._journal_path:
+                continue
+            with open(path, "r+", encoding="utf-8") as journal:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(journal.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        continue # Journal de um processo ainda ativo.
+                pending = _read_pending(journal, path)
+                for document in pending.values():
+                    self._append({"op": "order", "doc": document})
+                    self._pending[document["_id"]] = document
+            os.remove(path) # Só depois de copiar os pendentes (com fsync) para o journal deste processo.
+
+    def _append(self, record):
+        self._journal.write(json_util.dumps(record, json_options=_JSON_OPTIONS) + "\n")
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+
+
+def _read_pending(journal, path):
+    """Lê um journal e retorna os pedidos sem confirmação de gravação, na ordem original."""
+    pending = OrderedDict()
+    journal.seek(0)
+    for line_number, line in enumerate(journal, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json_util.loads(line, json_options=_JSON_OPTIONS)
+        except ValueError:
+            # Normalmente a última linha, interrompida por uma queda durante a escrita.
+            logging.warning(f"OrderWriteQueue: linha {line_number} inválida em {path} ignorada.")
+            continue
+        if record.get("op") == "order":
+            pending[record["doc"]["_id"]] = record["doc"]
+        elif record.get("op") == "ack":
+            for order_id in record.get("ids", []):
+                pending.pop(order_id, None)
+    return pending
@@ -0,0 +1,106 @@
+import datetime
+import logging
+from bson.objectid import ObjectId
+from bson import errors as bson_errors
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import PyMongoError
+
+# Campos que a tela da cozinha (kds.js) exibe.
+KDS_ORDER_PROJECTION = {
+    "client_name": 1,
+    "items.name": 1,
+    "items.quantity": 1,
+    "status": 1,
+    "timestamp": 1
+}
+
+# Índice composto usado pela listagem do KDS; serve tanto à ordem crescente quanto à decrescente.
+KDS_ORDERS_INDEX = [("status", ASCENDING), ("timestamp", ASCENDING), ("_id", ASCENDING)]
+KDS_ORDERS_INDEX_NAME = "kds_status_timestamp"
+
+
+def ensure_order_indexes(orders_collection):
+    """Cria (se ainda não existirem) os índices da coleção de pedidos usados pelo KDS."""
+    if orders_collection is None:
+        return
+    try:
+        orders_collection.create_index(KDS_ORDERS_INDEX, name=KDS_ORDERS_INDEX_NAME)
+        logging.info(f"Índice '{KDS_ORDERS_INDEX_NAME}' garantido na coleção de pedidos.")
+    except PyMongoError as e:
+        logging.error(f"Não foi possível criar o índice '{KDS_ORDERS_INDEX_NAME}' na coleção de pedidos: {e}")
+
+
+def parse_page_cursor(after, after_id=None):
+    """
+    Interpreta o cursor de paginação recebido na query string.
+
+    Args:
+        after (str): timestamp_iso do último pedido da página anterior.
+        after_id (str): _id do último pedido da página anterior (desempate entre timestamps iguais).
+
+    Returns:
+        tuple: (datetime, ObjectId | None), ou None se não houver cursor.
+
+    Raises:
+        ValueError: Se o timestamp ou o id forem inválidos.
+    """
+    if not after:
+        return None
+    timestamp = datetime.datetime.fromisoformat(after.replace("Z", "+00:00"))
+    if timestamp.tzinfo is not None:
+        # O MongoDB devolve datas ingênuas em UTC; o cursor é comparado no mesmo formato.
+        timestamp = timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    object_id = None
+    if after_id:
+        try:
+            object_id = ObjectId(after_id)
+        except bson_errors.InvalidId:
+            raise ValueError(f"after_id inválido: '{after_id}'")
+    return timestamp, object_id
+
+
+def find_kds_orders(orders_collection, status, sort_order, page_cursor=None, limit=200):
+    """
+    Consulta paginada dos pedidos de um status, ordenada por (timestamp, _id).
+
+    Args:
+        status (str): Status dos pedidos.
+        sort_order (int): 1 (mais antigos primeiro) ou -1 (mais recentes primeiro).
+        page_cursor (tuple): (timestamp, ObjectId | None) do último pedido já recebido.
+        limit (int): Número máximo de pedidos.
+
+    Returns:
+        Cursor: Cursor do PyMongo com a projeção do KDS.
+    """
+    query = {"status": status}
+    if page_cursor is not None:
+        timestamp, object_id = page_cursor
+        comparison = "$gt" if sort_order == ASCENDING else "$lt"
+        if object_id is None:
+            query["timestamp"] = {comparison: timestamp}
+        else:
+            query["$or"] = [
+                {"timestamp": {comparison: timestamp}},
+                {"timestamp": timestamp, "_id": {comparison: object_id}}
+            ]
+    direction = ASCENDING if sort_order == ASCENDING else DESCENDING
+    return (
+        orders_collection.find(query, KDS_ORDER_PROJECTION)
+        .sort([("timestamp", direction), ("_id", direction)])
+        .limit(limit)
+    )
+
+
+def serialize_kds_order(order_data):
+    """Converte um pedido do MongoDB para o formato JSON esperado pelo KDS."""
+    order_data['_id'] = str(order_data['_id'])
+    timestamp_obj = order_data.pop('timestamp', None)
+    if isinstance(timestamp_obj, datetime.datetime):
+        # O timestamp do MongoDB é um datetime ingênuo (sem fuso) representando UTC.
+        order_data['timestamp_iso'] = timestamp_obj.replace(tzinfo=datetime.timezone.utc).isoformat()
+    elif timestamp_obj is not None:
+        logging.warning(f"KDS: Timestamp do pedido {order_data['_id']} não é um objeto datetime, é {type(timestamp_obj)}.")
+        order_data['timestamp_iso'] = str(timestamp_obj) # Fallback
+    else:
+        order_data['timestamp_iso'] = None
+    return order_data
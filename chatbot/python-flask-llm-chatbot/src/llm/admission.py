@@ -0,0 +1,127 @@
+import contextlib
+import logging
+import math
+import threading
+import time
+from collections import deque
+from metrics.registry import REGISTRY
+
+CHAT_ADMISSION = REGISTRY.counter(
+    "chat_admission_total", "Mensagens de chat admitidas para o LLM ou atendidas em modo degradado.", labelnames=("result",)
+)
+LLM_ESTIMATED_WAIT = REGISTRY.gauge(
+    "llm_estimated_wait_seconds", "Espera estimada por uma vaga no LLM na última decisão de admissão."
+)
+
+
+class AdmissionController:
+    """
+    Controle de admissão das mensagens que precisam do LLM.
+
+    Acompanha as chamadas ao Ollama em andamento e a latência das chamadas recentes.
+    A espera estimada de uma nova chamada é o número de "rodadas" à frente dela
+    (chamadas em andamento / gerações simultâneas) vezes o percentil de latência.
+    Quando a estimativa passa do orçamento, a mensagem é atendida sem o LLM,
+    liberando os workers para as demais rotas (ex.: KDS).
+    """
+    def __init__(self, max_parallel=4, wait_budget_seconds=15.0, latency_percentile=0.9,
+                 window_size=50, window_seconds=120.0):
+        """
+        Args:
+            max_parallel (int): Gerações simultâneas no Ollama.
+            wait_budget_seconds (float): Espera estimada máxima para admitir uma chamada.
+            latency_percentile (float): Percentil (0-1) da latência usado na estimativa.
+            window_size (int): Número máximo de latências recentes consideradas.
+            window_seconds (float): Idade máxima das latências consideradas.
+        """
+        self.max_parallel = max(1, max_parallel)
+        self.wait_budget_seconds = wait_budget_seconds
+        self.latency_percentile = latency_percentile
+        self.window_seconds = window_seconds
+        self._latencies = deque(maxlen=window_size) # [(instante, duração)]
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        logging.info(
+            f"AdmissionController inicializado com max_parallel={self.max_parallel}, "
+            f"wait_budget={self.wait_budget_seconds}s, percentil={self.latency_percentile}."
+        )
+
+    @contextlib.contextmanager
+    def track(self):
+        """Registra uma chamada ao LLM em andamento, inclusive enquanto ela aguarda vaga no gateway."""
+        with self._lock:
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    @contextlib.contextmanager
+    def time_upstream(self):
+        """
+        Mede a duração da requisição ao Ollama. Deve envolver apenas a requisição, já com a vaga
+        do gateway obtida: a espera na fila entraria em dobro na estimativa, que já conta as
+        chamadas aguardando em _in_flight.
+        """
+        started_at = time.monotonic()
+        try:
+            yield
+        finally:
+            finished_at = time.monotonic()
+            with self._lock:
+                self._latencies.append((finished_at, finished_at - started_at))
+
+    def recent_latency(self):
+        """Percentil configurado das latências recentes, ou None se não houver amostras."""
+        cutoff = time.monotonic() - self.window_seconds
+        with self._lock:
+            samples = sorted(duration for finished_at, duration in self._latencies if finished_at >= cutoff)
+        if not samples:
+            return None
+        rank = max(1, math.ceil(self.latency_percentile * len(samples)))
+        return samples[rank - 1]
+
+    def estimated_wait(self):
+        """Espera estimada (segundos) até uma nova chamada começar a ser atendida pelo Ollama."""
+        latency = self.recent_latency()
+        if latency is None:
+            return 0.0
+        return (self._in_flight // self.max_parallel) * latency
+
+    def admit(self):
+        """Indica se uma nova mensagem pode seguir para o LLM."""
+        estimated_wait = self.estimated_wait()
+        LLM_ESTIMATED_WAIT.set(estimated_wait)
+        if estimated_wait > self.wait_budget_seconds:
+            CHAT_ADMISSION.inc(result="shed")
+            logging.warning(
+                f"AdmissionController: espera estimada de {estimated_wait:.1f}s "
+                f"({self._in_flight} chamadas em andamento) excede o orçamento de {self.wait_budget_seconds}s."
+            )
+            return False
+        CHAT_ADMISSION.inc(result="admitted")
+        return True
+
+
+class AdmissionDecision:
+    """
+    Decisão de admissão de uma mensagem de chat. É tomada (e contada em chat_admission_total)
+    no máximo uma vez, na primeira consulta, e reaproveitada pelas demais etapas do mesmo turno.
+    """
+    __slots__ = ("_admission", "_overloaded")
+
+    def __init__(self, admission):
+        """
+        Args:
+            admission (AdmissionController): Controle de admissão (pode ser None: sempre admite).
+        """
+        self._admission = admission
+        self._overloaded = None
+
+    @property
+    def overloaded(self):
+        """Indica se a mensagem deve ser atendida sem o LLM por excesso de carga."""
+        if self._overloaded is None:
+            self._overloaded = self._admission is not None and not self._admission.admit()
+        return self._overloaded
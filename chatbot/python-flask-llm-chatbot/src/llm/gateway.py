@@ -0,0 +1,192 @@
+import asyncio
+import contextlib
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from metrics.registry import REGISTRY, LATENCY_BUCKETS
+
+GATEWAY_QUEUE_DEPTH = REGISTRY.gauge("llm_gateway_queue_depth", "Chamadas ao LLM aguardando uma vaga no gateway.")
+GATEWAY_IN_FLIGHT = REGISTRY.gauge("llm_gateway_in_flight", "Chamadas ao LLM em execução no Ollama.")
+GATEWAY_WAIT_SECONDS = REGISTRY.histogram(
+    "llm_gateway_wait_seconds", "Tempo de espera na fila do gateway até a chamada ao LLM começar.", LATENCY_BUCKETS
+)
+GATEWAY_REQUESTS = REGISTRY.counter(
+    "llm_gateway_requests_total", "Chamadas recebidas pelo gateway do LLM, por resultado.", labelnames=("result",)
+)
+
+
+class GatewayBusyError(Exception):
+    """O gateway está sobrecarregado: a fila está cheia ou a espera por uma vaga excedeu o limite."""
+    pass
+
+
+class LLMGateway:
+    """
+    Gateway assíncrono para as chamadas ao Ollama.
+
+    Um laço asyncio em uma thread própria controla quantas gerações rodam ao mesmo tempo
+    (o mesmo valor de OLLAMA_NUM_PARALLEL no servidor Ollama). As chamadas excedentes
+    aguardam em uma fila FIFO limitada; quando a fila está cheia ou a espera passa de
+    max_wait_seconds, a chamada falha rapidamente com GatewayBusyError em vez de esgotar
+    o timeout do Ollama. Chamadas idênticas em andamento (mesma chave) são agrupadas e
+    compartilham o mesmo resultado.
+
+    Pode ser usado por código síncrono (call, slot) e por rotas assíncronas (call_async).
+    """
+    def __init__(self, max_parallel=4, max_queue=32, max_wait_seconds=20.0):
+        """
+        Args:
+            max_parallel (int): Gerações simultâneas permitidas (OLLAMA_NUM_PARALLEL).
+            max_queue (int): Número máximo de chamadas aguardando vaga.
+            max_wait_seconds (float): Espera máxima na fila antes de responder "ocupado".
+        """
+        if max_parallel < 1:
+            raise ValueError(f"max_parallel inválido: {max_parallel}. Use um valor maior ou igual a 1.")
+        self.max_parallel = max_parallel
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self._lock = threading.Lock()
+        self._loop = None
+        self._loop_pid = None
+        self._executor = None
+        self._waiters = None # deque de futures aguardando vaga (FIFO)
+        self._inflight = None # {chave: task} das chamadas agrupáveis em andamento
+        self._active = 0
+        logging.info(
+            f"LLMGateway inicializado com max_parallel={self.max_parallel}, max_queue={self.max_queue}, "
+            f"max_wait={self.max_wait_seconds}s."
+        )
+
+    def call(self, key, func):
+        """
+        Executa func() (bloqueante) respeitando o limite de concorrência e aguarda o resultado.
+
+        Args:
+            key: Chave para agrupar chamadas idênticas em andamento; None desativa o agrupamento.
+            func (callable): Função sem argumentos que faz a chamada HTTP ao Ollama.
+
+        Raises:
+            GatewayBusyError: Se não houver vaga dentro do limite de espera.
+        """
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(self._run(key, func), loop).result()
+
+    async def call_async(self, key, func):
+        """Versão de call para rotas assíncronas; pode ser aguardada a partir de qualquer laço asyncio."""
+        loop = self._ensure_loop()
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self._run(key, func), loop))
+
+    @contextlib.contextmanager
+    def slot(self):
+        """
+        Reserva uma vaga durante o bloco (usado no streaming, em que a própria thread da
+        requisição consome a resposta do Ollama).
+
+        Raises:
+            GatewayBusyError: Se não houver vaga dentro do limite de espera.
+        """
+        loop = self._ensure_loop()
+        asyncio.run_coroutine_threadsafe(self._acquire(), loop).result()
+        try:
+            yield
+        finally:
+            loop.call_soon_threadsafe(self._release)
+
+    def close(self):
+        """Encerra o laço e o executor do gateway."""
+        with self._lock:
+            if self._loop is not None and self._loop_pid == os.getpid():
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._executor.shutdown(wait=False)
+            self._loop = None
+
+    def _ensure_loop(self):
+        """Inicia (ou reinicia, após um fork) o laço asyncio do gateway em uma thread própria."""
+        loop = self._loop
+        if loop is not None and self._loop_pid == os.getpid():
+            return loop
+        with self._lock:
+            if self._loop is not None and self._loop_pid == os.getpid():
+                return self._loop
+            loop = asyncio.new_event_loop()
+            self._executor = ThreadPoolExecutor(max_workers=self.max_parallel, thread_name_prefix="llm-gateway")
+            self._waiters = deque()
+            self._inflight = {}
+            self._active = 0
+            GATEWAY_QUEUE_DEPTH.set(0)
+            GATEWAY_IN_FLIGHT.set(0)
+            threading.Thread(target=loop.run_forever, name="llm-gateway-loop", daemon=True).start()
+            self._loop, self._loop_pid = loop, os.getpid()
+            return loop
+
+    async def _run(self, key, func):
+        if key is None:
+            return await self._execute(func)
+        task = self._inflight.get(key)
+        if task is not None:
+            GATEWAY_REQUESTS.inc(result="coalesced")
+            return await asyncio.shield(task)
+        task = asyncio.ensure_future(self._execute(func))
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _execute(self, func):
+        await self._acquire()
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self._executor, func)
+            GATEWAY_REQUESTS.inc(result="executed")
+            return result
+        finally:
+            self._release()
+
+    async def _acquire(self):
+        """Obtém uma vaga; a ordem de chegada é respeitada porque as vagas liberadas passam ao primeiro da fila."""
+        if self._active < self.max_parallel and not self._waiters:
+            self._active += 1
+            GATEWAY_IN_FLIGHT.set(self._active)
+            GATEWAY_WAIT_SECONDS.observe(0)
+            return
+        if len(self._waiters) >= self.max_queue:
+            GATEWAY_REQUESTS.inc(result="rejected")
+            raise GatewayBusyError(f"Fila do LLM cheia ({len(self._waiters)} chamadas aguardando).")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        GATEWAY_QUEUE_DEPTH.set(len(self._waiters))
+        started_at = time.monotonic()
+        try:
+            await asyncio.wait((waiter,), timeout=self.max_wait_seconds)
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release() # A vaga já tinha sido repassada a esta chamada.
+            else:
+                self._discard_waiter(waiter)
+            raise
+        GATEWAY_WAIT_SECONDS.observe(time.monotonic() - started_at)
+        if not waiter.done():
+            self._discard_waiter(waiter)
+            GATEWAY_REQUESTS.inc(result="timeout")
+            raise GatewayBusyError(f"Nenhuma vaga no LLM após {self.max_wait_seconds}s de espera.")
+
+    def _release(self):
+        """Repassa a vaga ao primeiro da fila ou a devolve ao gateway."""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            GATEWAY_QUEUE_DEPTH.set(len(self._waiters))
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._active -= 1
+        GATEWAY_IN_FLIGHT.set(self._active)
+
+    def _discard_waiter(self, waiter):
+        waiter.cancel()
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+        GATEWAY_QUEUE_DEPTH.set(len(self._waiters))
@@ -1,93 +1,83 @@
+import asyncio
+import contextlib
+import hashlib
 import requests
 import json
 import logging
-from decimal import Decimal, InvalidOperation
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from llm.admission import AdmissionDecision
+from llm.gateway import GatewayBusyError
+from menu.cache import MENU_ERROR_MESSAGES, MENU_UNAVAILABLE_MESSAGE
+from nlp.order_parser import MAX_ITEM_QUANTITY
+from metrics.registry import REGISTRY, LATENCY_BUCKETS, SIZE_BUCKETS, TOKEN_BUCKETS
+from metrics.spans import Span
 
 # Configuração básica do logging para este módulo.
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(module)s - %(message)s')
 
-class LLMIntegration:
-    def __init__(self, ollama_url, model_name, menu_collection, timeout=60, temperature=0.5, max_history_turns=3):
-        self.ollama_url = ollama_url
-        self.model_name = model_name
-        self.menu_collection = menu_collection # Coleção MongoDB para buscar o cardápio.
-        self.timeout = timeout
-        self.temperature = temperature
-        # Número de pares de turnos (usuário/assistente) a serem mantidos no histórico para o prompt.
-        self.max_history_turns = max_history_turns
-        # Strings que indicam que o menu não está disponível ou houve erro ao carregá-lo.
-        self.known_menu_error_prefixes = (
-            "Desculpe, o cardápio está temporariamente indisponível.",
-            "No momento não temos itens cadastrados no cardápio.",
-            "No momento não temos itens válidos cadastrados no cardápio.",
-            "Desculpe, ocorreu um erro ao tentar carregar o cardápio."
-        )
-        logging.info(
-            f"LLMIntegration inicializado para o modelo '{self.model_name}' em {self.ollama_url} "
-            f"com timeout={self.timeout}, temp={self.temperature}, max_history_turns={self.max_history_turns}"
-        )
-
-    def _get_menu_string_from_db(self):
-        """
-        Carrega o cardápio da coleção MongoDB e o formata como uma string.
-        Retorna:
-            str: String formatada do cardápio ou uma mensagem de erro/indisponibilidade.
-        """
-        if self.menu_collection is None:
-            logging.error("LLMIntegration: self.menu_collection (coleção do cardápio) não está disponível.")
-            return "Desculpe, o cardápio está temporariamente indisponível."
-        
-        try:
-            menu_list_from_db = list(self.menu_collection.find({}))
-            if not menu_list_from_db:
-                return "No momento não temos itens cadastrados no cardápio."
-
-            menu_items_formatted = []
-            for item in menu_list_from_db:
-                try:
-                    name = item.get("name", "Item sem nome")
-                    # Garante que o preço seja tratado como string antes da conversão para Decimal,
-                    # especialmente se vier como float do DB.
-                    price_str = str(item.get("price", "0"))
-                    price = Decimal(price_str)
-                    menu_items_formatted.append(f"- {name} (R$ {price:.2f})")
-                except (InvalidOperation, ValueError, TypeError) as e:
-                    logging.warning(f"LLMIntegration: Ignorando item com preço inválido do DB: {item}. Erro: {e}")
-            
-            if not menu_items_formatted: # Caso todos os itens tenham tido preço inválido.
-                 return "No momento não temos itens válidos cadastrados no cardápio."
-            return "\n".join(menu_items_formatted)
-        except Exception as e: # Captura erros genéricos do PyMongo ou outros.
-            logging.exception(f"LLMIntegration: Erro ao carregar cardápio do MongoDB via self.menu_collection: {e}")
-            return "Desculpe, ocorreu um erro ao tentar carregar o cardápio."
-
-    def _is_menu_unavailable(self, menu_string):
-        """Verifica se a string do menu indica que ele não está disponível."""
-        return any(menu_string.startswith(prefix) for prefix in self.known_menu_error_prefixes)
-
-    def _build_base_context(self):
-        """
-        Constrói o prompt base para o LLM.
-        Retorna uma tupla: (string_do_prompt_base, booleano_indicando_se_eh_prompt_de_erro).
-        """
-        menu_string = self._get_menu_string_from_db()
-
-        if self._is_menu_unavailable(menu_string):
-            logging.warning("Falha ao carregar o menu ou menu vazio. Construindo prompt de erro para o LLM.")
-            # Prompt de erro específico quando o menu não está disponível.
-            # Instruções para o LLM em inglês por ser a principal linguagem que são treinadas, mas exigindo resposta em português.
-            base_prompt = """You are a virtual assistant for Poliedro Restaurant.
+# Métricas de construção de prompt.
+PROMPT_BUILT_BYTES = REGISTRY.histogram(
+    "llm_prompt_built_bytes", "Bytes de prompt construídos por requisição (prefixo compilado ou cauda do histórico).",
+    SIZE_BUCKETS, labelnames=("part",)
+)
+PROMPT_PREFIX_BUILDS = REGISTRY.counter("llm_prompt_prefix_builds_total", "Compilações do prompt base (uma por versão do cardápio).")
+# Estatísticas de avaliação do prompt reportadas pelo Ollama (baixas quando o cache KV é reaproveitado).
+PROMPT_EVAL_TOKENS = REGISTRY.histogram(
+    "llm_prompt_eval_tokens", "Tokens de prompt avaliados pelo Ollama (prompt_eval_count).",
+    TOKEN_BUCKETS, labelnames=("endpoint", "model")
+)
+PROMPT_EVAL_SECONDS = REGISTRY.histogram(
+    "llm_prompt_eval_seconds", "Tempo de avaliação do prompt pelo Ollama (prompt_eval_duration).",
+    LATENCY_BUCKETS, labelnames=("endpoint", "model")
+)
+# Estatísticas de geração da resposta e de carga do modelo reportadas pelo Ollama.
+EVAL_TOKENS = REGISTRY.histogram(
+    "llm_eval_tokens", "Tokens gerados pelo Ollama na resposta (eval_count).", TOKEN_BUCKETS, labelnames=("endpoint", "model")
+)
+EVAL_SECONDS = REGISTRY.histogram(
+    "llm_eval_seconds", "Tempo de geração da resposta pelo Ollama (eval_duration).", LATENCY_BUCKETS, labelnames=("endpoint", "model")
+)
+LOAD_SECONDS = REGISTRY.histogram(
+    "llm_load_seconds", "Tempo de carga do modelo antes da geração (load_duration); alto quando o modelo saiu da memória.",
+    LATENCY_BUCKETS, labelnames=("endpoint", "model")
+)
+# Rótulos dos papéis do histórico no prompt do /api/generate; "system" é a linha do estado do carrinho.
+HISTORY_ROLE_LABELS = {"user": "Cliente", "assistant": "Assistente", "system": "Sistema"}
+
+# Tarefas roteáveis para modelos diferentes: diálogo livre (respostas em texto), classificação das
+# confirmações ambíguas (check_confirmation_intent) e turno estruturado (LLM_OUTPUT_FORMAT json/schema).
+# O turno estruturado é uma única chamada que devolve a intenção, os itens e a resposta ao cliente.
+TASK_DIALOGUE = "dialogue"
+TASK_INTENT = "intent"
+TASK_STRUCTURED = "structured"
+MODEL_TASKS = (TASK_DIALOGUE, TASK_INTENT, TASK_STRUCTURED)
+
+# Respostas estruturadas (JSON) recebidas do LLM, válidas ou descartadas.
+STRUCTURED_RESPONSES = REGISTRY.counter(
+    "llm_structured_responses_total", "Respostas JSON do LLM por resultado da validação.", labelnames=("result",)
+)
+
+# Resposta imediata quando o gateway do LLM está sobrecarregado.
+LLM_BUSY_MESSAGE = "Estamos atendendo muitos clientes no momento. Por favor, tente novamente em alguns segundos."
+
+# Tokens para interromper a geração e que são removidos do final da resposta.
+STOP_TOKENS = ["Cliente:", "\nCliente:", "\n\nCliente:"]
+
+# Prompt de erro específico quando o menu não está disponível.
+# Instruções para o LLM em inglês por ser a principal linguagem que são treinadas, mas exigindo resposta em português.
+ERROR_PROMPT = """You are a virtual assistant for Poliedro Restaurant.
 ATTENTION: The menu could not be loaded or is empty.
 Your task is to politely inform the user that the menu is currently unavailable and you cannot take orders.
 Respond ONLY in Brazilian Portuguese. Example: "Desculpe, o cardápio está indisponível no momento e não consigo anotar pedidos. Por favor, tente novamente mais tarde."
 DO NOT ask what the user wants. DO NOT mention error details.
 Assistente:"""
-            return base_prompt, True # True indica que é um prompt de erro
 
-        # Prompt principal com instruções para o LLM em inglês.
-        # O cardápio e os exemplos de interação são em português.
-        # A resposta final do LLM DEVE ser em português do Brasil.
-        base_prompt = f"""You are a friendly and efficient virtual assistant for Poliedro Restaurant. Your goal is to take customer orders based on the available menu. Be clear, direct, and polite. Your final response MUST be in Brazilian Portuguese. Generate only the response for 'Assistente:'. DO NOT reproduce the examples below.
+# Prompt principal com instruções para o LLM em inglês.
+# O cardápio e os exemplos de interação são em português.
+# A resposta final do LLM DEVE ser em português do Brasil.
+# O marcador {menu_string} é preenchido uma vez por versão do cardápio em _build_base_context().
+BASE_PROMPT_TEMPLATE = """You are a friendly and efficient virtual assistant for Poliedro Restaurant. Your goal is to take customer orders based on the available menu. Be clear, direct, and polite. Your final response MUST be in Brazilian Portuguese. Generate only the response for 'Assistente:'. DO NOT reproduce the examples below.
 
 **Current Menu (Cardápio Atual):**
 {menu_string}
@@ -133,79 +123,713 @@ Assistente: Ótimo! Seu pedido foi anotado e enviado para a cozinha!
 
 --- END OF EXAMPLES ---
 """
-        return base_prompt, False # False indica que não é um prompt de erro
 
-    def generate_response(self, user_input, conversation_history=None):
+# Intenções aceitas no modo de resposta estruturada.
+STRUCTURED_INTENTS = ("order", "confirm", "deny", "clear_cart", "other")
+
+# Prompt do modo estruturado: uma única chamada por turno devolve a intenção, os itens e a resposta.
+# O marcador {menu_string} é preenchido uma vez por versão do cardápio em _build_structured_context().
+STRUCTURED_PROMPT_TEMPLATE = """You are a friendly and efficient virtual assistant for Poliedro Restaurant. Your goal is to take customer orders based on the available menu. Analyze the customer's last message, using the conversation for context, and answer with a single JSON object. All text for the customer MUST be in Brazilian Portuguese. DO NOT reproduce the examples below.
+
+**Current Menu (Cardápio Atual):**
+{menu_string}
+
+**JSON Response Format:**
+{{"intent": "...", "items": [{{"name": "...", "quantity": 1}}], "reply": "..."}}
+- "intent" is one of:
+  - "order": the customer adds, changes or removes items;
+  - "confirm": the customer confirms the order after the assistant asked "Correto?";
+  - "deny": the customer says the order is not correct, without saying what to change;
+  - "clear_cart": the customer wants to cancel or empty the whole order;
+  - "other": greetings, questions about the menu and anything else.
+- "items" is used only with "order": each item the customer added or changed in this message, with the exact menu name and the total quantity wanted (0 to remove it). Otherwise it is an empty list.
+- "reply" is a short and polite message for the customer. For "order", do not list the items; the system shows the confirmation. If the customer asks for something not on the menu, say that the item "não está disponível hoje".
+- Do not chat about other topics. Focus only on taking the order or providing information about the menu.
+
+--- EXAMPLES BELOW - DO NOT REPRODUCE (Exemplos de Interação em Português) ---
+
+Cliente: Olá, bom dia! Estou com fome.
+Assistente: {{"intent": "other", "items": [], "reply": "Olá! Bem-vindo ao Restaurante Poliedro. Gostaria de ver o cardápio ou fazer um pedido?"}}
+
+Cliente: tem pizza?
+Assistente: {{"intent": "other", "items": [], "reply": "Desculpe, não temos pizza em nosso cardápio hoje. Gostaria de pedir algum dos itens disponíveis?"}}
+
+Cliente: quero um hamburguer e uma batata frita
+Assistente: {{"intent": "order", "items": [{{"name": "Hambúrguer Clássico", "quantity": 1}}, {{"name": "Batata Frita (Média)", "quantity": 1}}], "reply": "Entendido."}}
+
+Cliente: é isso mesmo
+Assistente: {{"intent": "confirm", "items": [], "reply": "Ótimo! Seu pedido foi anotado e enviado para a cozinha!"}}
+
+Cliente: tira a batata
+Assistente: {{"intent": "order", "items": [{{"name": "Batata Frita (Média)", "quantity": 0}}], "reply": "Entendido."}}
+
+--- END OF EXAMPLES ---
+"""
+
+def _coalescing_key(url, payload):
+    """Chave que identifica chamadas idênticas ao Ollama (mesmo endpoint e mesmo corpo)."""
+    body = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return (url, hashlib.blake2b(body.encode('utf-8'), digest_size=16).hexdigest())
+
+
+def _build_response_schema(item_names):
+    """
+    JSON Schema da resposta estruturada. Com a saída restrita pelo Ollama, a intenção,
+    os nomes dos itens e as quantidades só podem assumir valores válidos.
+    """
+    item_name_schema = {"type": "string", "enum": list(item_names)} if item_names else {"type": "string"}
+    return {
+        "type": "object",
+        "properties": {
+            "intent": {"type": "string", "enum": list(STRUCTURED_INTENTS)},
+            "items": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "name": item_name_schema,
+                        "quantity": {"type": "integer", "minimum": 0, "maximum": MAX_ITEM_QUANTITY}
+                    },
+                    "required": ["name", "quantity"]
+                }
+            },
+            "reply": {"type": "string"}
+        },
+        "required": ["intent", "items", "reply"]
+    }
+
+
+def _parse_structured_reply(raw_text):
+    """
+    Interpreta e normaliza o JSON do modo estruturado.
+    Retorna None se o texto não for um objeto com intenção e resposta utilizáveis.
+    """
+    try:
+        data = json.loads(raw_text)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    intent = data.get("intent")
+    if intent not in STRUCTURED_INTENTS:
+        intent = "other"
+    reply = data.get("reply")
+    reply = reply.strip() if isinstance(reply, str) else ""
+
+    items = []
+    raw_items = data.get("items")
+    for raw_item in raw_items if isinstance(raw_items, list) else []:
+        if not isinstance(raw_item, dict) or not isinstance(raw_item.get("name"), str):
+            continue
+        try:
+            quantity = int(raw_item.get("quantity", 1))
+        except (TypeError, ValueError):
+            continue
+        if quantity < 0 or quantity > MAX_ITEM_QUANTITY:
+            continue
+        items.append({"name": raw_item["name"].strip(), "quantity": quantity})
+
+    if not reply and not items and intent == "other":
+        return None
+    return {"intent": intent, "items": items, "reply": reply}
+
+
+class ModelRoute:
+    """Modelo do Ollama usado em uma tarefa e por quanto tempo ele fica carregado (keep_alive)."""
+    __slots__ = ("model", "keep_alive")
+
+    def __init__(self, model, keep_alive=None):
+        self.model = model
+        self.keep_alive = keep_alive
+
+    def __repr__(self):
+        return f"ModelRoute({self.model!r}, keep_alive={self.keep_alive!r})"
+
+
+def _derive_chat_url(ollama_url):
+    """Obtém a URL do endpoint /api/chat a partir da URL configurada para /api/generate."""
+    base_url = ollama_url.rstrip('/')
+    if base_url.endswith("/api/generate"):
+        base_url = base_url[:-len("/api/generate")]
+    return base_url + "/api/chat"
+
+
+class StopTokenTrimmer:
+    """
+    Remove tokens de parada de um fluxo de texto incremental.
+    Retém apenas o final do texto que ainda pode formar um token de parada.
+    """
+    def __init__(self, stop_tokens):
+        self.stop_tokens = tuple(stop_tokens)
+        self._holdback = max((len(token) for token in self.stop_tokens), default=1) - 1
+        self._pending = ""
+        self._started = False
+        self.stopped = False
+
+    def feed(self, chunk):
+        """Recebe um pedaço do texto gerado e retorna a parte que já pode ser enviada ao cliente."""
+        if self.stopped:
+            return ""
+        self._pending += chunk
+        if not self._started:
+            self._pending = self._pending.lstrip() # Equivalente ao strip() da resposta completa.
+            if not self._pending:
+                return ""
+            self._started = True
+
+        positions = [self._pending.find(token) for token in self.stop_tokens]
+        positions = [position for position in positions if position != -1]
+        if positions:
+            text = self._pending[:min(positions)].rstrip()
+            self._pending = ""
+            self.stopped = True
+            return text
+
+        if len(self._pending) <= self._holdback:
+            return ""
+        cut = len(self._pending) - self._holdback
+        text, self._pending = self._pending[:cut], self._pending[cut:]
+        return text
+
+    def flush(self):
+        """Retorna o texto retido ao final do fluxo."""
+        text, self._pending = self._pending.rstrip(), ""
+        return text
+
+
+class LLMIntegration:
+    def __init__(self, ollama_url, model_name, menu_cache, timeout=60, temperature=0.5, max_history_turns=3,
+                 api_mode="generate", keep_alive=None, connect_timeout=5, pool_size=10, max_retries=2,
+                 retry_backoff=0.5, intent_classifier=None, response_cache=None,
+                 gateway=None, admission=None, output_format="text", model_routes=None):
+        self.ollama_url = ollama_url
+        # "generate" envia o prompt completo para /api/generate; "chat" usa /api/chat com
+        # uma mensagem de sistema fixa para que o Ollama reaproveite o cache do prefixo.
+        if api_mode not in ("generate", "chat"):
+            raise ValueError(f"api_mode inválido: '{api_mode}'. Use 'generate' ou 'chat'.")
+        self.api_mode = api_mode
+        # "text" recebe a resposta em texto livre; "json" pede ao Ollama um objeto JSON
+        # com intenção, itens e resposta em uma única chamada por turno; "schema" restringe
+        # esse objeto a um JSON Schema em que os nomes dos itens são os do cardápio.
+        if output_format not in ("text", "json", "schema"):
+            raise ValueError(f"output_format inválido: '{output_format}'. Use 'text', 'json' ou 'schema'.")
+        self.output_format = output_format
+        self.chat_url = _derive_chat_url(ollama_url)
+        self.keep_alive = keep_alive # Tempo que o Ollama mantém o modelo carregado (ex.: "30m").
+        self.model_name = model_name
+        # Modelo de cada tarefa; as tarefas sem rota própria usam model_name e keep_alive.
+        self.model_routes = {task: ModelRoute(model_name, keep_alive) for task in MODEL_TASKS}
+        for task, route in (model_routes or {}).items():
+            if task not in MODEL_TASKS:
+                raise ValueError(f"Tarefa de modelo inválida: '{task}'. Use uma de {', '.join(MODEL_TASKS)}.")
+            self.model_routes[task] = route
+        self.menu_cache = menu_cache # MenuCache compartilhado com o app para obter o cardápio.
+        self.timeout = timeout # Timeout de leitura (segundos) das chamadas ao Ollama.
+        self.connect_timeout = connect_timeout # Timeout de conexão (segundos), separado do de leitura.
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.http_session = self._create_http_session()
+        # Gateway que limita as gerações simultâneas no Ollama (opcional).
+        self.gateway = gateway
+        # Controle de admissão que acompanha as chamadas em andamento e suas latências (opcional).
+        self.admission = admission
+        # Classificador local usado antes do LLM em check_confirmation_intent (opcional).
+        self.intent_classifier = intent_classifier
+        # Cache de respostas para perguntas repetidas com histórico vazio ou curto (opcional).
+        self.response_cache = response_cache
+        self.temperature = temperature
+        # Número de pares de turnos (usuário/assistente) a serem mantidos no histórico para o prompt.
+        self.max_history_turns = max_history_turns
+        # Strings que indicam que o menu não está disponível ou houve erro ao carregá-lo.
+        self.known_menu_error_prefixes = MENU_ERROR_MESSAGES
+        # Prompt base compilado: (versão_do_cardápio, prompt, é_prompt_de_erro).
+        self._compiled_prompt = None
+        # Prompt do modo estruturado compilado: (versão_do_cardápio, prompt, formato_da_resposta).
+        self._compiled_structured_prompt = None
+        logging.info(
+            f"LLMIntegration inicializado para o modelo '{self.model_name}' em {self.ollama_url} "
+            f"com timeout={self.timeout}, temp={self.temperature}, max_history_turns={self.max_history_turns}, "
+            f"api_mode={self.api_mode}, output_format={self.output_format}, keep_alive={self.keep_alive}, connect_timeout={self.connect_timeout}, "
+            f"pool_size={self.pool_size}, max_retries={self.max_retries}, rotas={self.model_routes}"
+        )
+
+    def _route(self, task):
+        """Rota (modelo e keep_alive) da tarefa."""
+        return self.model_routes[task]
+
+    def _create_http_session(self):
         """
-        Gera uma resposta da API Ollama, construindo o contexto atualizado
-        com o histórico da conversa a cada chamada.
+        Cria a sessão HTTP (com pool de conexões keep-alive) usada em todas as chamadas ao Ollama.
+        Apenas falhas de conexão são repetidas, com backoff exponencial; erros de leitura
+        e respostas HTTP não são repetidos para não duplicar gerações em andamento.
         """
-        base_prompt, is_error_prompt = self._build_base_context()
-        
-        if is_error_prompt:
-             logging.warning("Usando prompt de erro pois o menu não foi carregado ou está vazio.")
-             full_prompt = base_prompt # Usa apenas o prompt de erro, sem histórico.
+        retry = Retry(
+            total=self.max_retries,
+            connect=self.max_retries,
+            read=0,
+            status=0,
+            other=0,
+            backoff_factor=self.retry_backoff,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+        http_session = requests.Session()
+        http_session.mount("http://", adapter)
+        http_session.mount("https://", adapter)
+        http_session.headers.update({'Content-Type': 'application/json'})
+        return http_session
+
+    def reset_http_session(self):
+        """Descarta o pool de conexões atual e cria um novo (ex.: após um fork do processo)."""
+        old_session, self.http_session = self.http_session, self._create_http_session()
+        old_session.close()
+
+    def close(self):
+        """Fecha as conexões mantidas pelo pool."""
+        self.http_session.close()
+
+    def _get_menu_string(self):
+        """
+        Obtém o cardápio formatado a partir do MenuCache, sem acessar o MongoDB.
+        Retorna:
+            str: String formatada do cardápio ou uma mensagem de erro/indisponibilidade.
+        """
+        if self.menu_cache is None:
+            logging.error("LLMIntegration: self.menu_cache (cache do cardápio) não está disponível.")
+            return MENU_UNAVAILABLE_MESSAGE
+        return self.menu_cache.get_menu_string()
+
+    def _is_menu_unavailable(self, menu_string):
+        """Verifica se a string do menu indica que ele não está disponível."""
+        return any(menu_string.startswith(prefix) for prefix in self.known_menu_error_prefixes)
+
+    def _build_base_context(self):
+        """
+        Retorna o prompt base para o LLM, compilado uma única vez por versão do cardápio.
+        Retorna uma tupla: (string_do_prompt_base, booleano_indicando_se_eh_prompt_de_erro).
+        """
+        snapshot = self.menu_cache.get_snapshot() if self.menu_cache is not None else None
+        version = snapshot.version if snapshot is not None else None
+        compiled = self._compiled_prompt
+        if compiled is not None and compiled[0] == version:
+            return compiled[1], compiled[2]
+
+        menu_string = snapshot.menu_string if snapshot is not None else self._get_menu_string()
+        if self._is_menu_unavailable(menu_string):
+            logging.warning("Falha ao carregar o menu ou menu vazio. Construindo prompt de erro para o LLM.")
+            base_prompt, is_error_prompt = ERROR_PROMPT, True # True indica que é um prompt de erro
         else:
-            history_string = ""
-            if conversation_history:
-                # Considera as últimas N interações (N pares de user/assistant)
-                num_messages_to_keep = self.max_history_turns * 2 
-                recent_history = conversation_history[-num_messages_to_keep:]
-                for entry in recent_history:
-                    role = "Cliente" if entry.get("role") == "user" else "Assistente"
-                    history_string += f"{role}: {entry.get('content', '')}\n"
+            base_prompt, is_error_prompt = BASE_PROMPT_TEMPLATE.format(menu_string=menu_string), False
 
-            full_prompt = f"{base_prompt}\n\n{history_string}Cliente: {user_input}\nAssistente:"
+        self._compiled_prompt = (version, base_prompt, is_error_prompt)
+        PROMPT_PREFIX_BUILDS.inc()
+        PROMPT_BUILT_BYTES.observe(len(base_prompt.encode('utf-8')), part="prefix")
+        logging.info(f"Prompt base compilado para a versão {version} do cardápio ({len(base_prompt)} caracteres).")
+        return base_prompt, is_error_prompt
 
-        # Loga apenas uma parte do prompt para evitar logs excessivamente longos.
-        logging.debug(f"Prompt enviado para LLM (generate_response):\n{full_prompt[:1000]}...")
+    def _build_structured_context(self):
+        """
+        Retorna o prompt do modo estruturado e o valor do campo "format" do Ollama,
+        compilados uma única vez por versão do cardápio, ou None se o cardápio estiver
+        indisponível (o modo texto trata esse caso).
+        Retorna uma tupla: (prompt, formato_da_resposta).
+        """
+        if self.menu_cache is None:
+            return None
+        snapshot = self.menu_cache.get_snapshot()
+        if self._is_menu_unavailable(snapshot.menu_string):
+            return None
+        compiled = self._compiled_structured_prompt
+        if compiled is not None and compiled[0] == snapshot.version:
+            return compiled[1], compiled[2]
+
+        prompt = STRUCTURED_PROMPT_TEMPLATE.format(menu_string=snapshot.menu_string)
+        if self.output_format == "schema":
+            response_format = _build_response_schema([item["name"] for item in snapshot.items])
+        else:
+            response_format = "json"
+        self._compiled_structured_prompt = (snapshot.version, prompt, response_format)
+        PROMPT_PREFIX_BUILDS.inc()
+        PROMPT_BUILT_BYTES.observe(len(prompt.encode('utf-8')), part="prefix")
+        logging.info(f"Prompt estruturado compilado para a versão {snapshot.version} do cardápio ({len(prompt)} caracteres).")
+        return prompt, response_format
+
+    def _response_cache_key(self, user_input, conversation_history, structured=False):
+        """
+        Chave do cache de respostas para esta mensagem, ou None se ela não for cacheável
+        (cache desativado, histórico longo ou cardápio indisponível).
+        """
+        if self.response_cache is None:
+            return None
+        _, is_error_prompt = self._build_base_context()
+        if is_error_prompt:
+            return None
+        menu_version = self._compiled_prompt[0]
+        model = self._route(TASK_STRUCTURED if structured else TASK_DIALOGUE).model
+        return self.response_cache.make_key(
+            menu_version, user_input, conversation_history,
+            variant=f"{self.api_mode}:{model}:{self.output_format if structured else 'text'}"
+        )
 
-        payload = {
-            "model": self.model_name,
-            "prompt": full_prompt,
-            "stream": False, # Garante que a resposta completa seja recebida de uma vez.
-            "options": {
+    def _recent_history(self, conversation_history):
+        """
+        Últimas N interações (N pares de user/assistant). Com max_history_turns=None, o histórico
+        já chega limitado (ex.: pelo HistoryCompactor do ChatbotHandler) e é usado inteiro.
+        """
+        if not conversation_history:
+            return []
+        if self.max_history_turns is None:
+            return conversation_history
+        return conversation_history[-self.max_history_turns * 2:]
+
+    def _build_history_tail(self, user_input, conversation_history):
+        """
+        Monta apenas a parte variável do prompt (histórico recente e mensagem atual).
+        """
+        parts = ["\n\n"]
+        for entry in self._recent_history(conversation_history):
+            role = HISTORY_ROLE_LABELS.get(entry.get("role"), "Assistente")
+            parts.append(f"{role}: {entry.get('content', '')}\n")
+        parts.append(f"Cliente: {user_input}\nAssistente:")
+        return "".join(parts)
+
+    def _build_chat_messages(self, base_prompt, user_input, conversation_history):
+        """
+        Monta as mensagens para o endpoint /api/chat. O prompt base vai como mensagem
+        de sistema fixa, o que mantém o prefixo estável e permite reaproveitar o cache KV do Ollama.
+        """
+        messages = [{"role": "system", "content": base_prompt}]
+        for entry in self._recent_history(conversation_history):
+            role = entry.get("role") if entry.get("role") in ("user", "system") else "assistant"
+            messages.append({"role": role, "content": entry.get('content', '')})
+        messages.append({"role": "user", "content": user_input})
+        return messages
+
+    def _build_generation_request(self, user_input, conversation_history, structured=False):
+        """
+        Monta a URL e o payload da chamada de geração de acordo com o modo da API.
+        Com structured=True, usa o prompt estruturado e pede a resposta em JSON.
+        Retorna uma tupla: (url, payload).
+        """
+        route = self._route(TASK_STRUCTURED if structured else TASK_DIALOGUE)
+        if structured:
+            (base_prompt, response_format), is_error_prompt = self._build_structured_context(), False
+            options = {"temperature": self.temperature}
+        else:
+            base_prompt, is_error_prompt = self._build_base_context()
+            options = {
                 "temperature": self.temperature,
-                "stop": ["Cliente:", "\nCliente:", "\n\nCliente:"] # Tokens para interromper a geração.
+                "stop": STOP_TOKENS # Tokens para interromper a geração.
             }
-        }
-        headers = {'Content-Type': 'application/json'}
 
-        try:
-            response = requests.post(self.ollama_url, headers=headers, data=json.dumps(payload), timeout=self.timeout)
-            response.raise_for_status() # Levanta uma exceção para respostas HTTP 4xx/5xx.
-            response_data = response.json()
-
-            generated_text = response_data.get('response', '').strip()
-            # Remove tokens de parada do final da resposta, se presentes.
-            for stop_token in payload.get("options", {}).get("stop", []):
-                if generated_text.endswith(stop_token):
-                    generated_text = generated_text[:-len(stop_token)].strip()
+        if self.api_mode == "chat":
+            if is_error_prompt:
+                logging.warning("Usando prompt de erro pois o menu não foi carregado ou está vazio.")
+                messages = self._build_chat_messages(base_prompt, user_input, None)
+            else:
+                messages = self._build_chat_messages(base_prompt, user_input, conversation_history)
+                PROMPT_BUILT_BYTES.observe(
+                    sum(len(m["content"].encode('utf-8')) for m in messages[1:]), part="tail"
+                )
+            logging.debug(f"Mensagens enviadas para LLM (generate_response/chat): {messages[1:]}")
+            payload = {"model": route.model, "messages": messages, "stream": False, "options": options}
+            url = self.chat_url
+        else:
+            if is_error_prompt:
+                 logging.warning("Usando prompt de erro pois o menu não foi carregado ou está vazio.")
+                 full_prompt = base_prompt # Usa apenas o prompt de erro, sem histórico.
+            else:
+                history_tail = self._build_history_tail(user_input, conversation_history)
+                PROMPT_BUILT_BYTES.observe(len(history_tail.encode('utf-8')), part="tail")
+                full_prompt = base_prompt + history_tail
+
+            # Loga apenas uma parte do prompt para evitar logs excessivamente longos.
+            logging.debug(f"Prompt enviado para LLM (generate_response):\n{full_prompt[:1000]}...")
+            payload = {
+                "model": route.model,
+                "prompt": full_prompt,
+                "stream": False, # Garante que a resposta completa seja recebida de uma vez.
+                "options": options
+            }
+            url = self.ollama_url
+
+        if structured:
+            payload["format"] = response_format
+        if route.keep_alive is not None:
+            payload["keep_alive"] = route.keep_alive # Mantém o modelo (e seu cache) residente.
+        return url, payload
+
+    def _record_eval_stats(self, response_data, endpoint):
+        """Registra as estatísticas de avaliação do prompt e de geração retornadas pelo Ollama."""
+        prompt_eval_count = response_data.get('prompt_eval_count')
+        prompt_eval_duration = response_data.get('prompt_eval_duration') # Em nanossegundos.
+        eval_count = response_data.get('eval_count')
+        eval_duration = response_data.get('eval_duration') # Em nanossegundos.
+        load_duration = response_data.get('load_duration') # Em nanossegundos.
+        model = response_data.get('model', '')
+        if prompt_eval_count is not None:
+            PROMPT_EVAL_TOKENS.observe(prompt_eval_count, endpoint=endpoint, model=model)
+        if prompt_eval_duration is not None:
+            PROMPT_EVAL_SECONDS.observe(prompt_eval_duration / 1e9, endpoint=endpoint, model=model)
+        if eval_count is not None:
+            EVAL_TOKENS.observe(eval_count, endpoint=endpoint, model=model)
+        if eval_duration is not None:
+            EVAL_SECONDS.observe(eval_duration / 1e9, endpoint=endpoint, model=model)
+        if load_duration is not None:
+            LOAD_SECONDS.observe(load_duration / 1e9, endpoint=endpoint, model=model)
+        logging.info(
+            f"Ollama ({endpoint}, {model}): prompt_eval_count={prompt_eval_count}, "
+            f"prompt_eval_duration={prompt_eval_duration}ns, eval_count={eval_count}, "
+            f"eval_duration={eval_duration}ns, load_duration={load_duration}ns"
+        )
 
-            logging.debug(f"Resposta recebida do LLM (generate_response): {generated_text}")
-            return generated_text
+    def _post_json(self, url, payload, read_timeout):
+        """Faz um POST não-streaming ao Ollama e retorna o JSON da resposta."""
+        with self._time_upstream():
+            response = self.http_session.post(url, data=json.dumps(payload), timeout=(self.connect_timeout, read_timeout))
+        response.raise_for_status() # Levanta uma exceção para respostas HTTP 4xx/5xx.
+        return response.json()
 
-        except requests.exceptions.Timeout:
+    def _call_ollama(self, url, payload, read_timeout):
+        """
+        Chamada não-streaming ao Ollama. Com o gateway configurado, respeita o limite de
+        gerações simultâneas e agrupa prompts idênticos em andamento.
+        """
+        with Span("llm.ollama"), self._track_call():
+            if self.gateway is None:
+                return self._post_json(url, payload, read_timeout)
+            return self.gateway.call(_coalescing_key(url, payload), lambda: self._post_json(url, payload, read_timeout))
+
+    def _track_call(self):
+        """Registra a chamada no controle de admissão, quando configurado."""
+        return self.admission.track() if self.admission is not None else contextlib.nullcontext()
+
+    def _time_upstream(self):
+        """Mede a requisição ao Ollama (sem a espera no gateway) para o controle de admissão."""
+        return self.admission.time_upstream() if self.admission is not None else contextlib.nullcontext()
+
+    def admission_decision(self):
+        """Nova decisão de admissão para um turno de chat; o LLM é evitado quando ela indica sobrecarga."""
+        return AdmissionDecision(self.admission)
+
+    def _get_cached_response(self, user_input, conversation_history, structured=False):
+        """Retorna (chave_do_cache, resposta_em_cache_ou_None)."""
+        cache_key = self._response_cache_key(user_input, conversation_history, structured)
+        if cache_key is None:
+            return None, None
+        return cache_key, self.response_cache.get(cache_key)
+
+    def _finish_generation(self, response_data, cache_key):
+        """Extrai o texto gerado da resposta do Ollama, remove tokens de parada e guarda no cache."""
+        self._record_eval_stats(response_data, self.api_mode)
+        if self.api_mode == "chat":
+            generated_text = (response_data.get('message') or {}).get('content', '').strip()
+        else:
+            generated_text = response_data.get('response', '').strip()
+        # Remove tokens de parada do final da resposta, se presentes.
+        for stop_token in STOP_TOKENS:
+            if generated_text.endswith(stop_token):
+                generated_text = generated_text[:-len(stop_token)].strip()
+
+        logging.debug(f"Resposta recebida do LLM (generate_response): {generated_text}")
+        if cache_key is not None and generated_text:
+            self.response_cache.put(cache_key, generated_text)
+        return generated_text
+
+    def _generation_error_message(self, error):
+        """Registra o erro da chamada ao Ollama e retorna a mensagem de desculpas correspondente."""
+        if isinstance(error, GatewayBusyError):
+            logging.warning(f"Gateway do LLM sobrecarregado: {error}")
+            return LLM_BUSY_MESSAGE
+        if isinstance(error, requests.exceptions.Timeout):
             logging.error(f"Timeout ({self.timeout}s) ao chamar a API Ollama em {self.ollama_url}")
             return "Desculpe, o serviço demorou muito para responder. Tente novamente."
-        except requests.exceptions.RequestException as e:
-            logging.exception(f"Erro de rede ou HTTP ao chamar a API Ollama: {e}")
+        if isinstance(error, requests.exceptions.RequestException):
+            logging.exception(f"Erro de rede ou HTTP ao chamar a API Ollama: {error}")
             return "Desculpe, não consegui me conectar ao serviço de chat no momento."
-        except json.JSONDecodeError:
-            # response.text pode ser útil para depurar o que foi recebido.
-            logging.exception(f"Erro ao decodificar a resposta JSON do Ollama: {response.text if 'response' in locals() else 'Resposta não disponível'}")
+        if isinstance(error, json.JSONDecodeError):
+            logging.exception("Erro ao decodificar a resposta JSON do Ollama.")
             return "Desculpe, recebi uma resposta inválida do serviço de chat."
+        logging.exception("Ocorreu um erro inesperado na integração com o LLM.")
+        return "Desculpe, ocorreu um erro inesperado."
+
+    def generate_response(self, user_input, conversation_history=None):
+        """
+        Gera uma resposta da API Ollama, reutilizando o prompt base compilado
+        e acrescentando apenas o histórico da conversa a cada chamada.
+        No modo "chat", usa o endpoint /api/chat com uma mensagem de sistema fixa.
+        Perguntas repetidas com histórico curto são respondidas pelo cache de respostas.
+        """
+        cache_key, cached_text = self._get_cached_response(user_input, conversation_history)
+        if cached_text is not None:
+            logging.debug(f"Resposta do LLM obtida do cache para: {user_input}")
+            return cached_text
+
+        with Span("llm.prompt_build"):
+            url, payload = self._build_generation_request(user_input, conversation_history)
+        try:
+            response_data = self._call_ollama(url, payload, self.timeout)
+            return self._finish_generation(response_data, cache_key)
+        except Exception as e:
+            return self._generation_error_message(e)
+
+    async def generate_response_async(self, user_input, conversation_history=None):
+        """
+        Versão assíncrona de generate_response, para rotas async. A espera pela vaga no
+        gateway e pela resposta do Ollama não ocupa a thread do laço que a chamou.
+        """
+        cache_key, cached_text = self._get_cached_response(user_input, conversation_history)
+        if cached_text is not None:
+            return cached_text
+
+        with Span("llm.prompt_build"):
+            url, payload = self._build_generation_request(user_input, conversation_history)
+        try:
+            with Span("llm.ollama"), self._track_call():
+                if self.gateway is not None:
+                    response_data = await self.gateway.call_async(
+                        _coalescing_key(url, payload), lambda: self._post_json(url, payload, self.timeout)
+                    )
+                else:
+                    response_data = await asyncio.to_thread(self._post_json, url, payload, self.timeout)
+            return self._finish_generation(response_data, cache_key)
+        except Exception as e:
+            return self._generation_error_message(e)
+
+    def generate_structured_response(self, user_input, conversation_history=None):
+        """
+        Gera a resposta do turno em uma única chamada no formato JSON, com a intenção,
+        os itens extraídos e a mensagem para o cliente.
+
+        Returns:
+            dict | None: {"intent": str, "items": [{"name": str, "quantity": int}], "reply": str}.
+                         Em falhas de rede, a mensagem de desculpas vem em "reply" com intenção "other".
+                         None quando o cardápio está indisponível ou o JSON é inválido; nesses casos
+                         o chamador deve usar generate_response (modo texto).
+        """
+        if self._build_structured_context() is None:
+            return None
+        cache_key, cached_text = self._get_cached_response(user_input, conversation_history, structured=True)
+        if cached_text is not None:
+            return _parse_structured_reply(cached_text)
+
+        with Span("llm.prompt_build"):
+            url, payload = self._build_generation_request(user_input, conversation_history, structured=True)
+        try:
+            response_data = self._call_ollama(url, payload, self.timeout)
+            self._record_eval_stats(response_data, self.api_mode)
+            if self.api_mode == "chat":
+                raw_text = (response_data.get('message') or {}).get('content', '')
+            else:
+                raw_text = response_data.get('response', '')
         except Exception as e:
-            logging.exception("Ocorreu um erro inesperado na integração com o LLM.")
-            return "Desculpe, ocorreu um erro inesperado."
+            return {"intent": "other", "items": [], "reply": self._generation_error_message(e)}
+
+        structured = _parse_structured_reply(raw_text)
+        if structured is None:
+            STRUCTURED_RESPONSES.inc(result="invalid")
+            logging.warning(f"Resposta estruturada inválida do LLM; usando o modo texto. Resposta: {raw_text[:500]}")
+            return None
+        STRUCTURED_RESPONSES.inc(result="ok")
+        logging.debug(f"Resposta estruturada recebida do LLM: {structured}")
+        if cache_key is not None:
+            self.response_cache.put(cache_key, raw_text)
+        return structured
+
+    def _llm_slot(self):
+        """Vaga do gateway para chamadas streaming (ou nenhuma restrição sem gateway)."""
+        return self.gateway.slot() if self.gateway is not None else contextlib.nullcontext()
+
+    def generate_response_stream(self, user_input, conversation_history=None):
+        """
+        Variante de generate_response que usa stream=True no Ollama e produz
+        os pedaços de texto à medida que chegam, já sem os tokens de parada.
+        Em caso de erro antes do primeiro pedaço, produz a mensagem de desculpas correspondente.
+        Respostas em cache são produzidas de uma só vez, sem chamar o Ollama.
+        """
+        cache_key, cached_text = self._get_cached_response(user_input, conversation_history)
+        if cached_text is not None:
+            yield cached_text
+            return
+
+        with Span("llm.prompt_build"):
+            url, payload = self._build_generation_request(user_input, conversation_history)
+        payload["stream"] = True
+        trimmer = StopTokenTrimmer(STOP_TOKENS)
+        emitted = False
+        streamed_parts = []
 
-    def check_confirmation_intent(self, user_input, previous_question):
+        try:
+            # No streaming a vaga do gateway fica reservada até o fim da transmissão.
+            with Span("llm.ollama_stream"), self._track_call(), self._llm_slot(), self._time_upstream(), self.http_session.post(
+                url, data=json.dumps(payload), timeout=(self.connect_timeout, self.timeout), stream=True
+            ) as response:
+                response.raise_for_status()
+                # O Ollama envia um objeto JSON por linha (NDJSON).
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk_data = json.loads(line)
+                    if chunk_data.get('error'):
+                        raise requests.exceptions.RequestException(chunk_data['error'])
+
+                    if self.api_mode == "chat":
+                        chunk = (chunk_data.get('message') or {}).get('content', '')
+                    else:
+                        chunk = chunk_data.get('response', '')
+                    text = trimmer.feed(chunk)
+                    if text:
+                        emitted = True
+                        streamed_parts.append(text)
+                        yield text
+                    if chunk_data.get('done'):
+                        self._record_eval_stats(chunk_data, self.api_mode)
+                        break
+                    if trimmer.stopped:
+                        break # Fecha a conexão; o Ollama interrompe a geração.
+
+            text = trimmer.flush()
+            if text:
+                emitted = True
+                streamed_parts.append(text)
+                yield text
+            # Só respostas completas vão para o cache; gerações interrompidas por erro não.
+            generated_text = "".join(streamed_parts).strip()
+            if cache_key is not None and generated_text:
+                self.response_cache.put(cache_key, generated_text)
+
+        except GatewayBusyError as e:
+            logging.warning(f"Gateway do LLM sobrecarregado (streaming): {e}")
+            yield LLM_BUSY_MESSAGE
+        except requests.exceptions.Timeout:
+            logging.error(f"Timeout ({self.timeout}s) ao transmitir resposta da API Ollama em {url}")
+            if not emitted:
+                yield "Desculpe, o serviço demorou muito para responder. Tente novamente."
+        except requests.exceptions.RequestException as e:
+            logging.exception(f"Erro de rede ou HTTP ao transmitir resposta da API Ollama: {e}")
+            if not emitted:
+                yield "Desculpe, não consegui me conectar ao serviço de chat no momento."
+        except json.JSONDecodeError:
+            logging.exception("Erro ao decodificar um pedaço NDJSON do Ollama.")
+            if not emitted:
+                yield "Desculpe, recebi uma resposta inválida do serviço de chat."
+
+    def check_confirmation_intent(self, user_input, previous_question, use_local_classifier=True):
         """
         Verifica se a entrada do usuário indica uma confirmação positiva para a pergunta anterior do assistente.
-        Usa o LLM para classificar a intenção como 'sim' ou 'não'.
+        Tenta primeiro o classificador local e só usa o LLM (modelo da tarefa TASK_INTENT) quando a confiança é baixa.
+        Args:
+            use_local_classifier (bool): False quando quem chama já consultou o classificador local.
         Retorna:
             str: 'sim' ou 'não'.
         """
+        if use_local_classifier and self.intent_classifier is not None:
+            local_intent = self.intent_classifier.decide(user_input)
+            if local_intent is not None:
+                return local_intent
+
         # Validação básica da pergunta anterior.
         if not previous_question.strip().endswith("Correto?"):
              logging.warning("check_confirmation_intent chamada sem uma pergunta de confirmação padrão terminada em 'Correto?'.")
@@ -234,23 +858,23 @@ Based on the Customer's Response "{user_input}", is the intent a positive confir
 
         logging.info(f"Verificando intenção de confirmação para: '{user_input}' em resposta a '{previous_question}'")
 
+        route = self._route(TASK_INTENT)
         payload = {
-            "model": self.model_name,
+            "model": route.model,
             "prompt": intent_prompt,
             "stream": False,
             "options": {
                 "temperature": 0.1, # Baixa temperatura para respostas mais determinísticas.
             }
         }
-        headers = {'Content-Type': 'application/json'}
-
+        if route.keep_alive is not None:
+            payload["keep_alive"] = route.keep_alive
         try:
             # Timeout menor para esta chamada, pois é uma tarefa de classificação mais simples.
             # Usando max para garantir que o timeout não seja menor que 10s.
             effective_timeout = max(10, self.timeout // 2) if self.timeout else 10
-            response = requests.post(self.ollama_url, headers=headers, data=json.dumps(payload), timeout=effective_timeout)
-            response.raise_for_status()
-            response_data = response.json()
+            response_data = self._call_ollama(self.ollama_url, payload, effective_timeout)
+            self._record_eval_stats(response_data, "generate")
 
             raw_intent_result = response_data.get('response', '').strip().lower()
             intent_result = ""
@@ -267,6 +891,9 @@ Based on the Customer's Response "{user_input}", is the intent a positive confir
                 logging.warning(f"Resposta inesperada do LLM para verificação de intenção: '{raw_intent_result}'. Tratando como 'não'.")
                 return "não" # Fallback para 'não' se a resposta do LLM não for clara.
 
+        except GatewayBusyError as e:
+            logging.warning(f"Gateway do LLM sobrecarregado ao verificar intenção de confirmação: {e}")
+            return "não" # Sem confirmação explícita, o pedido não é finalizado.
         except requests.exceptions.Timeout:
             logging.error(f"Timeout ao verificar intenção de confirmação com Ollama.")
             return "não" # Retorna 'não' em caso de timeout para segurança.
@@ -274,8 +901,7 @@ Based on the Customer's Response "{user_input}", is the intent a positive confir
             logging.exception(f"Erro de rede/HTTP ao verificar intenção de confirmação: {e}")
             return "não" # Retorna 'não' em caso de erro de rede.
         except json.JSONDecodeError:
-             # response.text pode ser útil para depurar o que foi recebido.
-             logging.exception(f"Erro ao decodificar JSON da verificação de intenção: {response.text if 'response' in locals() else 'Resposta não disponível'}")
+             logging.exception("Erro ao decodificar JSON da verificação de intenção.")
              return "não" # Retorna 'não' em caso de erro de JSON.
         except Exception as e:
             logging.exception("Erro inesperado ao verificar intenção de confirmação.")
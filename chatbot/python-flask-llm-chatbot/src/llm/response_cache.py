@@ -0,0 +1,78 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from metrics.registry import REGISTRY
+from nlp.text import normalize_text
+
+RESPONSE_CACHE_LOOKUPS = REGISTRY.counter(
+    "llm_response_cache_total", "Consultas ao cache de respostas do LLM.", labelnames=("result",)
+)
+
+
+class ResponseCache:
+    """
+    Cache LRU de respostas do LLM para perguntas repetidas ("o que tem hoje?", "tem pizza?").
+
+    A chave combina a versão do cardápio, a mensagem normalizada e uma impressão digital
+    do histórico, que precisa estar vazio ou ser curto. Quando a versão do cardápio muda,
+    as entradas das versões anteriores são descartadas.
+    """
+    def __init__(self, max_entries=256, max_history_messages=2):
+        """
+        Args:
+            max_entries (int): Número máximo de respostas guardadas.
+            max_history_messages (int): Tamanho máximo do histórico para uma mensagem ser cacheável.
+        """
+        self.max_entries = max_entries
+        self.max_history_messages = max_history_messages
+        self._entries = OrderedDict()
+        self._menu_version = None
+        self._lock = threading.Lock()
+        logging.info(f"ResponseCache inicializado com max_entries={self.max_entries}, max_history_messages={self.max_history_messages}.")
+
+    def make_key(self, menu_version, user_input, conversation_history, variant=""):
+        """
+        Monta a chave do cache ou retorna None se a mensagem não for cacheável.
+
+        Args:
+            menu_version: Versão do cardápio usada no prompt.
+            user_input (str): Mensagem do cliente.
+            conversation_history (list): Histórico enviado ao LLM.
+            variant (str): Distingue configurações que geram prompts diferentes (ex.: modo da API).
+        """
+        normalized_input = normalize_text(user_input)
+        history = conversation_history or []
+        if not normalized_input or len(history) > self.max_history_messages:
+            return None
+        history_fingerprint = hashlib.blake2b(digest_size=8)
+        for entry in history:
+            history_fingerprint.update(f"{entry.get('role')}:{normalize_text(entry.get('content', ''))}\n".encode('utf-8'))
+        return (menu_version, variant, normalized_input, history_fingerprint.hexdigest())
+
+    def get(self, key):
+        with self._lock:
+            response = self._entries.get(key)
+            if response is not None:
+                self._entries.move_to_end(key)
+        RESPONSE_CACHE_LOOKUPS.inc(result="hit" if response is not None else "miss")
+        return response
+
+    def put(self, key, response):
+        menu_version = key[0]
+        with self._lock:
+            if menu_version != self._menu_version:
+                # Cardápio mudou: respostas antigas podem citar itens ou preços desatualizados.
+                self._entries.clear()
+                self._menu_version = menu_version
+            self._entries[key] = response
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
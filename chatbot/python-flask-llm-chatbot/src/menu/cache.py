@@ -0,0 +1,324 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+from pymongo.errors import OperationFailure, PyMongoError
+from menu.index import get_menu_index
+from mongo.errors import CHANGE_STREAM_NOT_SUPPORTED
+
+# Mensagens usadas no lugar do cardápio formatado quando ele não pode ser carregado.
+MENU_UNAVAILABLE_MESSAGE = "Desculpe, o cardápio está temporariamente indisponível."
+MENU_EMPTY_MESSAGE = "No momento não temos itens cadastrados no cardápio."
+MENU_NO_VALID_ITEMS_MESSAGE = "No momento não temos itens válidos cadastrados no cardápio."
+MENU_LOAD_ERROR_MESSAGE = "Desculpe, ocorreu um erro ao tentar carregar o cardápio."
+
+MENU_ERROR_MESSAGES = (
+    MENU_UNAVAILABLE_MESSAGE,
+    MENU_EMPTY_MESSAGE,
+    MENU_NO_VALID_ITEMS_MESSAGE,
+    MENU_LOAD_ERROR_MESSAGE,
+)
+
+
+class MenuSnapshot:
+    """
+    Fotografia imutável do cardápio em uma determinada versão.
+
+    Atributos:
+        version (int): Versão do cardápio. Só é incrementada quando o conteúdo muda.
+        menu_data (dict): {lower_name: {"original_name": str, "price": Decimal}}.
+        menu_string (str): Cardápio formatado para o prompt ou uma mensagem de indisponibilidade.
+        items (tuple): Itens válidos na ordem do banco, como dicionários {"id": str, "name": str, "price": Decimal}.
+        loaded_at (float): Instante (time.monotonic) da última carga bem-sucedida.
+        menu_json (bytes): Corpo JSON já serializado de GET /menu, ou None se o cardápio não pôde ser lido.
+        etag (str): ETag forte de menu_json (hash do conteúdo, igual em todos os workers).
+    """
+    __slots__ = ("version", "menu_data", "menu_string", "items", "loaded_at", "menu_json", "etag")
+
+    def __init__(self, version, menu_data, menu_string, items, loaded_at, menu_json=None, etag=None):
+        self.version = version
+        self.menu_data = menu_data
+        self.menu_string = menu_string
+        self.items = items
+        self.loaded_at = loaded_at
+        self.menu_json = menu_json
+        self.etag = etag
+
+    @property
+    def is_available(self):
+        """Indica se o cardápio possui itens válidos para uso no chat."""
+        return bool(self.menu_data)
+
+
+class MenuCache:
+    """
+    Cache em memória do cardápio compartilhado por load_menu_data e LLMIntegration.
+
+    O cardápio é lido do MongoDB por uma thread em segundo plano, que recarrega
+    os dados quando o cache é invalidado ou quando o TTL expira; POST /menu e o
+    DELETE de item recarregam de forma síncrona. As requisições de chat e GET /menu
+    apenas leem a fotografia atual.
+
+    Com vários workers, a alteração feita em um deles só recarrega o cache desse worker.
+    Quando o MongoDB suporta change streams (replica set), uma segunda thread acompanha a
+    coleção do cardápio e invalida o cache em todos os workers; sem change streams, os
+    demais workers recebem a alteração em até ttl_seconds.
+    """
+    def __init__(self, menu_collection, ttl_seconds=300, watch_changes=True, retry_seconds=5):
+        """
+        Args:
+            menu_collection: Coleção MongoDB do cardápio (pode ser None).
+            ttl_seconds (int): Intervalo máximo entre recargas, usado como rede de segurança.
+            watch_changes (bool): Acompanha a coleção por change stream para invalidar o cache.
+            retry_seconds (float): Espera antes de reabrir o change stream após uma falha.
+        """
+        self.menu_collection = menu_collection
+        self.ttl_seconds = ttl_seconds
+        self.retry_seconds = retry_seconds
+        self._watch_supported = watch_changes and menu_collection is not None
+        self._watcher = None
+        self._watcher_pid = None
+        self._snapshot = MenuSnapshot(0, {}, MENU_UNAVAILABLE_MESSAGE, (), 0.0)
+        self._fingerprint = None
+        self._lock = threading.Lock()
+        self._refresh_event = threading.Event()
+        self._thread = None
+        self._thread_pid = None
+        logging.info(f"MenuCache inicializado com ttl={self.ttl_seconds}s.")
+
+    def start(self, blocking=True):
+        """
+        Faz a carga inicial e inicia a thread de recarga em segundo plano.
+        Com blocking=False, a carga inicial também é feita pela thread, sem esperar pelo MongoDB.
+        """
+        if blocking:
+            self.refresh()
+        else:
+            self._refresh_event.set()
+        self._ensure_refresher()
+        self._ensure_watcher()
+
+    def invalidate(self):
+        """Marca o cardápio como desatualizado e acorda a thread de recarga."""
+        logging.info("MenuCache: cache invalidado, agendando recarga do cardápio.")
+        self._ensure_refresher()
+        self._refresh_event.set()
+
+    def get_snapshot(self):
+        """
+        Retorna a fotografia atual do cardápio sem acessar o MongoDB,
+        exceto na primeira chamada caso start() ainda não tenha sido executado.
+        """
+        snapshot = self._snapshot
+        if snapshot.version == 0 and snapshot.loaded_at == 0.0:
+            snapshot = self.refresh()
+        self._ensure_refresher()
+        return snapshot
+
+    def get_menu_data(self):
+        """Atalho para o dicionário do cardápio usado pelo ChatbotHandler."""
+        return self.get_snapshot().menu_data
+
+    def get_menu_string(self):
+        """Atalho para o cardápio formatado usado pelo LLMIntegration."""
+        return self.get_snapshot().menu_string
+
+    def refresh(self):
+        """
+        Recarrega o cardápio do MongoDB e publica uma nova fotografia.
+        Em caso de erro, mantém a fotografia anterior se ela possuir itens.
+
+        Returns:
+            MenuSnapshot: A fotografia vigente após a recarga.
+        """
+        with self._lock:
+            menu_data, menu_string, items, listing, load_ok = self._load_from_db()
+            current = self._snapshot
+            if not load_ok and current.is_available:
+                logging.warning("MenuCache: falha ao recarregar o cardápio; mantendo a versão anterior.")
+                return current
+
+            fingerprint = (
+                menu_string,
+                tuple((item["id"], item["name"], item["price"]) for item in items),
+                None if listing is None else tuple((entry["id"], entry["name"], entry["price"]) for entry in listing)
+            )
+            now = time.monotonic()
+            if fingerprint == self._fingerprint:
+                self._snapshot = MenuSnapshot(
+                    current.version, current.menu_data, current.menu_string, current.items, now,
+                    current.menu_json, current.etag
+                )
+            else:
+                self._fingerprint = fingerprint
+                menu_json, etag = _serialize_listing(listing)
+                self._snapshot = MenuSnapshot(current.version + 1, menu_data, menu_string, items, now, menu_json, etag)
+                get_menu_index(menu_data) # Constrói o índice de nomes da nova versão fora do caminho das requisições.
+                logging.info(f"MenuCache: cardápio carregado (versão {self._snapshot.version}, {len(items)} itens).")
+            return self._snapshot
+
+    def _load_from_db(self):
+        """
+        Lê e valida os itens do cardápio.
+
+        Returns:
+            tuple: (menu_data, menu_string, items, listing, load_ok); listing é a lista de GET /menu
+            (None se o cardápio não pôde ser lido).
+        """
+        if self.menu_collection is None:
+            logging.error("MenuCache: menu_collection não está disponível.")
+            return {}, MENU_UNAVAILABLE_MESSAGE, (), None, False
+
+        try:
+            menu_list_from_db = list(self.menu_collection.find({}))
+        except Exception as e: # Captura erros genéricos do PyMongo ou outros.
+            logging.exception(f"MenuCache: Erro ao carregar cardápio do MongoDB: {e}")
+            return {}, MENU_LOAD_ERROR_MESSAGE, (), None, False
+
+        listing = _build_listing(menu_list_from_db)
+        if not menu_list_from_db:
+            return {}, MENU_EMPTY_MESSAGE, (), listing, True
+
+        menu_data = {}
+        items = []
+        menu_lines = []
+        for item in menu_list_from_db:
+            if not isinstance(item, dict) or 'name' not in item or 'price' not in item:
+                logging.warning(f"Item de menu do DB em formato inválido ignorado: {item}")
+                continue
+            try:
+                original_name = str(item['name'])
+                # Preços no MongoDB são armazenados como números (float).
+                # Convertendo para Decimal para consistência interna.
+                price = Decimal(str(item['price']))
+                if price < 0:
+                    logging.warning(f"Item de menu do DB com preço negativo ignorado: {item}")
+                    continue
+            except (InvalidOperation, ValueError, TypeError) as item_error:
+                logging.warning(f"Erro ao processar item de menu do DB {item}: {item_error}")
+                continue
+            menu_data[original_name.lower()] = {"original_name": original_name, "price": price}
+            items.append({"id": str(item.get('_id', '')), "name": original_name, "price": price})
+            menu_lines.append(f"- {original_name} (R$ {price:.2f})")
+
+        if not menu_lines: # Caso todos os itens tenham sido inválidos.
+            return {}, MENU_NO_VALID_ITEMS_MESSAGE, (), listing, True
+        return menu_data, "\n".join(menu_lines), tuple(items), listing, True
+
+    def _ensure_refresher(self):
+        """Inicia (ou reinicia, após um fork) a thread de recarga em segundo plano."""
+        if self._thread is not None and self._thread.is_alive() and self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._thread_pid == os.getpid():
+                return
+            self._thread = threading.Thread(target=self._refresh_loop, name="menu-cache-refresher", daemon=True)
+            self._thread_pid = os.getpid()
+            self._thread.start()
+
+    def _ensure_watcher(self):
+        """Inicia (ou reinicia, após um fork) a thread do change stream do cardápio."""
+        if not self._watch_supported:
+            return
+        if self._watcher is not None and self._watcher.is_alive() and self._watcher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._watcher is not None and self._watcher.is_alive() and self._watcher_pid == os.getpid():
+                return
+            self._watcher = threading.Thread(target=self._watch_loop, name="menu-change-stream", daemon=True)
+            self._watcher_pid = os.getpid()
+            self._watcher.start()
+
+    def _watch_loop(self):
+        """Laço da thread: invalida o cache a cada alteração na coleção e reabre o change stream após falhas."""
+        while True:
+            try:
+                with self.menu_collection.watch() as stream:
+                    logging.info("MenuCache: change stream da coleção do cardápio ativo.")
+                    self.invalidate() # Alterações feitas enquanto o change stream estava fechado.
+                    for _change in stream:
+                        self.invalidate()
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAM_NOT_SUPPORTED:
+                    self._watch_supported = False
+                    logging.info(
+                        f"MenuCache: change streams indisponíveis (mongod sem replica set); "
+                        f"alterações de outros workers chegam em até {self.ttl_seconds}s."
+                    )
+                    return
+                logging.error(f"MenuCache: erro no change stream; nova tentativa em {self.retry_seconds}s: {e}")
+            except PyMongoError as e:
+                logging.error(f"MenuCache: change stream interrompido; nova tentativa em {self.retry_seconds}s: {e}")
+            except Exception:
+                logging.exception("MenuCache: erro inesperado no change stream.")
+            time.sleep(self.retry_seconds)
+
+    def _refresh_loop(self):
+        """Laço da thread: recarrega ao ser invalidado ou quando o TTL expira."""
+        while True:
+            self._refresh_event.wait(timeout=self.ttl_seconds)
+            self._refresh_event.clear()
+            try:
+                self.refresh()
+            except Exception:
+                logging.exception("MenuCache: Erro inesperado na recarga em segundo plano.")
+
+
+def _build_listing(menu_list_from_db):
+    """
+    Monta a lista de itens de GET /menu (usada pelo chat e pela tela de administração).
+    Diferente do cardápio do chat, itens com preço inválido são listados com "0.00"
+    para que possam ser corrigidos ou excluídos pelo administrador.
+    """
+    listing = []
+    for item_index, item in enumerate(menu_list_from_db):
+        if not isinstance(item, dict):
+            logging.warning(f"GET /menu: Item {item_index} do DB não é um dicionário: {item}")
+            continue
+
+        item_id = item.get('_id')
+        item_name_raw = item.get("name")
+        item_price_raw = item.get("price")
+
+        if not item_id: # Valida _id
+            logging.warning(f"GET /menu: Item {item_index} não possui '_id': {item}")
+            continue # Pular item sem ID
+
+        # Valida nome
+        item_name_str = str(item_name_raw) if item_name_raw is not None else "Nome Indisponível"
+
+        # Valida preço
+        item_price_str = "0.00" # Preço padrão
+        if item_price_raw is not None:
+            try:
+                # Garante que o preço seja um número antes de formatar, depois converte para string para JSON.
+                numeric_price = float(item_price_raw)
+                item_price_str = f"{numeric_price:.2f}" # Formata para 2 casas decimais
+            except (ValueError, TypeError) as price_conversion_error:
+                logging.warning(f"GET /menu: Não foi possível converter o preço '{item_price_raw}' para float para o item ID {item_id}. Erro: {price_conversion_error}. Usando '0.00'.")
+        else: # item_price_raw é None
+            logging.warning(f"GET /menu: Item ID {item_id} não possui 'price'. Usando '0.00'.")
+
+        listing.append({
+            "id": str(item_id),
+            "name": item_name_str.title(),
+            "price": item_price_str
+        })
+    return listing
+
+
+def _serialize_listing(listing):
+    """
+    Serializa a resposta de GET /menu uma única vez por versão do cardápio.
+
+    Returns:
+        tuple: (corpo JSON em bytes, ETag), ou (None, None) se não houver listagem.
+    """
+    if listing is None:
+        return None, None
+    menu_json = json.dumps({"menu": listing}, separators=(",", ":")).encode("utf-8")
+    etag = hashlib.blake2b(menu_json, digest_size=16).hexdigest()
+    return menu_json, etag
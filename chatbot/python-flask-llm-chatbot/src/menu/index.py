@@ -0,0 +1,221 @@
+import logging
+import re
+import threading
+from collections import Counter
+from nlp.text import normalize_text
+
+# Artigos e preposições ignorados na comparação por tokens.
+STOP_WORDS = frozenset(("de", "do", "da", "dos", "das", "o", "a", "os", "as", "com"))
+# Similaridade mínima (coeficiente de Dice sobre trigramas) para um item ser candidato à busca aproximada.
+MIN_TRIGRAM_SIMILARITY = 0.3
+# Número máximo de candidatos avaliados com distância de edição.
+MAX_FUZZY_CANDIDATES = 8
+
+_PARENTHETICAL_RE = re.compile(r'\s*\(.*\)$')
+
+
+class MenuIndex:
+    """
+    Índice pré-computado dos nomes do cardápio para validação de itens.
+
+    Resolve um nome em etapas, da mais barata para a mais cara:
+      1. chave normalizada (minúsculas, sem acentos), com e sem o parêntese final e no singular;
+      2. tokens da consulta como prefixos dos tokens de um único item ("coca" -> "Coca-Cola");
+      3. candidatos por trigramas e distância de edição limitada ("hamburger classico").
+    Retorna None quando não há um único item compatível.
+    """
+    def __init__(self, menu_data):
+        """
+        Args:
+            menu_data (dict): {lower_name: {"original_name": str, "price": Decimal}}.
+        """
+        self._exact = {}
+        self._entries = [] # [(nome_normalizado, tokens, detalhes)]
+        self._postings = {} # {trigrama: [índices de _entries]}
+        ambiguous_keys = set()
+
+        for details in menu_data.values():
+            normalized = normalize_text(details["original_name"])
+            base = normalize_text(_PARENTHETICAL_RE.sub('', details["original_name"]))
+            tokens = tuple(token for token in normalized.split() if token not in STOP_WORDS)
+            entry_id = len(self._entries)
+            self._entries.append((normalized, tokens, details))
+
+            for key in {normalized, base, _singularize(normalized), _singularize(base)}:
+                if not key:
+                    continue
+                if key in self._exact and self._exact[key] is not details:
+                    ambiguous_keys.add(key)
+                self._exact.setdefault(key, details)
+            for trigram in _trigrams(normalized):
+                self._postings.setdefault(trigram, []).append(entry_id)
+
+        # Chaves compartilhadas por itens diferentes (ex.: "Batata (P)" e "Batata (G)") não são exatas.
+        for key in ambiguous_keys:
+            self._exact.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, name):
+        """
+        Args:
+            name (str): Nome do item como escrito pelo cliente ou pelo LLM.
+
+        Returns:
+            dict | None: Detalhes do item no cardápio ({"original_name", "price"}) ou None.
+        """
+        normalized = normalize_text(name)
+        if not normalized:
+            return None
+
+        details = self._exact.get(normalized) or self._exact.get(_singularize(normalized))
+        if details is None:
+            base = normalize_text(_PARENTHETICAL_RE.sub('', name))
+            details = self._exact.get(base)
+        if details is not None:
+            return details
+
+        query_tokens = tuple(token for token in normalized.split() if token not in STOP_WORDS)
+        details = self._match_token_prefixes(query_tokens)
+        if details is not None:
+            return details
+        return self._match_fuzzy(normalized)
+
+    def lookup_exact(self, name):
+        """Como lookup(), mas apenas pela chave normalizada (sem prefixos nem busca aproximada)."""
+        normalized = normalize_text(name)
+        if not normalized:
+            return None
+        return (
+            self._exact.get(normalized) or self._exact.get(_singularize(normalized))
+            or self._exact.get(normalize_text(_PARENTHETICAL_RE.sub('', name)))
+        )
+
+    def _match_token_prefixes(self, query_tokens):
+        """Item único cujos tokens contêm todos os tokens da consulta (como prefixo ou plural)."""
+        if not query_tokens:
+            return None
+        candidates = set(self._candidate_ids(query_tokens))
+        matches = [
+            self._entries[entry_id][2] for entry_id in sorted(candidates)
+            if all(
+                any(_token_matches(token, item_token) for item_token in self._entries[entry_id][1])
+                for token in query_tokens
+            )
+        ]
+        return matches[0] if len(matches) == 1 else None
+
+    def _candidate_ids(self, query_tokens):
+        """Itens que compartilham ao menos um trigrama com o primeiro token da consulta."""
+        candidate_ids = set()
+        for trigram in _trigrams(query_tokens[0][:3] if len(query_tokens[0]) >= 3 else query_tokens[0]):
+            candidate_ids.update(self._postings.get(trigram, ()))
+        return candidate_ids
+
+    def _match_fuzzy(self, normalized):
+        """Busca aproximada: candidatos por trigramas, confirmados por distância de edição limitada."""
+        query_trigrams = _trigrams(normalized)
+        shared = Counter()
+        for trigram in query_trigrams:
+            for entry_id in self._postings.get(trigram, ()):
+                shared[entry_id] += 1
+
+        max_distance = max(1, len(normalized) // 5)
+        best_distance = None
+        best = []
+        for entry_id, shared_count in shared.most_common(MAX_FUZZY_CANDIDATES):
+            entry_normalized, _, details = self._entries[entry_id]
+            similarity = 2 * shared_count / (len(query_trigrams) + len(_trigrams(entry_normalized)))
+            if similarity < MIN_TRIGRAM_SIMILARITY:
+                continue
+            distance = bounded_edit_distance(normalized, entry_normalized, max_distance)
+            if distance is None:
+                continue
+            if best_distance is None or distance < best_distance:
+                best_distance, best = distance, [details]
+            elif distance == best_distance:
+                best.append(details)
+        if len(best) == 1:
+            logging.debug(f"MenuIndex: '{normalized}' associado a '{best[0]['original_name']}' (distância {best_distance}).")
+            return best[0]
+        return None
+
+
+def bounded_edit_distance(first, second, max_distance):
+    """
+    Distância de Levenshtein entre duas strings, interrompida assim que ultrapassa max_distance.
+
+    Returns:
+        int | None: A distância, ou None se for maior que max_distance.
+    """
+    if abs(len(first) - len(second)) > max_distance:
+        return None
+    previous = list(range(len(second) + 1))
+    for i, first_char in enumerate(first, start=1):
+        current = [i] + [0] * len(second)
+        row_min = i
+        for j, second_char in enumerate(second, start=1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (first_char != second_char)
+            )
+            row_min = min(row_min, current[j])
+        if row_min > max_distance:
+            return None
+        previous = current
+    return previous[-1] if previous[-1] <= max_distance else None
+
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _singularize(normalized):
+    """Plural simples do português, token a token ("cocas" -> "coca", "hamburgueres" -> "hamburguer")."""
+    tokens = []
+    for token in normalized.split():
+        if len(token) > 4 and token.endswith("es") and token[-3] in "rsz":
+            token = token[:-2]
+        elif len(token) > 3 and token.endswith("s"):
+            token = token[:-1]
+        tokens.append(token)
+    return " ".join(tokens)
+
+
+def _token_matches(token, item_token):
+    """Compara um token da consulta com um token do nome do item (prefixo e plural simples)."""
+    if token == item_token:
+        return True
+    if len(token) < 3:
+        return False
+    if item_token.startswith(token):
+        return True
+    for suffix in ("es", "s"):
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3 and item_token.startswith(token[:-len(suffix)]):
+            return True
+    return False
+
+
+_index_lock = threading.Lock()
+_current_index = (None, None) # (menu_data indexado, MenuIndex)
+
+
+def get_menu_index(menu_data):
+    """
+    Retorna o MenuIndex do cardápio, construído uma única vez por versão.
+    O dicionário de cada versão do MenuCache é imutável, então a identidade do objeto identifica a versão.
+    """
+    global _current_index
+    indexed_menu, index = _current_index
+    if menu_data is indexed_menu:
+        return index
+    with _index_lock:
+        indexed_menu, index = _current_index
+        if menu_data is not indexed_menu:
+            index = MenuIndex(menu_data)
+            _current_index = (menu_data, index)
+            logging.info(f"MenuIndex construído com {len(index)} itens.")
+        return index
@@ -0,0 +1,111 @@
+import logging
+from pymongo import ASCENDING, DeleteOne, UpdateOne
+from pymongo.errors import PyMongoError
+from nlp.text import normalize_text
+
+# Nome normalizado gravado em cada item; o índice único impede que dois salvamentos simultâneos
+# incluam o mesmo item com grafias diferentes (ex.: "Pão de Queijo" e "pao de queijo").
+MENU_NAME_KEY_FIELD = "name_key"
+MENU_NAME_KEY_INDEX_NAME = "menu_name_key_unique"
+
+
+class MenuUpdateResult:
+    """Contagem de itens alterados por apply_menu_update."""
+    __slots__ = ("inserted", "updated", "removed")
+
+    def __init__(self, inserted=0, updated=0, removed=0):
+        self.inserted = inserted
+        self.updated = updated
+        self.removed = removed
+
+    @property
+    def changed(self):
+        return bool(self.inserted or self.updated or self.removed)
+
+    def to_dict(self):
+        return {"inserted": self.inserted, "updated": self.updated, "removed": self.removed}
+
+
+def ensure_menu_indexes(menu_collection):
+    """Cria (se ainda não existir) o índice único do nome normalizado na coleção do cardápio."""
+    if menu_collection is None:
+        return
+    try:
+        # Parcial: itens gravados antes do campo existir recebem o name_key no próximo POST /menu.
+        menu_collection.create_index(
+            [(MENU_NAME_KEY_FIELD, ASCENDING)], name=MENU_NAME_KEY_INDEX_NAME, unique=True,
+            partialFilterExpression={MENU_NAME_KEY_FIELD: {"$type": "string"}}
+        )
+        logging.info(f"Índice '{MENU_NAME_KEY_INDEX_NAME}' garantido na coleção do cardápio.")
+    except PyMongoError as e:
+        logging.error(f"Não foi possível criar o índice '{MENU_NAME_KEY_INDEX_NAME}' na coleção do cardápio: {e}")
+
+
+def build_menu_operations(current_items, new_items):
+    """
+    Calcula as operações que levam o cardápio atual ao novo, comparando os itens pelo nome normalizado.
+
+    Os itens gravados levam também o nome normalizado (name_key), usado como filtro das inclusões.
+
+    Args:
+        current_items (list): Documentos atuais da coleção ({"_id", "name", "price", "name_key"}).
+        new_items (list): Itens validados do novo cardápio ({"name": str, "price": float}).
+
+    Returns:
+        list: Operações de bulk_write: atualizações e inclusões (upsert) primeiro, exclusões por último.
+    """
+    current_by_key = {}
+    operations = []
+    deletes = []
+    for document in current_items:
+        key = normalize_text(document.get("name"))
+        if key in current_by_key:
+            deletes.append(DeleteOne({"_id": document["_id"]})) # Item duplicado no banco.
+        else:
+            current_by_key[key] = document
+
+    new_by_key = {}
+    for item in new_items:
+        key = normalize_text(item["name"])
+        if key in new_by_key:
+            logging.warning(f"Cardápio: item '{item['name']}' repetido na atualização; mantendo o último.")
+        new_by_key[key] = item
+
+    for key, item in new_by_key.items():
+        document = current_by_key.pop(key, None)
+        fields = {**item, MENU_NAME_KEY_FIELD: key}
+        if document is None:
+            # O filtro pelo nome normalizado (com índice único) torna a inclusão idempotente
+            # se dois salvamentos chegarem juntos, mesmo com grafias diferentes.
+            operations.append(UpdateOne({MENU_NAME_KEY_FIELD: key}, {"$set": fields}, upsert=True))
+        elif (document.get("name") != item["name"] or document.get(MENU_NAME_KEY_FIELD) != key
+              or not _same_price(document.get("price"), item["price"])):
+            operations.append(UpdateOne({"_id": document["_id"]}, {"$set": fields}))
+
+    deletes.extend(DeleteOne({"_id": document["_id"]}) for document in current_by_key.values())
+    return operations + deletes
+
+
+def apply_menu_update(menu_collection, new_items):
+    """
+    Aplica o novo cardápio com um único bulk_write ordenado, alterando apenas o que mudou.
+    Os itens não somem da coleção durante a atualização, então o chat nunca lê um cardápio vazio.
+
+    Returns:
+        MenuUpdateResult: Itens incluídos, atualizados e removidos.
+    """
+    current_items = list(menu_collection.find({}, {"name": 1, "price": 1, MENU_NAME_KEY_FIELD: 1}))
+    operations = build_menu_operations(current_items, new_items)
+    if not operations:
+        return MenuUpdateResult()
+    result = menu_collection.bulk_write(operations, ordered=True)
+    return MenuUpdateResult(
+        inserted=result.upserted_count, updated=result.modified_count, removed=result.deleted_count
+    )
+
+
+def _same_price(current_price, new_price):
+    try:
+        return float(current_price) == new_price
+    except (TypeError, ValueError):
+        return False
@@ -0,0 +1,54 @@
+from metrics.registry import Counter, Gauge, Histogram
+
+# Content-Type do formato texto de exposição do Prometheus.
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def render_prometheus(registry):
+    """Serializa as métricas do registro no formato texto do Prometheus (versão 0.0.4)."""
+    lines = []
+    for metric in sorted(registry.metrics(), key=lambda metric: metric.name):
+        if isinstance(metric, Counter):
+            metric_type = "counter"
+        elif isinstance(metric, Gauge):
+            metric_type = "gauge"
+        elif isinstance(metric, Histogram):
+            metric_type = "histogram"
+        else:
+            continue
+        lines.append(f"# HELP {metric.name} {_escape_help(metric.documentation)}")
+        lines.append(f"# TYPE {metric.name} {metric_type}")
+
+        if metric_type == "histogram":
+            for key, counts, total_sum, total_count in metric.samples():
+                labels = _format_labels(metric.labelnames, key)
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else _format_value(bound)
+                    lines.append(f"{metric.name}_bucket{_format_labels(metric.labelnames, key, le=le)} {cumulative}")
+                lines.append(f"{metric.name}_sum{labels} {_format_value(total_sum)}")
+                lines.append(f"{metric.name}_count{labels} {total_count}")
+        else:
+            for key, value in metric.samples():
+                lines.append(f"{metric.name}{_format_labels(metric.labelnames, key)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def _format_labels(labelnames, key, le=None):
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(labelnames, key)]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape_label(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _escape_help(text):
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
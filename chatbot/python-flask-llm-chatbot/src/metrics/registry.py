@@ -0,0 +1,136 @@
+import bisect
+import threading
+
+# Limites padrão (em bytes) para histogramas de tamanho.
+SIZE_BUCKETS = (256, 1024, 2048, 4096, 8192, 16384, 32768, 65536)
+# Limites padrão (em tokens) para contagens de tokens do LLM.
+TOKEN_BUCKETS = (16, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+# Limites padrão (em segundos) para latências.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Counter:
+    """Contador monotônico, opcionalmente separado por rótulos."""
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def samples(self):
+        """Lista de (valores_dos_rótulos, valor)."""
+        with self._lock:
+            return list(self._values.items())
+
+
+class Gauge:
+    """Valor instantâneo que pode subir e descer (ex.: profundidade de fila), opcionalmente separado por rótulos."""
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def samples(self):
+        """Lista de (valores_dos_rótulos, valor)."""
+        with self._lock:
+            return list(self._values.items())
+
+
+class Histogram:
+    """Histograma com limites fixos, opcionalmente separado por rótulos."""
+    def __init__(self, name, documentation, buckets, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        self._values = {} # {label_key: [contagens_por_bucket, soma, total]}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def snapshot(self, **labels):
+        """
+        Returns:
+            tuple: (contagens_por_bucket, soma, total). A última contagem corresponde a +Inf.
+        """
+        entry = self._values.get(_label_key(self.labelnames, labels))
+        if entry is None:
+            return [0] * (len(self.buckets) + 1), 0.0, 0
+        with self._lock:
+            return list(entry[0]), entry[1], entry[2]
+
+    def samples(self):
+        """Lista de (valores_dos_rótulos, contagens_por_bucket, soma, total)."""
+        with self._lock:
+            return [(key, list(entry[0]), entry[1], entry[2]) for key, entry in self._values.items()]
+
+
+class MetricsRegistry:
+    """Registro das métricas do processo, indexadas pelo nome."""
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, name, factory):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = factory()
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(name, lambda: Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._get_or_create(name, lambda: Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, buckets, labelnames=()):
+        return self._get_or_create(name, lambda: Histogram(name, documentation, buckets, labelnames))
+
+    def metrics(self):
+        with self._lock:
+            return list(self._metrics.values())
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+# Registro global usado pelos módulos da aplicação.
+REGISTRY = MetricsRegistry()
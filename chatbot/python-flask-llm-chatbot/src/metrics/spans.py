@@ -0,0 +1,32 @@
+import time
+from metrics.registry import REGISTRY, LATENCY_BUCKETS
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "stage_duration_seconds", "Duração de cada etapa do atendimento de uma mensagem.", LATENCY_BUCKETS,
+    labelnames=("stage",)
+)
+
+
+class Span:
+    """
+    Mede a duração de um bloco e a registra no histograma stage_duration_seconds:
+
+        with Span("llm.ollama"):
+            ...
+
+    Custa duas leituras de perf_counter e uma observação no histograma, então pode
+    ficar ativo em produção.
+    """
+    __slots__ = ("stage", "_started_at")
+
+    def __init__(self, stage):
+        self.stage = stage
+        self._started_at = 0.0
+
+    def __enter__(self):
+        self._started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        STAGE_SECONDS.observe(time.perf_counter() - self._started_at, stage=self.stage)
+        return False
@@ -0,0 +1 @@
+# Este arquivo é intencionalmente deixado em branco.
\ No newline at end of file
@@ -0,0 +1,6 @@
+# Códigos de erro do servidor MongoDB tratados pela aplicação.
+
+# Chave duplicada (ex.: documento já gravado em uma tentativa anterior ou violação de índice único).
+DUPLICATE_KEY_ERROR = 11000
+# Change streams não suportados (mongod standalone, sem replica set).
+CHANGE_STREAM_NOT_SUPPORTED = 40573
@@ -0,0 +1,154 @@
+import logging
+from metrics.registry import REGISTRY
+from nlp.text import normalize_text
+
+# Intenções possíveis para a resposta do cliente a uma pergunta "Correto?".
+INTENT_YES = "yes"
+INTENT_NO = "no"
+INTENT_MODIFY = "modify"
+INTENT_UNKNOWN = "unknown"
+
+# Frases já normalizadas (minúsculas e sem acentos).
+YES_PHRASES = (
+    "sim", "s", "ss", "si", "isso", "issu", "isso mesmo", "isso ai", "e isso", "e isso mesmo", "so isso",
+    "e so isso", "correto", "certo", "ta certo", "esta certo", "tudo certo", "exato", "exatamente",
+    "perfeito", "ok", "okay", "blz", "beleza", "fechou", "fechado", "pode fechar", "pode confirmar",
+    "confirmo", "confirma", "confirmado", "confirmar", "finalizar", "finaliza", "pode finalizar",
+    "manda ver", "manda a ver", "manda bala", "pode mandar", "manda", "mete marcha", "claro",
+    "com certeza", "positivo", "uhum", "aham", "yes", "bora", "pode ser", "isso ai mesmo",
+    "ta bom", "esta bom", "tudo bom", "ta otimo", "esta otimo", "otimo", "ta perfeito", "ta joia", "joia",
+    "ta beleza", "quero sim", "sim quero",
+)
+NO_PHRASES = (
+    "nao", "n", "nn", "errado", "ta errado", "esta errado", "incorreto", "negativo", "nada disso",
+    "nao e isso", "cancela", "cancelar", "cancelado", "nope",
+)
+MODIFY_PHRASES = (
+    "mudar", "muda", "trocar", "troca", "alterar", "altera", "adicionar", "adiciona", "acrescentar",
+    "acrescenta", "coloca", "colocar", "bota", "botar", "tirar", "tira", "remover", "remove", "retira",
+    "mais", "menos", "sem", "espera", "pera", "perai", "quero", "queria", "outro", "outra",
+    "faltou", "esqueci", "tambem",
+)
+# Palavras que confirmam quando vêm logo após uma confirmação ("sim, quero"), em vez de indicar alteração.
+AFFIRMATIVE_FOLLOWUPS = ("quero", "queria")
+# Palavras neutras que não alteram a intenção (ex.: "sim, por favor").
+FILLER_PHRASES = (
+    "por favor", "pfv", "pf", "obrigado", "obrigada", "valeu", "entao", "ai", "ja", "pode", "bom",
+    "ta", "tudo", "muito", "obg", "moco", "moca", "amigo", "amiga",
+)
+# Palavras que indicam uma pergunta, e não uma confirmação.
+QUESTION_WORDS = ("qual", "quanto", "quantos", "quanta", "quando", "como", "onde", "porque", "valor", "preco", "total")
+
+INTENT_DECISIONS = REGISTRY.counter(
+    "intent_fast_path_total",
+    "Classificações de confirmação resolvidas localmente (hit) ou encaminhadas ao LLM (miss).",
+    labelnames=("result",)
+)
+
+
+class IntentResult:
+    """Resultado da classificação local de uma resposta de confirmação."""
+    __slots__ = ("intent", "confidence")
+
+    def __init__(self, intent, confidence):
+        self.intent = intent
+        self.confidence = confidence
+
+    def __repr__(self):
+        return f"IntentResult(intent={self.intent!r}, confidence={self.confidence:.2f})"
+
+
+class ConfirmationIntentClassifier:
+    """
+    Classificador local de intenção para respostas em português a "Correto?".
+
+    Casa frases de um léxico normalizado (sem acentos) sobre os tokens da mensagem,
+    da mais longa para a mais curta, e pontua cada intenção pela fração de tokens
+    cobertos. Só decide sozinho quando a confiança é alta; caso contrário, o chamador
+    deve recorrer ao LLM.
+    """
+    def __init__(self, extra_yes_phrases=(), min_confidence=0.75):
+        """
+        Args:
+            extra_yes_phrases (iterable): Frases adicionais de confirmação (ex.: CONFIRMATION_WORDS do .env).
+            min_confidence (float): Confiança mínima para dispensar o LLM.
+        """
+        self.min_confidence = min_confidence
+        self._lexicon = {}
+        for intent, phrases in (
+            (INTENT_YES, YES_PHRASES),
+            (INTENT_YES, extra_yes_phrases),
+            (INTENT_NO, NO_PHRASES),
+            (INTENT_MODIFY, MODIFY_PHRASES),
+            (None, FILLER_PHRASES),
+        ):
+            for phrase in phrases:
+                tokens = tuple(normalize_text(phrase).split())
+                if tokens and tokens not in self._lexicon:
+                    self._lexicon[tokens] = intent
+        self._max_phrase_len = max(len(tokens) for tokens in self._lexicon)
+        logging.info(f"ConfirmationIntentClassifier inicializado com {len(self._lexicon)} frases (min_confidence={self.min_confidence}).")
+
+    def classify(self, user_input):
+        """
+        Classifica a resposta do cliente.
+
+        Returns:
+            IntentResult: Intenção (yes, no, modify ou unknown) e confiança entre 0 e 1.
+        """
+        tokens = normalize_text(user_input).split()
+        if not tokens:
+            return IntentResult(INTENT_UNKNOWN, 0.0)
+        if "?" in user_input or any(token in QUESTION_WORDS for token in tokens):
+            return IntentResult(INTENT_UNKNOWN, 0.0)
+
+        covered = {INTENT_YES: 0, INTENT_NO: 0, INTENT_MODIFY: 0, None: 0}
+        position = 0
+        previous_intent = None
+        while position < len(tokens):
+            for length in range(min(self._max_phrase_len, len(tokens) - position), 0, -1):
+                phrase = tuple(tokens[position:position + length])
+                if phrase in self._lexicon:
+                    intent = self._lexicon[phrase]
+                    if previous_intent == INTENT_YES and phrase[0] in AFFIRMATIVE_FOLLOWUPS and length == 1:
+                        intent = INTENT_YES
+                    covered[intent] += length
+                    position += length
+                    if intent is not None:
+                        previous_intent = intent
+                    break
+            else:
+                # Dígitos e palavras desconhecidas (ex.: nomes de itens) reduzem a confiança.
+                previous_intent = INTENT_UNKNOWN
+                position += 1
+
+        meaningful = len(tokens) - covered[None]
+        if meaningful == 0:
+            return IntentResult(INTENT_UNKNOWN, 0.0)
+
+        # Pedidos de alteração prevalecem: "não, tira a coca" deve ir para o fluxo de pedido.
+        if covered[INTENT_MODIFY]:
+            return IntentResult(INTENT_MODIFY, (covered[INTENT_MODIFY] + covered[INTENT_NO]) / meaningful)
+        if covered[INTENT_YES] and covered[INTENT_NO]:
+            return IntentResult(INTENT_UNKNOWN, 0.0) # Sinais contraditórios (ex.: "não está certo").
+        if covered[INTENT_YES]:
+            return IntentResult(INTENT_YES, covered[INTENT_YES] / meaningful)
+        if covered[INTENT_NO]:
+            return IntentResult(INTENT_NO, covered[INTENT_NO] / meaningful)
+        return IntentResult(INTENT_UNKNOWN, 0.0)
+
+    def decide(self, user_input):
+        """
+        Decide localmente uma confirmação, registrando se o LLM foi evitado.
+
+        Returns:
+            str | None: 'sim' ou 'não' quando a confiança é suficiente; None quando o LLM deve ser consultado.
+        """
+        result = self.classify(user_input)
+        if result.confidence >= self.min_confidence and result.intent in (INTENT_YES, INTENT_NO):
+            INTENT_DECISIONS.inc(result="hit")
+            logging.info(f"Intenção de confirmação resolvida localmente para '{user_input}': {result}")
+            return 'sim' if result.intent == INTENT_YES else 'não'
+        INTENT_DECISIONS.inc(result="miss")
+        logging.debug(f"Intenção de confirmação com baixa confiança para '{user_input}': {result}")
+        return None
@@ -0,0 +1,169 @@
+import logging
+import re
+from menu.index import get_menu_index
+from metrics.registry import REGISTRY
+from nlp.text import normalize_text
+
+# Quantidades por extenso (já normalizadas).
+NUMBER_WORDS = {
+    "um": 1, "uma": 1, "dois": 2, "duas": 2, "tres": 3, "quatro": 4, "cinco": 5, "seis": 6,
+    "sete": 7, "oito": 8, "nove": 9, "dez": 10, "onze": 11, "doze": 12, "par": 2,
+}
+DOZEN_WORDS = ("duzia", "duzias")
+MAX_ITEM_QUANTITY = 99
+
+# Frases sem significado para o pedido, removidas antes da análise (ex.: "eu quero", "por favor").
+FILLER_PHRASES = (
+    "eu quero", "quero", "eu queria", "queria", "vou querer", "gostaria de", "eu gostaria de", "me ve", "me da",
+    "me manda", "manda", "me traz", "traz", "pode ser", "pode me ver", "por favor", "pfv", "pf", "obrigado",
+    "obrigada", "ola", "oi", "bom dia", "boa tarde", "boa noite", "entao", "tambem", "so",
+)
+# Palavras que indicam alteração relativa do pedido, perguntas ou negação; nesses casos o LLM decide.
+BAIL_OUT_WORDS = (
+    "nao", "sem", "tira", "tirar", "remove", "remover", "retira", "troca", "trocar", "muda", "mudar",
+    "cancela", "cancelar", "mais", "menos", "outra", "outro", "tem", "qual", "quanto", "quais", "cardapio",
+)
+# Separadores entre itens do pedido. Nomes do cardápio que contêm um separador ("Arroz e Feijão")
+# têm prioridade: o trecho mais longo que corresponde exatamente a um item não é dividido.
+SEPARATOR_WORDS = ("e",)
+SEPARATOR_RE = re.compile(r'[,;+\n]')
+
+ORDER_PARSER_RESULTS = REGISTRY.counter(
+    "order_parser_total",
+    "Mensagens de pedido resolvidas pelo parser local (parsed) ou encaminhadas ao LLM (fallback).",
+    labelnames=("result",)
+)
+
+
+class OrderParser:
+    """
+    Parser determinístico de pedidos simples ("quero 2 coca e uma batata").
+
+    Extrai quantidades (dígitos ou por extenso, incluindo "meia dúzia") e nomes de itens
+    e os associa ao cardápio em cache por meio do MenuIndex. Retorna None sempre que houver qualquer
+    ambiguidade, para que a mensagem siga para o LLM como antes.
+    """
+    def __init__(self):
+        self._filler_phrases = sorted(
+            (tuple(normalize_text(phrase).split()) for phrase in FILLER_PHRASES), key=len, reverse=True
+        )
+
+    def parse(self, user_input, menu_data):
+        """
+        Args:
+            user_input (str): Mensagem do cliente.
+            menu_data (dict): Cardápio em cache ({lower_name: {"original_name": str, "price": Decimal}}).
+
+        Returns:
+            list | None: Lista de {'name': str, 'quantity': int, 'price': Decimal} ou None se a
+                         mensagem não for um pedido simples e inequívoco.
+        """
+        items = self._parse(user_input, menu_data)
+        ORDER_PARSER_RESULTS.inc(result="parsed" if items else "fallback")
+        if items:
+            logging.info(f"OrderParser: pedido '{user_input}' resolvido localmente: {items}")
+        return items
+
+    def _parse(self, user_input, menu_data):
+        if not menu_data or not user_input or "?" in user_input:
+            return None
+        menu_index = get_menu_index(menu_data)
+        items_by_name = {}
+        implicit_names = set() # Itens pedidos sem quantidade explícita
+        for part in SEPARATOR_RE.split(user_input):
+            tokens = normalize_text(part).split()
+            if any(token in BAIL_OUT_WORDS for token in tokens):
+                return None
+            pieces = [[]]
+            for token in self._remove_fillers(tokens):
+                if token in SEPARATOR_WORDS:
+                    pieces.append([])
+                else:
+                    pieces[-1].append(token)
+            pieces = [piece for piece in pieces if piece]
+            if not pieces:
+                continue
+            resolved = self._resolve_pieces(pieces, menu_index)
+            if resolved is None:
+                return None
+            for quantity, explicit, menu_item in resolved:
+                name = menu_item["original_name"]
+                item = items_by_name.get(name)
+                if item is None:
+                    items_by_name[name] = {"name": name, "quantity": quantity, "price": menu_item["price"]}
+                elif not explicit or name in implicit_names:
+                    return None # "coca e coca": repetição sem quantidade é ambígua
+                else:
+                    item["quantity"] += quantity
+                if not explicit:
+                    implicit_names.add(name)
+        if not items_by_name:
+            return None
+        if any(item["quantity"] > MAX_ITEM_QUANTITY for item in items_by_name.values()):
+            return None
+        return list(items_by_name.values())
+
+    def _resolve_pieces(self, pieces, menu_index):
+        """
+        Associa os trechos separados por "e" aos itens do cardápio. A partir de cada trecho, tenta
+        primeiro a junção mais longa com os seguintes que corresponda exatamente a um item
+        ("arroz" + "feijao" -> "Arroz e Feijão"); um trecho isolado usa a busca completa do MenuIndex.
+
+        Returns:
+            list | None: [(quantidade, quantidade_explícita, item)] ou None se algum trecho não for resolvido.
+        """
+        resolved = []
+        start = 0
+        while start < len(pieces):
+            quantity, explicit, name_tokens = self._split_quantity(pieces[start])
+            if quantity is None or not name_tokens:
+                return None
+            for end in range(len(pieces), start, -1):
+                name = " e ".join([" ".join(name_tokens)] + [" ".join(piece) for piece in pieces[start + 1:end]])
+                menu_item = menu_index.lookup_exact(name) if end - start > 1 else menu_index.lookup(name)
+                if menu_item is not None:
+                    resolved.append((quantity, explicit, menu_item))
+                    start = end
+                    break
+            else:
+                return None
+        return resolved
+
+    def _remove_fillers(self, tokens):
+        result = []
+        position = 0
+        while position < len(tokens):
+            for phrase in self._filler_phrases:
+                if tuple(tokens[position:position + len(phrase)]) == phrase:
+                    position += len(phrase)
+                    break
+            else:
+                result.append(tokens[position])
+                position += 1
+        return result
+
+    def _split_quantity(self, segment):
+        """
+        Separa a quantidade do nome do item em um trecho do pedido.
+        Retorna (quantidade, quantidade_explícita, tokens_do_nome); a quantidade é 1 quando omitida
+        e None se inválida.
+        """
+        if segment[0] == "meia" and len(segment) > 1 and segment[1] in DOZEN_WORDS:
+            return 6, True, segment[2:]
+        if segment[0] in DOZEN_WORDS:
+            return 12, True, segment[1:]
+
+        position = 0
+        quantity = 1
+        if segment[0].isdigit():
+            quantity = int(segment[0])
+            position = 1
+        elif segment[0] in NUMBER_WORDS:
+            quantity = NUMBER_WORDS[segment[0]]
+            position = 1
+        if position < len(segment) and segment[position] in DOZEN_WORDS:
+            quantity *= 12
+            position += 1
+        if quantity <= 0:
+            return None, False, []
+        return quantity, position > 0, segment[position:]
@@ -0,0 +1,26 @@
+import re
+import unicodedata
+
+_NON_ALNUM_RE = re.compile(r'[^a-z0-9]+')
+
+
+def fold_accents(text):
+    """Remove acentos e diacríticos (ex.: "Hambúrguer" -> "Hamburguer")."""
+    decomposed = unicodedata.normalize('NFKD', text)
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def normalize_text(text):
+    """
+    Normaliza um texto para comparações: minúsculas, sem acentos, apenas letras e
+    dígitos separados por um único espaço.
+    """
+    if not text:
+        return ""
+    return _NON_ALNUM_RE.sub(' ', fold_accents(str(text)).lower()).strip()
+
+
+def tokenize(text):
+    """Retorna os tokens do texto normalizado."""
+    normalized = normalize_text(text)
+    return normalized.split() if normalized else []
@@ -0,0 +1,97 @@
+import logging
+import re
+import secrets
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+# Ids gerados por secrets.token_urlsafe(16).
+_SID_RE = re.compile(r'^[A-Za-z0-9_-]{16,64}$')
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Sessão cujos dados ficam no servidor; o cookie carrega apenas o id."""
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.accessed = False
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """
+    SessionInterface do Flask que guarda os dados em um SessionStore e envia no
+    cookie somente um id curto. Os dados são serializados com o mesmo formato
+    das sessões por cookie do Flask.
+    """
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store, ttl_seconds=7200):
+        """
+        Args:
+            store (SessionStore): Armazenamento das sessões.
+            ttl_seconds (int): Validade de cada sessão desde o último uso.
+        """
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and _SID_RE.match(sid):
+            data = self.load_data(sid)
+            if data is not None:
+                return ServerSideSession(data, sid=sid)
+        return ServerSideSession(sid=secrets.token_urlsafe(16), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        # Sessão esvaziada: remove os dados e o cookie.
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path, secure=secure, samesite=samesite, httponly=httponly)
+                response.vary.add("Cookie")
+            return
+
+        # Os dados são regravados a cada uso para renovar a validade da sessão.
+        self.save_data(session.sid, dict(session))
+        if session.new or session.modified or app.config["SESSION_REFRESH_EACH_REQUEST"]:
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=httponly,
+                domain=domain,
+                path=path,
+                secure=secure,
+                samesite=samesite,
+            )
+            response.vary.add("Cookie")
+
+    def load_data(self, sid):
+        """Carrega e desserializa os dados da sessão; retorna None se não existir ou estiver inválida."""
+        raw_data = self.store.load(sid)
+        if raw_data is None:
+            return None
+        try:
+            return self.serializer.loads(raw_data)
+        except (ValueError, TypeError) as e:
+            logging.warning(f"Dados de sessão inválidos descartados: {e}")
+            return None
+
+    def save_data(self, sid, data):
+        """Serializa e grava os dados da sessão (também usado fora do ciclo da requisição, ex.: streaming)."""
+        self.store.save(sid, self.serializer.dumps(data), self.ttl_seconds)
@@ -0,0 +1,132 @@
+import abc
+import datetime
+import logging
+import threading
+import time
+from collections import OrderedDict
+from pymongo.errors import PyMongoError
+
+
+class SessionStore(abc.ABC):
+    """
+    Interface dos armazenamentos de sessão do lado do servidor.
+    Os dados são gravados já serializados (str), indexados pelo id curto da sessão.
+    """
+    @abc.abstractmethod
+    def load(self, sid):
+        """Retorna os dados serializados da sessão ou None se ela não existir ou tiver expirado."""
+
+    @abc.abstractmethod
+    def save(self, sid, data, ttl_seconds):
+        """Grava os dados serializados da sessão com validade de ttl_seconds."""
+
+    @abc.abstractmethod
+    def delete(self, sid):
+        """Remove a sessão."""
+
+    def ensure_indexes(self):
+        """Cria os índices do armazenamento, se houver (chamado quando o banco estiver acessível)."""
+
+
+class InMemorySessionStore(SessionStore):
+    """
+    Armazenamento em memória com política LRU e expiração por TTL.
+    Adequado para um único processo (servidor de desenvolvimento ou um worker).
+    """
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict() # {sid: (expira_em, dados)}
+        self._lock = threading.Lock()
+        logging.info(f"InMemorySessionStore inicializado com max_entries={self.max_entries}.")
+
+    def load(self, sid):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                del self._entries[sid]
+                return None
+            self._entries.move_to_end(sid)
+            return entry[1]
+
+    def save(self, sid, data, ttl_seconds):
+        now = time.monotonic()
+        with self._lock:
+            self._entries[sid] = (now + ttl_seconds, data)
+            self._entries.move_to_end(sid)
+            self._evict(now)
+
+    def delete(self, sid):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+    def _evict(self, now):
+        """Remove sessões expiradas no início da fila LRU e as menos usadas acima do limite."""
+        while self._entries:
+            oldest_sid, (expires_at, _) = next(iter(self._entries.items()))
+            if expires_at > now and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[oldest_sid]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class MongoSessionStore(SessionStore):
+    """
+    Armazenamento no MongoDB, compartilhado entre workers.
+    Um índice TTL em "expires_at" faz o próprio MongoDB remover as sessões expiradas.
+    """
+    def __init__(self, collection):
+        self.collection = collection
+        logging.info(f"MongoSessionStore inicializado na coleção '{self.collection.name}'.")
+
+    def ensure_indexes(self):
+        try:
+            self.collection.create_index("expires_at", expireAfterSeconds=0)
+        except PyMongoError as e:
+            logging.error(f"MongoSessionStore: não foi possível criar o índice TTL: {e}")
+
+    def load(self, sid):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        try:
+            document = self.collection.find_one({"_id": sid, "expires_at": {"$gt": now}}, {"data": 1})
+        except PyMongoError as e:
+            logging.error(f"MongoSessionStore: erro ao carregar a sessão: {e}")
+            return None
+        return document["data"] if document else None
+
+    def save(self, sid, data, ttl_seconds):
+        expires_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=ttl_seconds)
+        try:
+            self.collection.update_one(
+                {"_id": sid}, {"$set": {"data": data, "expires_at": expires_at}}, upsert=True
+            )
+        except PyMongoError as e:
+            logging.error(f"MongoSessionStore: erro ao gravar a sessão: {e}")
+
+    def delete(self, sid):
+        try:
+            self.collection.delete_one({"_id": sid})
+        except PyMongoError as e:
+            logging.error(f"MongoSessionStore: erro ao remover a sessão: {e}")
+
+
+def create_session_store(backend, db=None, max_entries=10000):
+    """
+    Cria o armazenamento de sessões configurado.
+
+    Args:
+        backend (str): "memory" ou "mongo".
+        db: Banco MongoDB (necessário para "mongo").
+        max_entries (int): Limite de sessões do armazenamento em memória.
+    """
+    if backend == "mongo":
+        if db is not None:
+            return MongoSessionStore(db.get_collection("chat_sessions"))
+        logging.warning("SESSION_BACKEND=mongo, mas o MongoDB não está disponível. Usando sessões em memória.")
+    elif backend != "memory":
+        logging.warning(f"SESSION_BACKEND '{backend}' desconhecido. Usando sessões em memória.")
+    return InMemorySessionStore(max_entries=max_entries)
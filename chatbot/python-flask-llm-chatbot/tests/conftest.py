@@ -0,0 +1,28 @@
+import os
+import sys
+from decimal import Decimal
+
+import pytest
+
+# A aplicação importa os módulos a partir de src (ex.: "from menu.index import ...").
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+
+def make_menu_data(prices):
+    """Cardápio no formato do MenuCache a partir de {nome: preço}."""
+    return {name.lower(): {"original_name": name, "price": Decimal(price)} for name, price in prices.items()}
+
+
+@pytest.fixture
+def menu_data():
+    return make_menu_data({
+        "X-Burguer": "20.50",
+        "X-Salada": "22.00",
+        "Batata Frita": "12.00",
+        "Coca-Cola": "7.50",
+        "Suco de Laranja": "9.00",
+        "Arroz e Feijão": "15.00",
+        "Arroz": "6.00",
+    })
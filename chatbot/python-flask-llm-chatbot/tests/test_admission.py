@@ -0,0 +1,63 @@
+import threading
+import time
+
+from llm.admission import CHAT_ADMISSION, AdmissionController, AdmissionDecision
+from llm.gateway import LLMGateway
+
+
+def test_latency_excludes_time_waiting_for_a_gateway_slot():
+    admission = AdmissionController(max_parallel=1, latency_percentile=1.0)
+    gateway = LLMGateway(max_parallel=1, max_queue=4, max_wait_seconds=5)
+
+    def upstream_call():
+        with admission.time_upstream():
+            time.sleep(0.1)
+
+    def chat_turn():
+        with admission.track(): # Como em LLMIntegration._call_ollama
+            gateway.call(None, upstream_call)
+
+    threads = [threading.Thread(target=chat_turn) for _ in range(3)]
+    try:
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        assert admission._in_flight == 3 # As chamadas na fila também contam
+        for thread in threads:
+            thread.join()
+    finally:
+        gateway.close()
+    assert 0.1 <= admission.recent_latency() < 0.18 # Sem os ~0.1-0.2s de fila
+    assert admission._in_flight == 0
+
+
+def test_estimated_wait_and_shedding():
+    admission = AdmissionController(max_parallel=2, wait_budget_seconds=1.0, latency_percentile=1.0)
+    assert admission.estimated_wait() == 0.0 # Sem amostras
+    with admission.time_upstream():
+        time.sleep(0.6)
+    with admission.track(), admission.track():
+        assert admission.admit() # 2 em andamento / 2 vagas = 1 rodada de ~0.6s
+        with admission.track(), admission.track():
+            assert 1.2 <= admission.estimated_wait() < 1.5
+            assert not admission.admit()
+
+
+def test_admission_decision_is_taken_and_counted_once():
+    admission = AdmissionController(max_parallel=1, wait_budget_seconds=1.0, latency_percentile=1.0)
+    with admission.time_upstream():
+        time.sleep(0.6)
+    admitted_before = CHAT_ADMISSION.value(result="admitted")
+    shed_before = CHAT_ADMISSION.value(result="shed")
+
+    decision = AdmissionDecision(admission)
+    assert not decision.overloaded # Nenhuma chamada em andamento
+    with admission.track(), admission.track():
+        assert not decision.overloaded # Mesmo turno: a decisão anterior vale
+        assert AdmissionDecision(admission).overloaded # 2 rodadas de ~0.6s à frente
+    assert CHAT_ADMISSION.value(result="admitted") == admitted_before + 1
+    assert CHAT_ADMISSION.value(result="shed") == shed_before + 1
+
+
+def test_admission_decision_without_controller_always_admits():
+    assert not AdmissionDecision(None).overloaded
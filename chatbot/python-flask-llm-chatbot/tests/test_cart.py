@@ -0,0 +1,60 @@
+from decimal import Decimal
+
+import pytest
+
+from chatbot.cart import Cart, cents_to_decimal, to_cents
+
+
+@pytest.mark.parametrize("price, cents", [
+    (Decimal("20.50"), 2050), ("7.5", 750), (0.1, 10), (19.99, 1999), ("0.005", 1), (3, 300),
+])
+def test_to_cents(price, cents):
+    assert to_cents(price) == cents
+
+
+def test_cents_to_decimal():
+    assert cents_to_decimal(2050) == Decimal("20.50")
+    assert str(cents_to_decimal(5)) == "0.05"
+
+
+def test_total_is_kept_in_cents():
+    cart = Cart()
+    for _ in range(3):
+        cart.set_quantity("Água", 1, price=0.1)
+        cart.set_quantity("Bala", cart.get("bala").quantity + 1 if cart.get("bala") else 1, price="0.10")
+    assert cart.total_cents == 40
+    assert cart.total == Decimal("0.40")
+
+
+def test_set_quantity_replaces_and_removes():
+    cart = Cart()
+    cart.set_quantity("X-Burguer", 2, price="20.50")
+    cart.set_quantity("Coca-Cola", 1, price="7.50")
+    cart.set_quantity("x-burguer", 1, price="20.50") # Mesmo item, nome normalizado
+    assert len(cart) == 2
+    assert cart.total == Decimal("28.00")
+    cart.remove("COCA-COLA")
+    assert [line.name for line in cart] == ["x-burguer"]
+    cart.set_quantity("x-burguer", 0)
+    assert not cart
+    assert cart.total_cents == 0
+
+
+def test_session_round_trip_and_copy():
+    cart = Cart()
+    cart.set_quantity("X-Burguer", 2, price="20.50")
+    restored = Cart.from_session(cart.to_session())
+    assert restored.to_list() == [{"name": "X-Burguer", "quantity": 2, "price": "20.50"}]
+    copy = restored.copy()
+    copy.set_quantity("Coca-Cola", 1, price="7.50")
+    assert len(restored) == 1 and restored.total == Decimal("41.00")
+    assert copy.total == Decimal("48.50")
+
+
+def test_from_session_accepts_old_format_and_skips_invalid_entries():
+    menu_data = {"coca-cola": {"original_name": "Coca-Cola", "price": Decimal("7.50")}}
+    cart = Cart.from_session(
+        [{"name": "Coca-Cola", "quantity": 2}, {"name": "Pizza"}, ["Suco", "x", 900], {"quantity": 1}],
+        menu_data
+    )
+    assert cart.to_list() == [{"name": "Coca-Cola", "quantity": 2, "price": "7.50"}]
@@ -0,0 +1,70 @@
+import threading
+import time
+
+import pytest
+
+from llm.gateway import GatewayBusyError, LLMGateway
+
+
+@pytest.fixture
+def gateway():
+    gateway = LLMGateway(max_parallel=1, max_queue=1, max_wait_seconds=5)
+    yield gateway
+    gateway.close()
+
+
+def _in_threads(*targets):
+    threads = [threading.Thread(target=target) for target in targets]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.02) # Garante a ordem de chegada
+    for thread in threads:
+        thread.join()
+
+
+def test_identical_calls_in_flight_are_coalesced(gateway):
+    calls, results = [], []
+
+    def slow_call():
+        calls.append(1)
+        time.sleep(0.2)
+        return "resposta"
+
+    _in_threads(*[lambda: results.append(gateway.call("chave", slow_call))] * 3)
+    assert results == ["resposta"] * 3
+    assert len(calls) == 1
+
+
+def test_full_queue_is_rejected(gateway):
+    release = threading.Event()
+    errors = []
+
+    def call():
+        try:
+            gateway.call(None, release.wait)
+        except GatewayBusyError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(3)] # 1 em execução, 1 na fila, 1 rejeitada
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+    assert len(errors) == 1
+    release.set()
+    for thread in threads:
+        thread.join()
+
+
+def test_wait_timeout_raises_busy():
+    gateway = LLMGateway(max_parallel=1, max_queue=4, max_wait_seconds=0.05)
+    release = threading.Event()
+    holder = threading.Thread(target=lambda: gateway.call(None, release.wait))
+    holder.start()
+    time.sleep(0.02)
+    try:
+        with pytest.raises(GatewayBusyError):
+            gateway.call(None, lambda: None)
+    finally:
+        release.set()
+        holder.join()
+        gateway.close()
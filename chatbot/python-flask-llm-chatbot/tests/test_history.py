@@ -0,0 +1,70 @@
+from chatbot.cart import Cart
+from chatbot.history import CONFIRMATION_PLACEHOLDER, LAST_CONFIRMATION_PLACEHOLDER, HistoryCompactor
+
+CONFIRMATION = (
+    "Entendido. Você pediu:\n- 2x X-Burguer (R$ 20.50 cada) = R$ 41.00\n"
+    "- 1x Coca-Cola (R$ 7.50 cada) = R$ 7.50\n\nTotal: R$ 48.50\nCorreto?"
+)
+HISTORY = [
+    {"role": "user", "content": "oi"},
+    {"role": "assistant", "content": "Olá! Em que posso ajudar? " * 5},
+    {"role": "user", "content": "quero 2 x-burguer e 1 coca"},
+    {"role": "assistant", "content": CONFIRMATION},
+    {"role": "user", "content": "na verdade tira a coca"},
+]
+
+
+def _cart():
+    cart = Cart()
+    cart.set_quantity("X-Burguer", 2, price="20.50")
+    cart.set_quantity("Coca-Cola", 1, price="7.50")
+    return cart
+
+
+def test_estimate_tokens():
+    compactor = HistoryCompactor(chars_per_token=4, message_overhead_tokens=4)
+    assert compactor.estimate_tokens("") == 4
+    assert compactor.estimate_tokens("abcde") == 6
+
+
+def test_confirmations_are_replaced_and_cart_line_is_appended():
+    compacted = HistoryCompactor(token_budget=1000).compact(HISTORY, _cart())
+    assert [entry["role"] for entry in compacted] == ["user", "assistant", "user", "assistant", "user", "system"]
+    assert compacted[3]["content"] == LAST_CONFIRMATION_PLACEHOLDER
+    assert compacted[-1]["content"] == "Carrinho atual do cliente: 2x X-Burguer, 1x Coca-Cola (total R$ 48.50)."
+    assert compacted[1] == HISTORY[1] # Mensagens comuns seguem na íntegra
+    assert HISTORY[3]["content"] == CONFIRMATION # O histórico da sessão não é alterado
+
+
+def test_only_the_last_confirmation_keeps_its_question():
+    history = HISTORY + [{"role": "assistant", "content": CONFIRMATION.replace("2x", "1x")}, {"role": "user", "content": "pode ser"}]
+    compacted = HistoryCompactor(token_budget=1000).compact(history)
+    assert [entry["content"] for entry in compacted if entry["role"] == "assistant"][1:] == [
+        CONFIRMATION_PLACEHOLDER, LAST_CONFIRMATION_PLACEHOLDER
+    ]
+    assert compacted[-2]["content"].endswith("Correto?")
+
+
+def test_user_messages_are_never_rewritten():
+    history = [{"role": "user", "content": "Você pediu: nada disso. Correto?"}]
+    assert HistoryCompactor().compact(history) == history
+
+
+def test_budget_keeps_the_most_recent_contiguous_messages():
+    compactor = HistoryCompactor(token_budget=64)
+    compacted = compactor.compact(HISTORY, _cart())
+    assert [entry["content"] for entry in compacted[:-1]] == [
+        "quero 2 x-burguer e 1 coca", LAST_CONFIRMATION_PLACEHOLDER, "na verdade tira a coca"
+    ]
+    used = sum(compactor.estimate_tokens(entry["content"]) for entry in compacted)
+    assert used <= 64
+
+
+def test_cart_line_is_kept_even_when_it_exceeds_the_budget():
+    compacted = HistoryCompactor(token_budget=10).compact(HISTORY, _cart())
+    assert [entry["role"] for entry in compacted] == ["system"]
+
+
+def test_empty_history_and_cart():
+    assert HistoryCompactor().compact([], Cart()) == []
+    assert HistoryCompactor().compact(None) == []
@@ -0,0 +1,52 @@
+from llm.integration import LLMIntegration, ModelRoute, TASK_DIALOGUE, TASK_INTENT, TASK_STRUCTURED
+from nlp.intent import ConfirmationIntentClassifier
+
+QUESTION = "Você pediu: 1x Coxinha. Total: R$ 6,50. Correto?"
+
+
+def _integration(answer):
+    integration = LLMIntegration(
+        ollama_url="http://ollama.invalid/api/generate",
+        model_name="dialogo",
+        menu_cache=None,
+        intent_classifier=ConfirmationIntentClassifier(),
+        model_routes={TASK_INTENT: ModelRoute("intencao", "30m"), TASK_STRUCTURED: ModelRoute("estruturado")}
+    )
+    integration.calls = []
+
+    def fake_call(url, payload, read_timeout):
+        integration.calls.append(payload)
+        return {"response": answer}
+
+    integration._call_ollama = fake_call
+    return integration
+
+
+def test_routes_fall_back_to_the_main_model():
+    integration = LLMIntegration(ollama_url="http://ollama.invalid/api/generate", model_name="dialogo", menu_cache=None)
+    assert {task: integration._route(task).model for task in (TASK_DIALOGUE, TASK_INTENT, TASK_STRUCTURED)} == {
+        TASK_DIALOGUE: "dialogo", TASK_INTENT: "dialogo", TASK_STRUCTURED: "dialogo"
+    }
+
+
+def test_confident_confirmation_does_not_call_the_llm():
+    integration = _integration("no")
+    assert integration.check_confirmation_intent("sim", QUESTION) == "sim"
+    assert integration.calls == []
+
+
+def test_ambiguous_confirmation_uses_the_intent_route():
+    integration = _integration("Yes.")
+    assert integration.check_confirmation_intent("acho que sim", QUESTION) == "sim"
+    assert [(payload["model"], payload["keep_alive"]) for payload in integration.calls] == [("intencao", "30m")]
+
+
+def test_local_classifier_can_be_skipped():
+    integration = _integration("no")
+    assert integration.check_confirmation_intent("sim", QUESTION, use_local_classifier=False) == "não"
+    assert len(integration.calls) == 1
+
+
+def test_unclear_llm_answer_is_not_a_confirmation():
+    integration = _integration("talvez")
+    assert integration.check_confirmation_intent("acho que sim", QUESTION) == "não"
@@ -0,0 +1,46 @@
+import pytest
+
+from nlp.intent import ConfirmationIntentClassifier, INTENT_MODIFY, INTENT_NO, INTENT_UNKNOWN, INTENT_YES
+
+
+@pytest.fixture(scope="module")
+def classifier():
+    return ConfirmationIntentClassifier()
+
+
+@pytest.mark.parametrize("user_input", [
+    "sim", "Sim!", "isso mesmo", "pode fechar", "sim, por favor", "ta bom", "tá bom", "tá ótimo",
+    "ótimo", "sim quero", "sim, quero", "quero sim", "isso, pode mandar", "beleza, obrigado",
+])
+def test_affirmatives_are_decided_locally(classifier, user_input):
+    assert classifier.classify(user_input).intent == INTENT_YES
+    assert classifier.decide(user_input) == "sim"
+
+
+@pytest.mark.parametrize("user_input", ["não", "nao", "ta errado", "não, cancela", "nada disso"])
+def test_negatives_are_decided_locally(classifier, user_input):
+    assert classifier.decide(user_input) == "não"
+
+
+@pytest.mark.parametrize("user_input", ["quero mais uma coca", "não, tira a batata", "espera, faltou o suco"])
+def test_modifications_go_to_llm(classifier, user_input):
+    assert classifier.classify(user_input).intent == INTENT_MODIFY
+    assert classifier.decide(user_input) is None
+
+
+@pytest.mark.parametrize("user_input", [
+    "sim, quero a coca", # Confirmação seguida de item: baixa confiança
+    "qual o total?",
+    "não está certo",
+    "por favor",
+    "",
+])
+def test_ambiguous_replies_go_to_llm(classifier, user_input):
+    assert classifier.decide(user_input) is None
+
+
+def test_extra_yes_phrases():
+    classifier = ConfirmationIntentClassifier(extra_yes_phrases=["demorou"])
+    assert classifier.decide("demorou") == "sim"
+    assert classifier.classify("não está certo").intent == INTENT_UNKNOWN
+    assert classifier.classify("errado").intent == INTENT_NO
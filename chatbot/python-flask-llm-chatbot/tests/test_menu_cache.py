@@ -0,0 +1,72 @@
+import queue
+import threading
+import time
+
+from pymongo.errors import OperationFailure
+
+from menu.cache import MenuCache
+from mongo.errors import CHANGE_STREAM_NOT_SUPPORTED
+
+
+class FakeChangeStream:
+    def __init__(self, changes):
+        self._changes = changes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def __iter__(self):
+        while True:
+            yield self._changes.get()
+
+
+class FakeMenuCollection:
+    def __init__(self, documents, supports_change_streams=True):
+        self.documents = documents
+        self.supports_change_streams = supports_change_streams
+        self.changes = queue.Queue()
+        self.watching = threading.Event()
+
+    def find(self, filter):
+        return [dict(document) for document in self.documents]
+
+    def watch(self, *args, **kwargs):
+        if not self.supports_change_streams:
+            raise OperationFailure("The $changeStream stage is only supported on replica sets", code=CHANGE_STREAM_NOT_SUPPORTED)
+        self.watching.set()
+        return FakeChangeStream(self.changes)
+
+
+def _wait_for_version(cache, version, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if cache.get_snapshot().version >= version:
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_change_stream_invalidates_the_cache():
+    collection = FakeMenuCollection([{"_id": 1, "name": "Coxinha", "price": 6.5}])
+    cache = MenuCache(collection, ttl_seconds=3600, retry_seconds=0.01)
+    cache.start(blocking=True)
+    assert collection.watching.wait(2)
+    assert _wait_for_version(cache, 1)
+
+    # Alteração feita por outro worker: este cache só sabe dela pelo change stream.
+    collection.documents.append({"_id": 2, "name": "Suco", "price": 7.0})
+    collection.changes.put({"operationType": "insert"})
+    assert _wait_for_version(cache, 2)
+    assert "suco" in cache.get_menu_data()
+
+
+def test_without_change_streams_the_watcher_stops():
+    collection = FakeMenuCollection([{"_id": 1, "name": "Coxinha", "price": 6.5}], supports_change_streams=False)
+    cache = MenuCache(collection, ttl_seconds=3600, retry_seconds=0.01)
+    cache.start(blocking=True)
+    cache._watcher.join(2)
+    assert not cache._watcher.is_alive()
+    assert cache.get_snapshot().version == 1
@@ -0,0 +1,54 @@
+import pytest
+
+from conftest import make_menu_data
+from menu.index import MenuIndex, bounded_edit_distance, get_menu_index
+
+
+@pytest.fixture(scope="module")
+def index():
+    return MenuIndex(make_menu_data({
+        "Hambúrguer Clássico": "25.00",
+        "Coca-Cola": "7.50",
+        "Batata (P)": "10.00",
+        "Batata (G)": "14.00",
+        "Suco de Laranja": "9.00",
+        "Arroz e Feijão": "15.00",
+    }))
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("coca-cola", "Coca-Cola"), # Chave normalizada
+    ("COCA COLA", "Coca-Cola"),
+    ("cocas", "Coca-Cola"), # Plural e prefixo
+    ("coca", "Coca-Cola"),
+    ("hamburguer classico", "Hambúrguer Clássico"), # Sem acentos
+    ("hamburger classico", "Hambúrguer Clássico"), # Erro de digitação
+    ("suco laranja", "Suco de Laranja"), # Preposição ignorada
+    ("batata (g)", "Batata (G)"),
+    ("arroz e feijao", "Arroz e Feijão"),
+])
+def test_lookup(index, query, expected):
+    assert index.lookup(query)["original_name"] == expected
+
+
+@pytest.mark.parametrize("query", ["batata", "pizza", "", "x"])
+def test_lookup_ambiguous_or_unknown(index, query):
+    assert index.lookup(query) is None
+
+
+def test_lookup_exact_skips_prefix_and_fuzzy_matches(index):
+    assert index.lookup_exact("arroz e feijão")["original_name"] == "Arroz e Feijão"
+    assert index.lookup_exact("coca") is None
+    assert index.lookup_exact("hamburger classico") is None
+
+
+def test_bounded_edit_distance():
+    assert bounded_edit_distance("coca", "coca", 1) == 0
+    assert bounded_edit_distance("hamburger", "hamburguer", 2) == 1
+    assert bounded_edit_distance("coca", "suco de laranja", 3) is None
+
+
+def test_get_menu_index_is_built_once_per_menu_version():
+    first = make_menu_data({"Coca-Cola": "7.50"})
+    assert get_menu_index(first) is get_menu_index(first)
+    assert get_menu_index(make_menu_data({"Coca-Cola": "7.50"})) is not get_menu_index(first)
@@ -0,0 +1,103 @@
+from bson.objectid import ObjectId
+from pymongo import DeleteOne, UpdateOne
+
+from menu.updates import MENU_NAME_KEY_INDEX_NAME, apply_menu_update, build_menu_operations, ensure_menu_indexes
+from nlp.text import normalize_text
+
+
+def _doc(name, price):
+    return {"_id": ObjectId(), "name": name, "price": price, "name_key": normalize_text(name)}
+
+
+def test_unchanged_menu_has_no_operations():
+    current = [_doc("Coca-Cola", 7.5), _doc("X-Burguer", 20.5)]
+    assert build_menu_operations(current, [{"name": "Coca-Cola", "price": 7.5}, {"name": "X-Burguer", "price": 20.5}]) == []
+
+
+def test_diff_updates_inserts_then_deletes_last():
+    coca, burger, suco = _doc("Coca-Cola", 7.5), _doc("X-Burguer", 20.5), _doc("Suco", 9.0)
+    operations = build_menu_operations(
+        [coca, burger, suco],
+        [{"name": "Coca-Cola", "price": 8.0}, {"name": "x-burguer", "price": 20.5}, {"name": "Batata", "price": 12.0}]
+    )
+    assert operations == [
+        UpdateOne({"_id": coca["_id"]}, {"$set": {"name": "Coca-Cola", "price": 8.0, "name_key": "coca cola"}}),
+        UpdateOne({"_id": burger["_id"]}, {"$set": {"name": "x-burguer", "price": 20.5, "name_key": "x burguer"}}), # Nome alterado
+        UpdateOne({"name_key": "batata"}, {"$set": {"name": "Batata", "price": 12.0, "name_key": "batata"}}, upsert=True),
+        DeleteOne({"_id": suco["_id"]}),
+    ]
+
+
+def test_duplicates_in_database_are_removed_and_last_new_item_wins():
+    first, duplicate = _doc("Coca-Cola", 7.5), _doc("coca-cola", 7.5)
+    operations = build_menu_operations([first, duplicate], [{"name": "Coca-Cola", "price": 7.0}, {"name": "Coca-Cola", "price": 7.5}])
+    assert operations == [DeleteOne({"_id": duplicate["_id"]})]
+
+
+def test_invalid_stored_price_is_rewritten():
+    document = _doc("Coca-Cola", "sete")
+    operations = build_menu_operations([document], [{"name": "Coca-Cola", "price": 7.5}])
+    assert operations == [UpdateOne({"_id": document["_id"]}, {"$set": {"name": "Coca-Cola", "price": 7.5, "name_key": "coca cola"}})]
+
+
+def test_inserts_upsert_on_the_normalized_name():
+    # Dois salvamentos simultâneos com grafias diferentes usam o mesmo filtro do índice único.
+    for name in ("Pão de Queijo", "pao de queijo"):
+        assert build_menu_operations([], [{"name": name, "price": 5.0}]) == [
+            UpdateOne({"name_key": "pao de queijo"}, {"$set": {"name": name, "price": 5.0, "name_key": "pao de queijo"}}, upsert=True)
+        ]
+
+
+def test_items_without_name_key_are_backfilled():
+    document = _doc("Pão de Queijo", 5.0)
+    del document["name_key"] # Item gravado antes do campo existir
+    operations = build_menu_operations([document], [{"name": "Pão de Queijo", "price": 5.0}])
+    assert operations == [
+        UpdateOne({"_id": document["_id"]}, {"$set": {"name": "Pão de Queijo", "price": 5.0, "name_key": "pao de queijo"}})
+    ]
+
+
+class _BulkResult:
+    upserted_count, modified_count, deleted_count = 1, 1, 1
+
+
+class _Collection:
+    def __init__(self, documents):
+        self.documents = documents
+        self.bulk_calls = []
+
+    def find(self, filter, projection):
+        return iter(self.documents)
+
+    def bulk_write(self, operations, ordered):
+        self.bulk_calls.append((operations, ordered))
+        return _BulkResult()
+
+
+def test_menu_index_is_unique_on_the_normalized_name():
+    calls = []
+
+    class _IndexedCollection:
+        def create_index(self, keys, **kwargs):
+            calls.append((keys, kwargs))
+
+    ensure_menu_indexes(_IndexedCollection())
+    ensure_menu_indexes(None)
+    assert len(calls) == 1
+    keys, options = calls[0]
+    assert keys == [("name_key", 1)]
+    assert options["name"] == MENU_NAME_KEY_INDEX_NAME and options["unique"] is True
+
+
+def test_apply_menu_update_uses_one_ordered_bulk_write():
+    collection = _Collection([_doc("Coca-Cola", 7.5), _doc("Suco", 9.0)])
+    result = apply_menu_update(collection, [{"name": "Coca-Cola", "price": 8.0}, {"name": "Batata", "price": 12.0}])
+    assert result.to_dict() == {"inserted": 1, "updated": 1, "removed": 1}
+    assert len(collection.bulk_calls) == 1 and collection.bulk_calls[0][1] is True
+
+
+def test_apply_menu_update_skips_bulk_write_when_nothing_changed():
+    collection = _Collection([_doc("Coca-Cola", 7.5)])
+    result = apply_menu_update(collection, [{"name": "Coca-Cola", "price": 7.5}])
+    assert not result.changed
+    assert collection.bulk_calls == []
@@ -0,0 +1,43 @@
+import pytest
+
+from nlp.order_parser import OrderParser
+
+
+def _parsed(user_input, menu_data):
+    items = OrderParser().parse(user_input, menu_data)
+    return None if items is None else sorted((item["name"], item["quantity"]) for item in items)
+
+
+@pytest.mark.parametrize("user_input, expected", [
+    ("quero 2 x-burguer e 1 coca-cola", [("Coca-Cola", 1), ("X-Burguer", 2)]),
+    ("me vê duas cocas, uma batata frita por favor", [("Batata Frita", 1), ("Coca-Cola", 2)]),
+    ("meia dúzia de x-salada", [("X-Salada", 6)]),
+    ("quero 2 coca e 1 coca", [("Coca-Cola", 3)]),
+])
+def test_simple_orders(user_input, expected, menu_data):
+    assert _parsed(user_input, menu_data) == expected
+
+
+@pytest.mark.parametrize("user_input, expected", [
+    ("quero arroz e feijão", [("Arroz e Feijão", 1)]),
+    ("2 arroz e feijão", [("Arroz e Feijão", 2)]),
+    ("quero arroz e feijão e uma coca", [("Arroz e Feijão", 1), ("Coca-Cola", 1)]),
+    ("uma coca e arroz e feijao", [("Arroz e Feijão", 1), ("Coca-Cola", 1)]),
+    ("quero arroz e uma coca", [("Arroz", 1), ("Coca-Cola", 1)]),
+])
+def test_menu_names_containing_separator(user_input, expected, menu_data):
+    assert _parsed(user_input, menu_data) == expected
+
+
+@pytest.mark.parametrize("user_input", [
+    "coca e coca", # Repetição sem quantidade
+    "coca e 2 coca",
+    "quero um x-burguer sem cebola", # Alteração
+    "tem suco de uva?", # Pergunta
+    "quero uma pizza", # Fora do cardápio
+    "quero 100 cocas", # Acima do limite
+    "por favor",
+    "",
+])
+def test_ambiguous_messages_go_to_llm(user_input, menu_data):
+    assert OrderParser().parse(user_input, menu_data) is None
@@ -0,0 +1,86 @@
+import os
+import time
+
+from bson import json_util
+from bson.objectid import ObjectId
+from pymongo.errors import AutoReconnect
+
+from kds.order_queue import OrderWriteQueue, _JSON_OPTIONS
+
+
+class _Collection:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.documents = {}
+
+    def insert_many(self, documents, ordered=True):
+        if self.fail:
+            raise AutoReconnect("banco fora do ar")
+        for document in documents:
+            self.documents[document["_id"]] = document
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_enqueued_orders_are_flushed_and_acknowledged(tmp_path):
+    collection = _Collection()
+    flushed = []
+    queue = OrderWriteQueue(collection, str(tmp_path), fsync=False, on_flushed=flushed.extend)
+    order_id = queue.enqueue({"client_name": "Ana", "items": []})
+    assert _wait_for(lambda: len(queue) == 0)
+    assert collection.documents[order_id]["client_name"] == "Ana"
+    assert [order["_id"] for order in flushed] == [order_id]
+
+
+def test_pending_orders_survive_a_database_outage(tmp_path):
+    collection = _Collection(fail=True)
+    queue = OrderWriteQueue(collection, str(tmp_path), fsync=False)
+    order_id = queue.enqueue({"client_name": "Bruno"})
+    assert not queue.flush()
+    assert len(queue) == 1
+    collection.fail = False
+    assert queue.flush()
+    assert list(collection.documents) == [order_id]
+
+
+def test_orphan_journal_is_adopted_without_acknowledged_orders(tmp_path):
+    pending_id, acked_id = ObjectId(), ObjectId()
+    orphan = tmp_path / "orders-999999999.jsonl"
+    records = [
+        {"op": "order", "doc": {"_id": acked_id, "client_name": "Carla"}},
+        {"op": "order", "doc": {"_id": pending_id, "client_name": "Davi"}},
+        {"op": "ack", "ids": [acked_id]},
+    ]
+    orphan.write_text(
+        "".join(json_util.dumps(record, json_options=_JSON_OPTIONS) + "\n" for record in records) + '{"op": "ord',
+        encoding="utf-8"
+    ) # Última linha interrompida por uma queda
+
+    collection = _Collection()
+    OrderWriteQueue(collection, str(tmp_path), fsync=False).start()
+    assert _wait_for(lambda: pending_id in collection.documents)
+    assert list(collection.documents) == [pending_id]
+    assert not orphan.exists()
+    assert os.listdir(tmp_path) == [f"orders-{os.getpid()}.jsonl"]
+
+
+def test_journal_of_a_previous_process_with_the_same_pid_is_reloaded(tmp_path):
+    pending_id = ObjectId()
+    journal = tmp_path / f"orders-{os.getpid()}.jsonl" # Reinício reaproveitando o pid (ex.: pid 1 em um contêiner)
+    journal.write_text(
+        json_util.dumps({"op": "order", "doc": {"_id": pending_id, "client_name": "Eva"}}, json_options=_JSON_OPTIONS) + "\n",
+        encoding="utf-8"
+    )
+
+    collection = _Collection(fail=True)
+    queue = OrderWriteQueue(collection, str(tmp_path), fsync=False)
+    queue.start()
+    assert len(queue) == 1
+    collection.fail = False
+    assert _wait_for(lambda: pending_id in collection.documents)
+    assert _wait_for(lambda: len(queue) == 0)
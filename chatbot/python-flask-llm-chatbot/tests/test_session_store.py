@@ -0,0 +1,47 @@
+import time
+
+import pytest
+
+from sessions.store import InMemorySessionStore, SessionStore, create_session_store
+
+
+def test_save_load_delete():
+    store = InMemorySessionStore()
+    store.save("a", '{"cart": []}', ttl_seconds=60)
+    assert store.load("a") == '{"cart": []}'
+    store.delete("a")
+    assert store.load("a") is None
+    store.delete("a") # Remover de novo não é erro
+
+
+def test_expired_sessions_are_not_returned():
+    store = InMemorySessionStore()
+    store.save("a", "dados", ttl_seconds=0.01)
+    time.sleep(0.02)
+    assert store.load("a") is None
+    assert len(store) == 0
+
+
+def test_least_recently_used_session_is_evicted():
+    store = InMemorySessionStore(max_entries=2)
+    store.save("a", "1", ttl_seconds=60)
+    store.save("b", "2", ttl_seconds=60)
+    store.load("a") # "b" passa a ser a menos usada
+    store.save("c", "3", ttl_seconds=60)
+    assert len(store) == 2
+    assert store.load("b") is None
+    assert store.load("a") == "1" and store.load("c") == "3"
+
+
+def test_factory_falls_back_to_memory():
+    assert isinstance(create_session_store("mongo", db=None), InMemorySessionStore)
+    assert isinstance(create_session_store("redis"), InMemorySessionStore)
+
+
+def test_incomplete_store_fails_when_instantiated():
+    class LoadOnlyStore(SessionStore):
+        def load(self, sid):
+            return None
+
+    with pytest.raises(TypeError):
+        LoadOnlyStore()